@@ -0,0 +1,145 @@
+"""
+Backup key Bloom filter benchmark.
+
+Builds a lambda_function.BloomFilter of --keys keys at --error-rate and
+reports the add and lookup rates, the serialized size, and the false
+positive rate measured on the same number of keys that were never added,
+next to the configured and estimated rates. Every added key must be found
+and the filter must survive a serialization round trip.
+
+Then runs backfill_handler against the local S3 stand-in over a source
+bucket of --backfill-objects objects, half of which are already in the
+backup bucket, once without and once with BLOOM_FILTER_ENABLED, and
+reports the HEAD requests each run made.
+
+Results are printed as JSON; exits non-zero if the filter misses an added
+key or the measured false positive rate exceeds twice the configured one.
+
+Usage:
+    python benchmarks/bench_bloom_filter.py [--keys 1000000] [--error-rate 0.01]
+
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+from local_aws import LocalS3, LocalSNS  # noqa: E402
+
+import lambda_function  # noqa: E402
+
+
+def object_key(n: int) -> str:
+    return f"tenant-{n % 997:03d}/2024/{n % 12 + 1:02d}/object-{n:09d}.bin"
+
+
+def measure_filter(keys: int, error_rate: float) -> dict:
+    """Build a filter of keys members and measure it."""
+    members = [object_key(n) for n in range(keys)]
+    others = [object_key(n) for n in range(keys, 2 * keys)]
+
+    bloom = lambda_function.BloomFilter(keys, error_rate)
+    started = time.perf_counter()
+    for start in range(0, keys, 1000):
+        bloom.add_many(members[start:start + 1000])
+    add_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    false_negatives = sum(1 for key in members if key not in bloom)
+    lookup_seconds = time.perf_counter() - started
+    false_positives = sum(1 for key in others if key in bloom)
+
+    restored = lambda_function.BloomFilter.from_bytes(bloom.to_bytes())
+    round_trip = restored.bits == bloom.bits and restored.count == bloom.count
+
+    return {
+        'keys': keys,
+        'bytes': len(bloom.to_bytes()),
+        'hashes': bloom.hashes,
+        'adds_per_second': round(keys / add_seconds),
+        'lookups_per_second': round(keys / lookup_seconds),
+        'configured_error_rate': error_rate,
+        'estimated_error_rate': round(bloom.estimated_error_rate(), 6),
+        'measured_error_rate': round(false_positives / keys, 6),
+        'false_negatives': false_negatives,
+        'round_trip': round_trip
+    }
+
+
+def run_backfill(objects: int, use_filter: bool) -> dict:
+    """Backfill a half-backed-up bucket and count HEAD requests."""
+    s3 = LocalS3(request_latency=0, time_scale=0)
+    lambda_function.s3_client = s3
+    lambda_function.sns_client = LocalSNS(time_scale=0)
+    lambda_function._backup_filters.clear()
+    for n in range(objects):
+        etag = f'"{n:032x}"'
+        s3.add_object('bench-source', object_key(n), 1024, etag)
+        if n % 2:
+            s3.add_object('bench-backup', object_key(n), 1024, etag)
+
+    os.environ['BLOOM_FILTER_ENABLED'] = 'true' if use_filter else 'false'
+    body = json.loads(lambda_function.backfill_handler({}, None)['body'])
+    return {
+        'bloom_filter': use_filter,
+        'copied': body['copied'],
+        'skipped': body['skipped'],
+        'head_requests': s3.calls.get('head_object', 0),
+        'list_requests': s3.calls.get('list_objects_v2', 0)
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--keys', type=int, default=1_000_000)
+    parser.add_argument('--error-rate', type=float, default=0.01)
+    parser.add_argument('--backfill-objects', type=int, default=20_000)
+    args = parser.parse_args()
+
+    os.environ.update({
+        'BACKUP_BUCKET': 'bench-backup',
+        'SOURCE_BUCKET': 'bench-source',
+        'SNS_TOPIC_ARN': 'arn:aws:sns:us-east-1:000000000000:bench',
+        'IDEMPOTENCY_ENABLED': 'false',
+        'METRICS_ENABLED': 'false',
+        # Count every HEAD the backfill needs, not just those the cache misses
+        'METADATA_CACHE_ENABLED': 'false',
+        'BLOOM_FILTER_ERROR_RATE': str(args.error_rate)
+    })
+
+    result = {'benchmark': 'bloom_filter', 'filter': measure_filter(args.keys, args.error_rate)}
+
+    # Keep filters cached by earlier runs out of the measurement
+    tempdir = tempfile.mkdtemp(prefix='bench-bloom-')
+    tempfile.tempdir = tempdir
+    try:
+        result['backfill'] = [
+            run_backfill(args.backfill_objects, use_filter)
+            for use_filter in (False, True)
+        ]
+    finally:
+        for name in os.listdir(tempdir):
+            os.remove(os.path.join(tempdir, name))
+        os.rmdir(tempdir)
+
+    measured = result['filter']
+    result['correct'] = (
+        measured['false_negatives'] == 0
+        and measured['round_trip']
+        and measured['measured_error_rate'] <= 2 * args.error_rate
+    )
+    print(json.dumps(result, indent=2))
+
+    if not result['correct']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+"""
+Cold-start benchmark.
+
+Each sample runs in a fresh Python process so nothing is cached, and
+measures:
+
+- import_ms: importing lambda_function
+- invalid_invocation_ms: a first invocation that fails configuration
+  validation, which should never import boto3
+- first_invocation_ms: a first successful invocation, including creating
+  the real boto3 clients (responses come from botocore's Stubber, so no
+  network is used)
+- warm_invocation_ms: a second invocation in the same process
+
+Medians across samples are printed as JSON. With --budget-ms the script
+exits non-zero if the median import time exceeds the budget, so it can
+run in CI to catch cold-start regressions.
+
+Usage:
+    python benchmarks/bench_cold_start.py [--samples 5] [--budget-ms 50]
+
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+REPO_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Runs inside a fresh interpreter for every sample
+SAMPLE_SCRIPT = r'''
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, sys.argv[1])
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'benchmark')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'benchmark')
+
+event = {
+    'Records': [{
+        'eventTime': '2024-01-01T00:00:00.000Z',
+        's3': {
+            'bucket': {'name': 'bench-source'},
+            'object': {'key': 'cold-start.txt', 'size': 1024}
+        }
+    }]
+}
+sample = {}
+quiet = contextlib.redirect_stdout(io.StringIO())
+
+started = time.perf_counter()
+import lambda_function
+sample['import_ms'] = (time.perf_counter() - started) * 1000
+
+os.environ.pop('BACKUP_BUCKET', None)
+os.environ.pop('SNS_TOPIC_ARN', None)
+started = time.perf_counter()
+with quiet:
+    try:
+        lambda_function.lambda_handler(event, None)
+    except ValueError:
+        pass
+sample['invalid_invocation_ms'] = (time.perf_counter() - started) * 1000
+sample['boto3_imported_by_invalid_invocation'] = 'boto3' in sys.modules
+
+os.environ.update({
+    'BACKUP_BUCKET': 'bench-backup',
+    'SNS_TOPIC_ARN': 'arn:aws:sns:us-east-1:000000000000:bench',
+    'SKIP_UNCHANGED': 'false',
+    'IDEMPOTENCY_ENABLED': 'false'
+})
+
+
+def invoke():
+    from botocore.stub import Stubber
+    s3_stub = Stubber(lambda_function.get_s3_client())
+    sns_stub = Stubber(lambda_function.get_sns_client())
+    s3_stub.add_response('head_object', {'ETag': '"cold"'})
+    s3_stub.add_response('copy_object', {'CopyObjectResult': {'ETag': '"cold"'}})
+    sns_stub.add_response('publish', {'MessageId': 'cold-start'})
+    with s3_stub, sns_stub, quiet:
+        lambda_function.lambda_handler(event, None)
+
+
+started = time.perf_counter()
+invoke()
+sample['first_invocation_ms'] = (time.perf_counter() - started) * 1000
+
+started = time.perf_counter()
+invoke()
+sample['warm_invocation_ms'] = (time.perf_counter() - started) * 1000
+
+print(json.dumps(sample))
+'''
+
+METRICS = (
+    'import_ms',
+    'invalid_invocation_ms',
+    'first_invocation_ms',
+    'warm_invocation_ms'
+)
+
+
+def run_sample() -> dict:
+    """Measure one cold start in a fresh interpreter."""
+    output = subprocess.run(
+        [sys.executable, '-c', SAMPLE_SCRIPT, REPO_ROOT],
+        check=True,
+        capture_output=True,
+        text=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--samples', type=int, default=5)
+    parser.add_argument('--budget-ms', type=float, default=None)
+    args = parser.parse_args()
+
+    samples = [run_sample() for _ in range(args.samples)]
+    result = {
+        'benchmark': 'cold_start',
+        'samples': args.samples,
+        'boto3_imported_by_invalid_invocation': any(
+            s['boto3_imported_by_invalid_invocation'] for s in samples
+        )
+    }
+    for metric in METRICS:
+        result[metric] = round(statistics.median(s[metric] for s in samples), 2)
+
+    if args.budget_ms is not None:
+        result['import_budget_ms'] = args.budget_ms
+        result['within_budget'] = result['import_ms'] <= args.budget_ms
+
+    print(json.dumps(result, indent=2))
+
+    if args.budget_ms is not None and not result['within_budget']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+"""
+External-sort diff benchmark.
+
+Generates synthetic source and backup listings of --keys objects each
+(10 million by default) in scrambled order, sorts both with
+lambda_function.external_sort and diffs them with diff_listings, the
+path inventory_handler takes for unsorted inventories. The backup is
+missing 1% of the keys and has a different size for 0.1%, and the diff
+is checked against those counts.
+
+Reports wall time, rows sorted per second, peak resident memory and the
+peak bytes spilled to disk as JSON. With --memory-mb the script exits
+non-zero if peak memory exceeds the budget, to show the diff fits in a
+Lambda function of that size. Spill files go to --spill-dir (default the
+system temporary directory, /tmp on Lambda).
+
+Usage:
+    python benchmarks/bench_external_sort.py [--keys 10000000] [--memory-mb 512]
+
+"""
+
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import lambda_function  # noqa: E402
+
+# Odd multiplier, coprime with any power of two, used to scramble order
+SCRAMBLE = 2654435761
+
+
+def synthetic_rows(count: int, backup: bool):
+    """
+    Yield count listing rows in scrambled order.
+
+    Keys look like partitioned upload paths so that prefixes are shared
+    as in real buckets. The backup variant drops every 100th object and
+    changes the size of every 1000th.
+    """
+    for i in range(count):
+        n = (i * SCRAMBLE) % count
+        if backup and n % 100 == 0:
+            continue
+        key = f"tenant-{n % 997:03d}/2024/{n % 12 + 1:02d}/{n % 28 + 1:02d}/object-{n:09d}.bin"
+        size = 1024 + n % 65536
+        if backup and n % 1000 == 1:
+            size += 1
+        yield key, size, f'"{n:032x}"'
+
+
+def directory_bytes(path: str) -> int:
+    """Return the total size of the spill files currently in path."""
+    total = 0
+    for name in os.listdir(path):
+        if name.startswith('backup-sort-'):
+            try:
+                total += os.path.getsize(os.path.join(path, name))
+            except OSError:
+                pass
+    return total
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--keys', type=int, default=10_000_000)
+    parser.add_argument('--run-entries', type=int,
+                        default=lambda_function.DEFAULT_SORT_RUN_ENTRIES)
+    parser.add_argument('--spill-dir', default=None)
+    parser.add_argument('--memory-mb', type=float, default=None)
+    args = parser.parse_args()
+
+    spill_dir = args.spill_dir or tempfile.gettempdir()
+    peak_spill = [0]
+    done = threading.Event()
+
+    def watch_spill() -> None:
+        while not done.wait(0.5):
+            peak_spill[0] = max(peak_spill[0], directory_bytes(spill_dir))
+
+    watcher = threading.Thread(target=watch_spill, daemon=True)
+    watcher.start()
+
+    started = time.perf_counter()
+    counts = {'missing': 0, 'size': 0, 'etag': 0}
+    differences = lambda_function.diff_listings(
+        lambda_function.external_sort(
+            synthetic_rows(args.keys, backup=False), args.run_entries, spill_dir
+        ),
+        lambda_function.external_sort(
+            synthetic_rows(args.keys, backup=True), args.run_entries, spill_dir
+        )
+    )
+    for _, _, _, reason in differences:
+        counts[reason] += 1
+    seconds = time.perf_counter() - started
+
+    done.set()
+    watcher.join()
+
+    # ru_maxrss is reported in kilobytes on Linux
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    expected = {
+        'missing': (args.keys + 99) // 100,
+        'size': sum(1 for n in range(1, args.keys, 1000) if n % 100),
+        'etag': 0
+    }
+
+    result = {
+        'benchmark': 'external_sort_diff',
+        'keys_per_listing': args.keys,
+        'run_entries': args.run_entries,
+        'seconds': round(seconds, 1),
+        'rows_per_second': round(2 * args.keys / seconds),
+        'peak_rss_mb': round(peak_rss_mb, 1),
+        'peak_spill_mb': round(peak_spill[0] / 1024 ** 2, 1),
+        'differences': counts,
+        'correct': counts == expected
+    }
+    if args.memory_mb is not None:
+        result['memory_budget_mb'] = args.memory_mb
+        result['within_budget'] = peak_rss_mb <= args.memory_mb
+
+    print(json.dumps(result, indent=2))
+
+    if not result['correct'] or not result.get('within_budget', True):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""
+Metadata cache benchmark.
+
+Replays --invocations invocations of --batch-size records against the
+local S3 and SNS stand-ins, every record an event for one of --hot-keys
+keys whose content changes only every --rewrite-every invocations, as
+with log rotation or regularly overwritten reports. The replay runs once
+with METADATA_CACHE_ENABLED=false and once with the cache on, and reports
+for each the HEAD, GetBucketLocation and copy requests made, the median
+record latency in simulated time, and the cache counters.
+
+Usage:
+    python benchmarks/bench_metadata_cache.py [--invocations 50] [--hot-keys 20]
+
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+from typing import Any, Dict, List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+from local_aws import LocalS3, LocalSNS, ScaledClock, percentile  # noqa: E402
+
+import lambda_function  # noqa: E402
+
+
+def hot_record(key: str, etag: str) -> Dict[str, Any]:
+    return {
+        'eventSource': 'aws:s3',
+        'eventName': 'ObjectCreated:Put',
+        's3': {
+            'bucket': {'name': 'bench-source'},
+            'object': {'key': key, 'size': 64 * 1024, 'eTag': etag}
+        }
+    }
+
+
+def run(args: argparse.Namespace, cache_enabled: bool) -> Dict[str, Any]:
+    """Replay the hot key events and count the requests they cause."""
+    s3 = LocalS3(time_scale=args.time_scale)
+    clock = ScaledClock(args.time_scale)
+    lambda_function.s3_client = s3
+    lambda_function.sns_client = LocalSNS(time_scale=args.time_scale)
+    lambda_function.time = clock
+    lambda_function._regional_s3_clients.clear()
+    lambda_function._bucket_regions = lambda_function.MetadataCache(
+        lambda_function.BUCKET_REGION_CACHE_SIZE,
+        lambda_function.BUCKET_REGION_TTL_SECONDS
+    )
+    os.environ['METADATA_CACHE_ENABLED'] = 'true' if cache_enabled else 'false'
+    # A new TTL forces get_metadata_cache to start from an empty cache
+    os.environ['METADATA_CACHE_TTL_SECONDS'] = str(300 + cache_enabled)
+
+    latencies: List[float] = []
+    lock = threading.Lock()
+
+    def collect(scope: str, timings: Dict[str, float], result: Dict[str, Any]) -> None:
+        if scope == 'record':
+            with lock:
+                latencies.append(timings['total_ms'])
+
+    keys = [f"logs/app-{n:03d}.log" for n in range(args.hot_keys)]
+    lambda_function.add_timing_hook(collect)
+    try:
+        for invocation in range(args.invocations):
+            version = invocation // args.rewrite_every
+            etag = f'"{version:032x}"'
+            records = []
+            for index in range(args.batch_size):
+                key = keys[(invocation * args.batch_size + index) % len(keys)]
+                s3.add_object('bench-source', key, 64 * 1024, etag)
+                records.append(hot_record(key, etag))
+            lambda_function.lambda_handler({'Records': records}, None)
+    finally:
+        lambda_function.remove_timing_hook(collect)
+
+    cache = lambda_function.get_metadata_cache()
+    return {
+        'metadata_cache': cache_enabled,
+        'records': args.invocations * args.batch_size,
+        'head_requests': s3.calls.get('head_object', 0),
+        'bucket_location_requests': s3.calls.get('get_bucket_location', 0),
+        'copy_requests': s3.calls.get('copy_object', 0),
+        'record_latency_ms_p50': percentile(latencies, 50),
+        'cache': cache.stats() if cache else None
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--invocations', type=int, default=50)
+    parser.add_argument('--batch-size', type=int, default=10)
+    parser.add_argument('--hot-keys', type=int, default=20)
+    parser.add_argument('--rewrite-every', type=int, default=10)
+    parser.add_argument('--time-scale', type=float, default=0.05)
+    args = parser.parse_args()
+
+    os.environ.update({
+        'BACKUP_BUCKET': 'bench-backup',
+        'SNS_TOPIC_ARN': 'arn:aws:sns:us-east-1:000000000000:bench',
+        'IDEMPOTENCY_ENABLED': 'false',
+        'METRICS_ENABLED': 'false'
+    })
+
+    print(json.dumps({
+        'benchmark': 'metadata_cache',
+        'hot_keys': args.hot_keys,
+        'results': [run(args, cache_enabled) for cache_enabled in (False, True)]
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""
+Multipart copy planner benchmark.
+
+Drives lambda_handler against the local S3 stand-in with batches of
+100 MB, 1 GB and 10 GB objects and reports the plan chosen for each copy
+together with the simulated throughput. Records in a batch are copied one
+after another so later copies can use the throughput observed by earlier
+ones. With --link-mb-per-second, all transfers share a link of that
+bandwidth, so parallel parts slow each other down and later copies should
+use fewer of them. Results are printed as JSON.
+
+Usage:
+    python benchmarks/bench_multipart.py [--objects 3] [--time-scale 0.01]
+    python benchmarks/bench_multipart.py --link-mb-per-second 200
+
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+from local_aws import LocalS3, LocalSNS, ScaledClock, MIB  # noqa: E402
+
+import lambda_function  # noqa: E402
+
+SIZES = {
+    '100MB': 100 * 1000 ** 2,
+    '1GB': 1000 ** 3,
+    '10GB': 10 * 1000 ** 3
+}
+
+
+def run_size(
+    label: str,
+    size: int,
+    objects: int,
+    time_scale: float,
+    link_bandwidth: float = None
+) -> dict:
+    """Back up a batch of equally sized objects and summarize each copy."""
+    s3 = LocalS3(time_scale=time_scale, link_bandwidth=link_bandwidth)
+    sns = LocalSNS(time_scale=time_scale)
+    lambda_function.s3_client = s3
+    lambda_function.sns_client = sns
+    lambda_function.time = ScaledClock(time_scale)
+
+    records = []
+    for index in range(objects):
+        key = f"bench/{label}/object-{index}.bin"
+        s3.add_object('bench-source', key, size)
+        records.append({
+            'eventTime': '2024-01-01T00:00:00.000Z',
+            's3': {
+                'bucket': {'name': 'bench-source'},
+                'object': {'key': key, 'size': size}
+            }
+        })
+
+    started = time.monotonic()
+    response = lambda_function.lambda_handler({'Records': records}, None)
+    simulated_seconds = (time.monotonic() - started) / time_scale
+
+    copies = []
+    for result in json.loads(response['body'])['results']:
+        plan = result.get('copy_plan') or {}
+        copies.append({
+            'method': result['copy_method'],
+            'basis': plan.get('basis'),
+            'part_size_mib': plan.get('part_size', 0) / MIB,
+            'part_count': plan.get('part_count'),
+            'concurrency': plan.get('concurrency'),
+            'seconds': plan.get('duration_seconds'),
+            'mb_per_second': round(
+                (plan.get('throughput_bytes_per_second') or 0) / 1000 ** 2, 1
+            )
+        })
+
+    return {
+        'size': label,
+        'size_bytes': size,
+        'objects': objects,
+        'simulated_seconds': round(simulated_seconds, 2),
+        'mb_per_second': round(size * objects / simulated_seconds / 1000 ** 2, 1),
+        'requests': s3.calls,
+        'copies': copies
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--objects', type=int, default=3)
+    parser.add_argument('--time-scale', type=float, default=0.01)
+    parser.add_argument('--threshold', type=int, default=64 * MIB)
+    parser.add_argument('--link-mb-per-second', type=float, default=None)
+    args = parser.parse_args()
+
+    os.environ.update({
+        'BACKUP_BUCKET': 'bench-backup',
+        'SNS_TOPIC_ARN': 'arn:aws:sns:us-east-1:000000000000:bench',
+        'COPY_CONCURRENCY': '1',
+        'MULTIPART_THRESHOLD_BYTES': str(args.threshold)
+    })
+
+    # Keep the handler's own logging out of the benchmark output
+    real_stdout = sys.stdout
+    results = []
+    for label, size in SIZES.items():
+        sys.stdout = open(os.devnull, 'w')
+        try:
+            results.append(run_size(
+                label, size, args.objects, args.time_scale,
+                args.link_mb_per_second and args.link_mb_per_second * 1000 ** 2
+            ))
+        finally:
+            sys.stdout.close()
+            sys.stdout = real_stdout
+
+    print(json.dumps({'benchmark': 'multipart_copy', 'results': results}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+"""
+State index benchmark.
+
+Records --keys objects in a SQLiteStateIndex backed by the local S3
+stand-in and times the sync that uploads them as a delta, then the
+compaction that folds the delta into the snapshot. A second index
+standing in for another container records a key and syncs while the
+first keeps recording, and a reader that loads the snapshot plus the
+outstanding deltas measures how quickly it answers "is this backed up?"
+for one key at a time and for keys in bulk. Finally a warm container
+records --delta-keys more keys and syncs, which is the upload made on the
+event path; it must not grow with the size of the index.
+
+Reports timings, rates and the snapshot and delta sizes as JSON; exits
+non-zero if any lookup gives a wrong answer.
+
+Usage:
+    python benchmarks/bench_state_index.py [--keys 1000000] [--bulk 10000]
+
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+from local_aws import LocalS3  # noqa: E402
+
+import lambda_function  # noqa: E402
+
+
+def object_key(n: int) -> str:
+    return f"tenant-{n % 997:03d}/2024/{n % 12 + 1:02d}/object-{n:09d}.bin"
+
+
+def delta_bytes(s3: LocalS3) -> int:
+    prefix = lambda_function.DEFAULT_STATE_INDEX_KEY + '.deltas/'
+    return sum(
+        obj['size'] for (bucket, key), obj in s3.objects.items()
+        if bucket == 'bench-backup' and key.startswith(prefix)
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--keys', type=int, default=1_000_000)
+    parser.add_argument('--bulk', type=int, default=10_000)
+    parser.add_argument('--lookups', type=int, default=100_000)
+    parser.add_argument('--delta-keys', type=int, default=1000)
+    args = parser.parse_args()
+
+    # No simulated latency: this measures the index, not S3
+    s3 = LocalS3(request_latency=0, time_scale=0)
+    lambda_function.s3_client = s3
+    workdir = tempfile.mkdtemp(prefix='bench-state-index-')
+
+    def open_index(name: str) -> lambda_function.SQLiteStateIndex:
+        return lambda_function.SQLiteStateIndex(
+            'bench-backup', path=os.path.join(workdir, f'{name}.db')
+        )
+
+    first = open_index('first')
+    started = time.perf_counter()
+    for n in range(args.keys):
+        first.record(object_key(n), 1024 + n % 65536, f'"{n:032x}"', f"v{n}")
+    record_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    first.sync()
+    full_sync_seconds = time.perf_counter() - started
+    full_delta_bytes = delta_bytes(s3)
+
+    started = time.perf_counter()
+    first.compact()
+    compact_seconds = time.perf_counter() - started
+
+    # Another container, and more rows from the first, not yet compacted
+    second = open_index('second')
+    second.record(object_key(args.keys), 1, None)
+    second.sync()
+    first.record(object_key(args.keys + 1), 1, None)
+    first.sync()
+
+    reader = open_index('reader')
+    started = time.perf_counter()
+    reader.refresh()
+    load_seconds = time.perf_counter() - started
+
+    # Half the probes are for keys that were never recorded
+    rng = random.Random(1)
+    probes = [rng.randrange(2 * args.keys) for _ in range(args.lookups)]
+    started = time.perf_counter()
+    single_correct = all(
+        reader.is_backed_up(object_key(n), etag=f"{n:032x}") == (n < args.keys)
+        for n in probes
+    )
+    single_seconds = time.perf_counter() - started
+
+    bulk = [object_key(rng.randrange(2 * args.keys)) for _ in range(args.bulk)]
+    started = time.perf_counter()
+    found = reader.lookup_many(bulk)
+    bulk_seconds = time.perf_counter() - started
+    bulk_correct = set(found) == {key for key in bulk if int(key[-13:-4]) < args.keys}
+
+    merge_correct = all(
+        reader.is_backed_up(object_key(n))
+        for n in (0, args.keys - 1, args.keys, args.keys + 1)
+    )
+
+    # The sync a warm container makes on the event path
+    s3.objects = {
+        name: obj for name, obj in s3.objects.items()
+        if not name[1].startswith(first.delta_prefix)
+    }
+    for n in range(args.keys + 2, args.keys + 2 + args.delta_keys):
+        first.record(object_key(n), 1, None)
+    started = time.perf_counter()
+    first.sync()
+    delta_sync_seconds = time.perf_counter() - started
+
+    snapshot = s3.objects[('bench-backup', lambda_function.DEFAULT_STATE_INDEX_KEY)]
+    result = {
+        'benchmark': 'state_index',
+        'keys': args.keys,
+        'records_per_second': round(args.keys / record_seconds),
+        'single_lookup_us': round(single_seconds / args.lookups * 1e6, 1),
+        'bulk_lookup_keys': args.bulk,
+        'bulk_lookup_ms': round(bulk_seconds * 1000, 1),
+        'bulk_keys_per_second': round(args.bulk / bulk_seconds),
+        'snapshot_mb': round(snapshot['size'] / 1024 ** 2, 1),
+        'full_delta_mb': round(full_delta_bytes / 1024 ** 2, 1),
+        'full_sync_seconds': round(full_sync_seconds, 2),
+        'compact_seconds': round(compact_seconds, 2),
+        'load_seconds': round(load_seconds, 2),
+        'delta_keys': args.delta_keys,
+        'delta_kb': round(delta_bytes(s3) / 1024, 1),
+        'delta_sync_ms': round(delta_sync_seconds * 1000, 1),
+        'correct': single_correct and bulk_correct and merge_correct
+    }
+    print(json.dumps(result, indent=2))
+
+    for name in os.listdir(workdir):
+        os.remove(os.path.join(workdir, name))
+    os.rmdir(workdir)
+
+    if not result['correct']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
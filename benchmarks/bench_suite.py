@@ -0,0 +1,220 @@
+"""
+Backup path benchmark suite.
+
+Drives lambda_handler with synthetic S3 events against the local S3 and
+SNS stand-ins and reports, for each scenario, objects/sec, bytes/sec and
+p50/p99 latency per record and per invocation. All figures are in
+simulated time, so they reflect the injected AWS latencies rather than
+the speed of the machine running the benchmark.
+
+Scenarios:
+
+- small_objects: many invocations of a single 4 KiB object
+- large_batch: invocations carrying 200 records of 256 KiB each
+- multipart: 2 GiB objects that take the multipart copy path
+- failure_storm: batches where half the source objects are missing
+
+Results are printed as JSON and can be written to a file with --output.
+Passing a previous result file as --baseline exits non-zero when any
+scenario's objects/sec or median record latency regresses by more than
+--tolerance. p99 is reported but not compared, since with a few hundred
+records it moves with thread scheduling noise.
+
+Usage:
+    python benchmarks/bench_suite.py [--scenario large_batch] [--output results.json]
+    python benchmarks/bench_suite.py --baseline results.json [--tolerance 0.25]
+
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+from typing import Any, Dict, List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+from local_aws import LocalS3, LocalSNS, ScaledClock, percentile  # noqa: E402
+
+import lambda_function  # noqa: E402
+
+KIB = 1024
+GIB = 1024 ** 3
+
+# name: (invocations, records per invocation, object size, missing fraction)
+SCENARIOS = {
+    'small_objects': (200, 1, 4 * KIB, 0.0),
+    'large_batch': (5, 200, 256 * KIB, 0.0),
+    'multipart': (1, 4, 2 * GIB, 0.0),
+    'failure_storm': (5, 100, 64 * KIB, 0.5)
+}
+
+
+def make_record(bucket: str, key: str, size: int) -> Dict[str, Any]:
+    """Build a minimal S3 ObjectCreated event record."""
+    return {
+        'eventSource': 'aws:s3',
+        'eventName': 'ObjectCreated:Put',
+        'eventTime': '2024-01-01T00:00:00.000Z',
+        's3': {
+            'bucket': {'name': bucket},
+            'object': {'key': key, 'size': size}
+        }
+    }
+
+
+def run_scenario(name: str, time_scale: float) -> Dict[str, Any]:
+    """Run one scenario against fresh stand-ins and summarize it."""
+    invocations, batch_size, size, missing = SCENARIOS[name]
+
+    s3 = LocalS3(time_scale=time_scale)
+    sns = LocalSNS(time_scale=time_scale)
+    clock = ScaledClock(time_scale)
+    lambda_function.s3_client = s3
+    lambda_function.sns_client = sns
+    lambda_function.time = clock
+
+    events = []
+    for invocation in range(invocations):
+        records = []
+        for index in range(batch_size):
+            key = f"bench/{name}/{invocation}/object-{index}.bin"
+            # Leave every n-th object out of the source bucket
+            if not missing or (index + 1) % round(1 / missing):
+                s3.add_object('bench-source', key, size)
+            records.append(make_record('bench-source', key, size))
+        events.append({'Records': records})
+
+    record_latencies: List[float] = []
+    invocation_latencies: List[float] = []
+    lock = threading.Lock()
+
+    def collect(scope: str, timings: Dict[str, float], result: Dict[str, Any]) -> None:
+        with lock:
+            if scope == 'record':
+                record_latencies.append(timings['total_ms'])
+            else:
+                invocation_latencies.append(timings['total_ms'])
+
+    lambda_function.add_timing_hook(collect)
+    results = []
+    started = clock.monotonic()
+    try:
+        for event in events:
+            try:
+                response = lambda_function.lambda_handler(event, None)
+                results.extend(json.loads(response['body'])['results'])
+            except lambda_function.BackupBatchError as e:
+                results.extend(e.results)
+    finally:
+        lambda_function.remove_timing_hook(collect)
+    seconds = clock.monotonic() - started
+
+    copied = [r for r in results if r['status'] == 'success']
+    copied_bytes = sum(r['size_bytes'] for r in copied)
+
+    return {
+        'scenario': name,
+        'invocations': invocations,
+        'records': len(results),
+        'object_size_bytes': size,
+        'succeeded': len(copied),
+        'failed': sum(1 for r in results if r['status'] == 'failed'),
+        'simulated_seconds': round(seconds, 3),
+        'objects_per_second': round(len(copied) / seconds, 1),
+        'bytes_per_second': round(copied_bytes / seconds),
+        'record_latency_ms': {
+            'p50': percentile(record_latencies, 50),
+            'p99': percentile(record_latencies, 99)
+        },
+        'invocation_latency_ms': {
+            'p50': percentile(invocation_latencies, 50),
+            'p99': percentile(invocation_latencies, 99)
+        },
+        'requests': s3.calls,
+        'notifications': len(sns.messages)
+    }
+
+
+def find_regressions(
+    results: List[Dict[str, Any]],
+    baseline: Dict[str, Any],
+    tolerance: float
+) -> List[str]:
+    """Compare results with a previous run and describe any regressions."""
+    previous = {r['scenario']: r for r in baseline['results']}
+    regressions = []
+
+    for result in results:
+        before = previous.get(result['scenario'])
+        if not before:
+            continue
+
+        rate, rate_before = result['objects_per_second'], before['objects_per_second']
+        if rate < rate_before * (1 - tolerance):
+            regressions.append(
+                f"{result['scenario']}: objects_per_second {rate_before} -> {rate}"
+            )
+        p50 = result['record_latency_ms']['p50']
+        p50_before = before['record_latency_ms']['p50']
+        if p50 > p50_before * (1 + tolerance):
+            regressions.append(
+                f"{result['scenario']}: record p50 {p50_before} ms -> {p50} ms"
+            )
+
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--scenario', choices=sorted(SCENARIOS), action='append')
+    parser.add_argument('--time-scale', type=float, default=0.05)
+    parser.add_argument('--output', default=None)
+    parser.add_argument('--baseline', default=None)
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    args = parser.parse_args()
+
+    os.environ.update({
+        'BACKUP_BUCKET': 'bench-backup',
+        'SNS_TOPIC_ARN': 'arn:aws:sns:us-east-1:000000000000:bench',
+        'IDEMPOTENCY_ENABLED': 'false',
+        'METRICS_ENABLED': 'false'
+    })
+
+    # Keep the handler's own logging out of the benchmark output
+    real_stdout = sys.stdout
+    results = []
+    for name in args.scenario or SCENARIOS:
+        sys.stdout = open(os.devnull, 'w')
+        try:
+            results.append(run_scenario(name, args.time_scale))
+        finally:
+            sys.stdout.close()
+            sys.stdout = real_stdout
+
+    report = {
+        'benchmark': 'backup_suite',
+        'time_scale': args.time_scale,
+        'results': results
+    }
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = find_regressions(results, json.load(f), args.tolerance)
+        report['regressions'] = regressions
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
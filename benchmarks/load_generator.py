@@ -0,0 +1,387 @@
+"""
+Synthetic S3 event generator and load replayer.
+
+Generates realistic S3 ObjectCreated events and replays them into
+lambda_handler at a controlled rate and concurrency against the local S3
+and SNS stand-ins, to reproduce upload bursts without AWS. Each
+concurrent worker stands in for one Lambda execution environment; they
+share the module's clients and idempotency store, as containers share
+the DynamoDB idempotency table.
+
+The generator controls:
+
+- key distribution: uniform random keys, a few hot prefixes receiving
+  most uploads (Zipf weights) or sequential date-partitioned log keys
+- size distribution: fixed, log-normal around the median, or bimodal
+  with one upload in ten about a hundred times the median
+- batch size: records per event
+- duplicate rate: fraction of records that redeliver an earlier event
+  (same sequencer), as S3 occasionally does
+- encoded key rate: fraction of keys with spaces and non-ASCII
+  characters, URL-encoded the way S3 sends them
+
+Load is described as phases of (duration, invocations per second). The
+morning_burst profile models a quiet start, a sustained spike and a
+tail-off. Results, overall and per phase, are printed as JSON in
+simulated seconds. Handler settings such as COPY_CONCURRENCY or
+NOTIFICATION_MODE are taken from the environment.
+
+Usage:
+    python benchmarks/load_generator.py --profile morning_burst
+    python benchmarks/load_generator.py --rate 20 --duration 30 --concurrency 10 \\
+        --batch-size 5 --duplicate-rate 0.05 --encoded-key-rate 0.1
+    python benchmarks/load_generator.py --profile morning_burst --dump-events events.jsonl
+
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import quote_plus
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+from local_aws import LocalS3, LocalSNS, ScaledClock, percentile  # noqa: E402
+
+import lambda_function  # noqa: E402
+
+KIB = 1024
+MAX_OBJECT_SIZE = 5 * 1024 ** 4
+
+KEY_DISTRIBUTIONS = ('uniform', 'hot_prefix', 'sequential')
+SIZE_DISTRIBUTIONS = ('fixed', 'lognormal', 'bimodal')
+
+# Named load profiles: generator settings plus (seconds, rate) phases
+PROFILES = {
+    'morning_burst': {
+        'phases': [(30, 2.0), (60, 15.0), (30, 4.0)],
+        'concurrency': 50,
+        'batch_size': 10,
+        'key_distribution': 'hot_prefix',
+        'size_distribution': 'bimodal',
+        'median_size': 256 * KIB,
+        'duplicate_rate': 0.02,
+        'encoded_key_rate': 0.05
+    }
+}
+
+
+class EventGenerator:
+    """
+    Produce S3 event payloads with configurable keys, sizes and duplicates.
+
+    Every new object is also recorded in objects so it can be created in
+    the source bucket before the events are replayed.
+
+    Args:
+        bucket: Source bucket named in the events
+        key_distribution: One of KEY_DISTRIBUTIONS
+        size_distribution: One of SIZE_DISTRIBUTIONS
+        median_size: Median object size in bytes
+        batch_size: Records per event
+        duplicate_rate: Fraction of records that redeliver an earlier event
+        encoded_key_rate: Fraction of keys needing URL encoding
+        prefixes: Number of distinct prefixes for hot_prefix keys
+        seed: Random seed, for reproducible runs
+    """
+
+    def __init__(
+        self,
+        bucket: str = 'bench-source',
+        key_distribution: str = 'hot_prefix',
+        size_distribution: str = 'lognormal',
+        median_size: int = 256 * KIB,
+        batch_size: int = 1,
+        duplicate_rate: float = 0.0,
+        encoded_key_rate: float = 0.0,
+        prefixes: int = 100,
+        seed: Optional[int] = None
+    ):
+        if key_distribution not in KEY_DISTRIBUTIONS:
+            raise ValueError(f"Unknown key distribution {key_distribution!r}")
+        if size_distribution not in SIZE_DISTRIBUTIONS:
+            raise ValueError(f"Unknown size distribution {size_distribution!r}")
+
+        self.bucket = bucket
+        self.key_distribution = key_distribution
+        self.size_distribution = size_distribution
+        self.median_size = median_size
+        self.batch_size = batch_size
+        self.duplicate_rate = duplicate_rate
+        self.encoded_key_rate = encoded_key_rate
+        self.random = random.Random(seed)
+        self.prefixes = [f"tenant-{i:03d}" for i in range(prefixes)]
+        self.prefix_weights = [1 / (i + 1) for i in range(prefixes)]
+        self.objects: List[Tuple[str, str, int]] = []
+        self.sent: List[Dict[str, Any]] = []
+        self._count = 0
+
+    def _key(self) -> str:
+        n = self._count
+        if self.key_distribution == 'uniform':
+            key = f"data/{self.random.getrandbits(64):016x}.bin"
+        elif self.key_distribution == 'hot_prefix':
+            prefix = self.random.choices(self.prefixes, self.prefix_weights)[0]
+            key = f"{prefix}/uploads/object-{n:08d}.bin"
+        else:
+            hour, minute = divmod(n // 60, 60)
+            key = f"logs/2024/01/01/{hour % 24:02d}/{minute:02d}/event-{n:08d}.json"
+
+        if self.random.random() < self.encoded_key_rate:
+            directory, _, name = key.rpartition('/')
+            key = f"{directory}/Quarterly Report ({n}) – résumé+final {name}"
+        return key
+
+    def _size(self) -> int:
+        if self.size_distribution == 'fixed':
+            size = self.median_size
+        elif self.size_distribution == 'lognormal':
+            size = self.random.lognormvariate(math.log(self.median_size), 1.0)
+        else:
+            median = self.median_size * (100 if self.random.random() < 0.1 else 1)
+            size = self.random.lognormvariate(math.log(median), 0.5)
+        return max(1, min(int(size), MAX_OBJECT_SIZE))
+
+    def _record(self) -> Dict[str, Any]:
+        if self.sent and self.random.random() < self.duplicate_rate:
+            return self.random.choice(self.sent)
+
+        key, size = self._key(), self._size()
+        self._count += 1
+        self.objects.append((self.bucket, key, size))
+        record = {
+            'eventVersion': '2.1',
+            'eventSource': 'aws:s3',
+            'awsRegion': 'us-east-1',
+            'eventTime': '2024-01-01T08:00:00.000Z',
+            'eventName': 'ObjectCreated:Put',
+            's3': {
+                'bucket': {'name': self.bucket},
+                'object': {
+                    'key': quote_plus(key, safe='/'),
+                    'size': size,
+                    'sequencer': f"{self._count:016X}"
+                }
+            }
+        }
+        self.sent.append(record)
+        return record
+
+    def event(self) -> Dict[str, Any]:
+        """Return the next event, carrying batch_size records."""
+        return {'Records': [self._record() for _ in range(self.batch_size)]}
+
+
+def schedule(phases: List[Tuple[float, float]]) -> List[Tuple[int, float]]:
+    """
+    Expand (seconds, rate) phases into evenly spaced invocation start times.
+
+    Returns:
+        list: (phase index, start time in simulated seconds) pairs
+    """
+    starts = []
+    phase_start = 0.0
+    for index, (seconds, rate) in enumerate(phases):
+        count = int(seconds * rate)
+        starts.extend((index, phase_start + i / rate) for i in range(count))
+        phase_start += seconds
+    return starts
+
+
+def summarize(runs: List[Dict[str, Any]], seconds: float) -> Dict[str, Any]:
+    """Aggregate the per-invocation measurements of a replay."""
+    statuses: Dict[str, int] = {}
+    copied_bytes = 0
+    for run in runs:
+        for result in run['results']:
+            statuses[result['status']] = statuses.get(result['status'], 0) + 1
+            if result['status'] == 'success':
+                copied_bytes += result['size_bytes']
+
+    latencies = [run['latency_ms'] for run in runs]
+    delays = [run['queue_delay_ms'] for run in runs]
+    return {
+        'invocations': len(runs),
+        'invocations_per_second': round(len(runs) / seconds, 2) if seconds else None,
+        'records': sum(statuses.values()),
+        'statuses': statuses,
+        'objects_per_second': round(statuses.get('success', 0) / seconds, 1) if seconds else None,
+        'bytes_per_second': round(copied_bytes / seconds) if seconds else None,
+        'invocation_latency_ms': {
+            'p50': percentile(latencies, 50),
+            'p99': percentile(latencies, 99)
+        },
+        'queue_delay_ms': {
+            'p50': percentile(delays, 50),
+            'p99': percentile(delays, 99)
+        }
+    }
+
+
+def replay(
+    events: List[Dict[str, Any]],
+    starts: List[Tuple[int, float]],
+    phase_seconds: List[float],
+    concurrency: int,
+    clock: ScaledClock
+) -> Dict[str, Any]:
+    """
+    Invoke lambda_handler with each event at its scheduled start time.
+
+    An invocation waits in the queue when all workers are busy, as events
+    do when Lambda reaches its concurrency limit; that wait is reported
+    separately from handler latency.
+
+    Args:
+        events: Events to deliver, one per start time
+        starts: (phase index, start time) pairs from schedule
+        phase_seconds: Scheduled length of each phase
+        concurrency: Maximum invocations in flight
+        clock: Simulated clock shared with the handler
+
+    Returns:
+        dict: Overall summary, per-phase summaries and peak concurrency
+    """
+    runs: List[Dict[str, Any]] = []
+    lock = threading.Lock()
+    in_flight = [0, 0]  # current, peak
+    origin = clock.monotonic()
+
+    def invoke(event: Dict[str, Any], phase: int, start: float) -> None:
+        started = clock.monotonic()
+        with lock:
+            in_flight[0] += 1
+            in_flight[1] = max(in_flight[1], in_flight[0])
+        try:
+            response = lambda_function.lambda_handler(event, None)
+            results = json.loads(response['body'])['results']
+        except lambda_function.BackupBatchError as e:
+            results = e.results
+        finished = clock.monotonic()
+        with lock:
+            in_flight[0] -= 1
+            runs.append({
+                'phase': phase,
+                'results': results,
+                'latency_ms': round((finished - started) * 1000, 1),
+                'queue_delay_ms': round((started - origin - start) * 1000, 1)
+            })
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for event, (phase, start) in zip(events, starts):
+            delay = start - (clock.monotonic() - origin)
+            if delay > 0:
+                clock.sleep(delay)
+            executor.submit(invoke, event, phase, start)
+    seconds = clock.monotonic() - origin
+
+    return {
+        'simulated_seconds': round(seconds, 2),
+        'peak_concurrency': in_flight[1],
+        'overall': summarize(runs, seconds),
+        'phases': [
+            summarize([run for run in runs if run['phase'] == phase], length)
+            for phase, length in enumerate(phase_seconds)
+        ]
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--profile', choices=sorted(PROFILES), default=None)
+    parser.add_argument('--rate', type=float, default=10.0,
+                        help='invocations per simulated second')
+    parser.add_argument('--duration', type=float, default=30.0,
+                        help='simulated seconds of load')
+    parser.add_argument('--concurrency', type=int, default=None)
+    parser.add_argument('--batch-size', type=int, default=None)
+    parser.add_argument('--key-distribution', choices=KEY_DISTRIBUTIONS, default=None)
+    parser.add_argument('--size-distribution', choices=SIZE_DISTRIBUTIONS, default=None)
+    parser.add_argument('--median-size', type=int, default=None)
+    parser.add_argument('--duplicate-rate', type=float, default=None)
+    parser.add_argument('--encoded-key-rate', type=float, default=None)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--time-scale', type=float, default=0.01)
+    parser.add_argument('--dump-events', default=None,
+                        help='write the events as JSON lines instead of replaying them')
+    args = parser.parse_args()
+
+    config = dict(PROFILES[args.profile]) if args.profile else {
+        'phases': [(args.duration, args.rate)],
+        'concurrency': 10,
+        'batch_size': 1,
+        'key_distribution': 'hot_prefix',
+        'size_distribution': 'lognormal',
+        'median_size': 256 * KIB,
+        'duplicate_rate': 0.0,
+        'encoded_key_rate': 0.0
+    }
+    for name in config:
+        if getattr(args, name, None) is not None:
+            config[name] = getattr(args, name)
+
+    generator = EventGenerator(
+        key_distribution=config['key_distribution'],
+        size_distribution=config['size_distribution'],
+        median_size=config['median_size'],
+        batch_size=config['batch_size'],
+        duplicate_rate=config['duplicate_rate'],
+        encoded_key_rate=config['encoded_key_rate'],
+        seed=args.seed
+    )
+    starts = schedule(config['phases'])
+    events = [generator.event() for _ in starts]
+
+    if args.dump_events:
+        with open(args.dump_events, 'w') as f:
+            for event in events:
+                f.write(json.dumps(event) + '\n')
+        print(json.dumps({'events': len(events), 'path': args.dump_events}))
+        return
+
+    os.environ.setdefault('BACKUP_BUCKET', 'bench-backup')
+    os.environ.setdefault('SNS_TOPIC_ARN', 'arn:aws:sns:us-east-1:000000000000:bench')
+    os.environ.setdefault('METRICS_ENABLED', 'false')
+
+    s3 = LocalS3(time_scale=args.time_scale)
+    clock = ScaledClock(args.time_scale)
+    lambda_function.s3_client = s3
+    lambda_function.sns_client = LocalSNS(time_scale=args.time_scale)
+    lambda_function.time = clock
+    for bucket, key, size in generator.objects:
+        s3.add_object(bucket, key, size)
+
+    # Keep the handler's own logging out of the benchmark output
+    real_stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        result = replay(
+            events,
+            starts,
+            [seconds for seconds, _ in config['phases']],
+            config['concurrency'],
+            clock
+        )
+    finally:
+        sys.stdout.close()
+        sys.stdout = real_stdout
+
+    print(json.dumps({
+        'benchmark': 'load_replay',
+        'profile': args.profile,
+        'config': config,
+        'time_scale': args.time_scale,
+        'requests': s3.calls,
+        **result
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
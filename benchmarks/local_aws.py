@@ -0,0 +1,503 @@
+"""
+Local S3, SNS and DynamoDB stand-ins for benchmarking the backup Lambda.
+
+These classes implement the subset of the boto3 client APIs used by
+lambda_function.py, keep state in memory, and sleep to imitate request
+latency and per-request bandwidth. Sleeps are multiplied by a
+time scale so that multi-gigabyte copies can be simulated in well under a
+second; reported timings are converted back to simulated seconds.
+
+"""
+
+import hashlib
+import io
+import threading
+import time
+import uuid
+from types import SimpleNamespace
+from typing import Dict, Any, List, Optional, Tuple
+
+from botocore.exceptions import ClientError
+
+MIB = 1024 ** 2
+
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    """Return the p-th percentile of values (nearest rank), or None if empty."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * p // 100))
+    return ordered[int(rank) - 1]
+
+
+class ScaledClock:
+    """
+    Drop-in for the time module that reports simulated seconds.
+
+    Assign an instance to lambda_function.time so that durations measured
+    inside the handler (and decisions based on them) match the simulated
+    latencies rather than the scaled-down wall clock.
+    """
+
+    def __init__(self, time_scale: float):
+        self.time_scale = time_scale
+
+    def monotonic(self) -> float:
+        return time.monotonic() / self.time_scale
+
+    def perf_counter(self) -> float:
+        return time.perf_counter() / self.time_scale
+
+    def time(self) -> float:
+        return time.time()
+
+    def sleep(self, seconds: float) -> None:
+        time.sleep(seconds * self.time_scale)
+
+
+class LocalS3:
+    """
+    In-memory S3 client with injected latency.
+
+    All buckets report the client's own region, so the handler uses this
+    client for every bucket.
+
+    Args:
+        request_latency: Fixed overhead of every request, in seconds
+        bandwidth: Bytes per second a single copy request can move
+        time_scale: Factor applied to every simulated sleep
+        region_name: Region reported by the client and its buckets
+        link_bandwidth: Bytes per second shared by all requests in
+            flight, or None for no shared limit
+    """
+
+    def __init__(
+        self,
+        request_latency: float = 0.03,
+        bandwidth: float = 80 * MIB,
+        time_scale: float = 0.01,
+        region_name: str = 'us-east-1',
+        link_bandwidth: Optional[float] = None
+    ):
+        self.meta = SimpleNamespace(region_name=region_name)
+        self.request_latency = request_latency
+        self.bandwidth = bandwidth
+        self.time_scale = time_scale
+        self.link_bandwidth = link_bandwidth
+        self._transfers = 0
+        self.objects: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self.uploads: Dict[str, Dict[str, Any]] = {}
+        self.calls: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def _simulate(self, operation: str, size: int = 0) -> None:
+        with self._lock:
+            self.calls[operation] = self.calls.get(operation, 0) + 1
+            if size:
+                self._transfers += 1
+            transfers = self._transfers
+        bandwidth = self.bandwidth
+        if size and self.link_bandwidth:
+            # The link is shared evenly by the transfers running at the start
+            bandwidth = min(bandwidth, self.link_bandwidth / transfers)
+        try:
+            time.sleep((self.request_latency + size / bandwidth) * self.time_scale)
+        finally:
+            if size:
+                with self._lock:
+                    self._transfers -= 1
+
+    def _get(self, bucket: str, key: str) -> Dict[str, Any]:
+        try:
+            return self.objects[(bucket, key)]
+        except KeyError:
+            raise ClientError(
+                {'Error': {'Code': '404', 'Message': 'Not Found'}},
+                'HeadObject'
+            )
+
+    def add_object(
+        self,
+        bucket: str,
+        key: str,
+        size: int,
+        etag: str = None,
+        **extra: Any
+    ) -> None:
+        """Create an object directly, without simulated latency."""
+        self.objects[(bucket, key)] = {
+            'size': size,
+            'etag': etag or f'"{hashlib.md5(f"{bucket}/{key}/{size}".encode()).hexdigest()}"',
+            **extra
+        }
+
+    def _check_source_match(self, source: Dict[str, Any], if_match: Optional[str]) -> None:
+        if if_match and source['etag'] != if_match:
+            raise ClientError(
+                {'Error': {'Code': 'PreconditionFailed', 'Message': 'Precondition Failed'}},
+                'UploadPartCopy'
+            )
+
+    def get_bucket_location(self, Bucket: str, **kwargs: Any) -> Dict[str, Any]:
+        self._simulate('get_bucket_location')
+        region = self.meta.region_name
+        return {'LocationConstraint': None if region == 'us-east-1' else region}
+
+    def list_objects_v2(
+        self,
+        Bucket: str,
+        Prefix: str = '',
+        Delimiter: str = '',
+        MaxKeys: int = 1000,
+        ContinuationToken: str = None,
+        StartAfter: str = '',
+        **kwargs: Any
+    ) -> Dict[str, Any]:
+        self._simulate('list_objects_v2')
+        # Continuation tokens are simply the last key of the previous page
+        after = ContinuationToken or StartAfter
+        with self._lock:
+            keys = sorted(
+                key for bucket, key in self.objects
+                if bucket == Bucket and key.startswith(Prefix) and key > after
+            )
+        contents, common_prefixes = [], []
+        last = None
+        for key in keys:
+            if len(contents) + len(common_prefixes) >= MaxKeys:
+                break
+            if Delimiter and Delimiter in key[len(Prefix):]:
+                common = key[:key.index(Delimiter, len(Prefix)) + len(Delimiter)]
+                if not common_prefixes or common_prefixes[-1] != common:
+                    common_prefixes.append(common)
+            else:
+                obj = self.objects[(Bucket, key)]
+                contents.append({'Key': key, 'Size': obj['size'], 'ETag': obj['etag']})
+            last = key
+        # A common prefix must not be split across pages
+        if common_prefixes and last is not None and last.startswith(common_prefixes[-1]):
+            last = common_prefixes[-1] + '\U0010ffff'
+        truncated = last is not None and any(key > last for key in keys)
+        response = {
+            'Contents': contents,
+            'CommonPrefixes': [{'Prefix': p} for p in common_prefixes],
+            'KeyCount': len(contents) + len(common_prefixes),
+            'IsTruncated': truncated
+        }
+        if truncated:
+            response['NextContinuationToken'] = last
+        return response
+
+    def get_object(self, Bucket: str, Key: str, **kwargs: Any) -> Dict[str, Any]:
+        self._simulate('get_object')
+        obj = self._get(Bucket, Key)
+        return {
+            'ContentLength': obj['size'],
+            'ETag': obj['etag'],
+            'Body': io.BytesIO(obj.get('body', b''))
+        }
+
+    def put_object(
+        self,
+        Bucket: str,
+        Key: str,
+        Body: Any = b'',
+        IfMatch: str = None,
+        IfNoneMatch: str = None,
+        **kwargs: Any
+    ) -> Dict[str, Any]:
+        if hasattr(Body, 'read'):
+            Body = Body.read()
+        self._simulate('put_object', len(Body))
+        etag = f'"{hashlib.md5(Body).hexdigest()}"'
+        with self._lock:
+            current = self.objects.get((Bucket, Key))
+            if (IfNoneMatch == '*' and current) or (
+                IfMatch and (not current or current['etag'] != IfMatch)
+            ):
+                raise ClientError(
+                    {'Error': {'Code': 'PreconditionFailed', 'Message': 'Precondition Failed'}},
+                    'PutObject'
+                )
+            self.objects[(Bucket, Key)] = {'size': len(Body), 'etag': etag, 'body': Body}
+        return {'ETag': etag}
+
+    def head_object(self, Bucket: str, Key: str, **kwargs: Any) -> Dict[str, Any]:
+        self._simulate('head_object')
+        obj = self._get(Bucket, Key)
+        return {
+            'ContentLength': obj['size'],
+            'ETag': obj['etag'],
+            'ContentType': obj.get('content_type', 'binary/octet-stream'),
+            'Metadata': obj.get('metadata', {})
+        }
+
+    def copy_object(
+        self,
+        CopySource: Dict[str, str],
+        Bucket: str,
+        Key: str,
+        **kwargs: Any
+    ) -> Dict[str, Any]:
+        source = self._get(CopySource['Bucket'], CopySource['Key'])
+        if source['size'] > 5 * 1024 ** 3:
+            raise ValueError("The specified copy source is larger than 5 GB")
+        self._check_source_match(source, kwargs.get('CopySourceIfMatch'))
+        self._simulate('copy_object', source['size'])
+        copy = dict(source)
+        if kwargs.get('MetadataDirective') == 'REPLACE':
+            copy['metadata'] = kwargs.get('Metadata', {})
+        self.objects[(Bucket, Key)] = copy
+        return {'CopyObjectResult': {'ETag': source['etag']}}
+
+    def delete_object(self, Bucket: str, Key: str, **kwargs: Any) -> Dict[str, Any]:
+        self._simulate('delete_object')
+        with self._lock:
+            self.objects.pop((Bucket, Key), None)
+        return {}
+
+    def delete_objects(
+        self,
+        Bucket: str,
+        Delete: Dict[str, Any],
+        **kwargs: Any
+    ) -> Dict[str, Any]:
+        self._simulate('delete_objects')
+        with self._lock:
+            for obj in Delete['Objects']:
+                self.objects.pop((Bucket, obj['Key']), None)
+        return {'Deleted': [{'Key': obj['Key']} for obj in Delete['Objects']]}
+
+    def create_multipart_upload(
+        self,
+        Bucket: str,
+        Key: str,
+        **kwargs: Any
+    ) -> Dict[str, Any]:
+        self._simulate('create_multipart_upload')
+        upload_id = uuid.uuid4().hex
+        with self._lock:
+            self.uploads[upload_id] = {
+                'bucket': Bucket,
+                'key': Key,
+                'metadata': kwargs.get('Metadata', {}),
+                'parts': {}
+            }
+        return {'UploadId': upload_id}
+
+    def upload_part_copy(
+        self,
+        Bucket: str,
+        Key: str,
+        CopySource: Dict[str, str],
+        CopySourceRange: str,
+        PartNumber: int,
+        UploadId: str,
+        **kwargs: Any
+    ) -> Dict[str, Any]:
+        source = self._get(CopySource['Bucket'], CopySource['Key'])
+        self._check_source_match(source, kwargs.get('CopySourceIfMatch'))
+        start, end = (int(n) for n in CopySourceRange[len('bytes='):].split('-'))
+        size = end - start + 1
+        self._simulate('upload_part_copy', size)
+        etag = f'"{hashlib.md5(f"{UploadId}/{PartNumber}".encode()).hexdigest()}"'
+        with self._lock:
+            self.uploads[UploadId]['parts'][PartNumber] = size
+        return {'CopyPartResult': {'ETag': etag}}
+
+    def complete_multipart_upload(
+        self,
+        Bucket: str,
+        Key: str,
+        UploadId: str,
+        MultipartUpload: Dict[str, List[Dict[str, Any]]],
+        **kwargs: Any
+    ) -> Dict[str, Any]:
+        self._simulate('complete_multipart_upload')
+        with self._lock:
+            upload = self.uploads.pop(UploadId)
+        parts = MultipartUpload['Parts']
+        etag = f'"{hashlib.md5(UploadId.encode()).hexdigest()}-{len(parts)}"'
+        self.objects[(Bucket, Key)] = {
+            'size': sum(upload['parts'].values()),
+            'etag': etag,
+            'metadata': upload['metadata']
+        }
+        return {'ETag': etag}
+
+    def abort_multipart_upload(
+        self,
+        Bucket: str,
+        Key: str,
+        UploadId: str,
+        **kwargs: Any
+    ) -> Dict[str, Any]:
+        self._simulate('abort_multipart_upload')
+        with self._lock:
+            self.uploads.pop(UploadId, None)
+        return {}
+
+
+class LocalSNS:
+    """
+    In-memory SNS client with injected latency.
+
+    Args:
+        request_latency: Fixed overhead of every request, in seconds
+        time_scale: Factor applied to every simulated sleep
+    """
+
+    def __init__(self, request_latency: float = 0.05, time_scale: float = 0.01):
+        self.request_latency = request_latency
+        self.time_scale = time_scale
+        self.messages: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def publish(self, TopicArn: str, Message: str, **kwargs: Any) -> Dict[str, Any]:
+        time.sleep(self.request_latency * self.time_scale)
+        with self._lock:
+            self.messages.append({'TopicArn': TopicArn, 'Message': Message, **kwargs})
+        return {'MessageId': uuid.uuid4().hex}
+
+    def publish_batch(
+        self,
+        TopicArn: str,
+        PublishBatchRequestEntries: List[Dict[str, Any]],
+        **kwargs: Any
+    ) -> Dict[str, Any]:
+        time.sleep(self.request_latency * self.time_scale)
+        successful = []
+        with self._lock:
+            for entry in PublishBatchRequestEntries:
+                self.messages.append({'TopicArn': TopicArn, **entry})
+                successful.append({'Id': entry['Id'], 'MessageId': uuid.uuid4().hex})
+        return {'Successful': successful, 'Failed': []}
+
+
+class LocalDynamoDB:
+    """
+    In-memory DynamoDB client supporting get_item, put_item and delete_item.
+
+    Items are keyed by the string value of the first attribute in Key,
+    which is enough for single-attribute partition key tables such as the
+    idempotency table. ConditionExpression supports attribute_exists,
+    attribute_not_exists and comparisons, combined with AND, OR and
+    parentheses.
+
+    Args:
+        request_latency: Fixed overhead of every request, in seconds
+        time_scale: Factor applied to every simulated sleep
+    """
+
+    def __init__(self, request_latency: float = 0.005, time_scale: float = 0.01):
+        self.request_latency = request_latency
+        self.time_scale = time_scale
+        self.tables: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(item: Dict[str, Dict[str, str]]) -> str:
+        name, value = next(iter(item.items()))
+        return f"{name}={next(iter(value.values()))}"
+
+    @staticmethod
+    def _split(expression: str, operator: str) -> List[str]:
+        """Split on operator outside parentheses."""
+        parts, depth, start = [], 0, 0
+        token = f" {operator} "
+        index = 0
+        while index < len(expression):
+            char = expression[index]
+            depth += (char == '(') - (char == ')')
+            if depth == 0 and expression.startswith(token, index):
+                parts.append(expression[start:index])
+                index += len(token)
+                start = index
+                continue
+            index += 1
+        parts.append(expression[start:])
+        return parts
+
+    @classmethod
+    def _matches(
+        cls,
+        item: Optional[Dict[str, Any]],
+        expression: Optional[str],
+        names: Dict[str, str],
+        values: Dict[str, Dict[str, str]]
+    ) -> bool:
+        if not expression:
+            return True
+        item = item or {}
+        expression = expression.strip()
+
+        clauses = cls._split(expression, 'OR')
+        if len(clauses) > 1:
+            return any(cls._matches(item, c, names, values) for c in clauses)
+        clauses = cls._split(expression, 'AND')
+        if len(clauses) > 1:
+            return all(cls._matches(item, c, names, values) for c in clauses)
+        if expression.startswith('(') and expression.endswith(')'):
+            return cls._matches(item, expression[1:-1], names, values)
+
+        def typed(value: Dict[str, str]) -> Any:
+            kind, raw = next(iter(value.items()))
+            return float(raw) if kind == 'N' else raw
+
+        if expression.startswith(('attribute_exists(', 'attribute_not_exists(')):
+            function, name = expression[:-1].split('(')
+            present = names.get(name, name) in item
+            return present == (function == 'attribute_exists')
+        name, operator, placeholder = expression.split()
+        current = item.get(names.get(name, name))
+        if current is None:
+            return False
+        left, right = typed(current), typed(values[placeholder])
+        return {
+            '=': left == right, '<>': left != right,
+            '<': left < right, '<=': left <= right,
+            '>': left > right, '>=': left >= right
+        }[operator]
+
+    def _check(
+        self,
+        operation: str,
+        item: Optional[Dict[str, Any]],
+        kwargs: Dict[str, Any]
+    ) -> None:
+        if not self._matches(
+            item,
+            kwargs.get('ConditionExpression'),
+            kwargs.get('ExpressionAttributeNames', {}),
+            kwargs.get('ExpressionAttributeValues', {})
+        ):
+            raise ClientError(
+                {'Error': {
+                    'Code': 'ConditionalCheckFailedException',
+                    'Message': 'The conditional request failed'
+                }},
+                operation
+            )
+
+    def get_item(self, TableName: str, Key: Dict[str, Any], **kwargs: Any) -> Dict[str, Any]:
+        time.sleep(self.request_latency * self.time_scale)
+        with self._lock:
+            item = self.tables.get(TableName, {}).get(self._key(Key))
+        return {'Item': dict(item)} if item else {}
+
+    def put_item(self, TableName: str, Item: Dict[str, Any], **kwargs: Any) -> Dict[str, Any]:
+        time.sleep(self.request_latency * self.time_scale)
+        with self._lock:
+            table = self.tables.setdefault(TableName, {})
+            self._check('PutItem', table.get(self._key(Item)), kwargs)
+            table[self._key(Item)] = dict(Item)
+        return {}
+
+    def delete_item(self, TableName: str, Key: Dict[str, Any], **kwargs: Any) -> Dict[str, Any]:
+        time.sleep(self.request_latency * self.time_scale)
+        with self._lock:
+            table = self.tables.setdefault(TableName, {})
+            self._check('DeleteItem', table.get(self._key(Key)), kwargs)
+            table.pop(self._key(Key), None)
+        return {}
@@ -1,334 +1,4986 @@
-"""
-AWS S3 Automated Backup System - Lambda Function
-
-This Lambda function automatically copies files from a source S3 bucket
-to a backup bucket in a different AWS region when triggered by S3 events.
-It sends email notifications via SNS for all backup operations.
-
-"""
-
-import json
-import boto3
-import os
-from datetime import datetime
-from typing import Dict, Any
-
-# Initialize AWS service clients
-s3_client = boto3.client('s3')
-sns_client = boto3.client('sns')
-
-def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
-    """
-    Main Lambda handler function triggered by S3 events.
-    
-    This function processes S3 object creation events, copies files to a backup
-    bucket, and sends notifications about the operation status.
-    
-    Args:
-        event (dict): S3 event notification containing file upload details
-        context (object): Lambda context object with runtime information
-        
-    Returns:
-        dict: Response object with statusCode and body
-        
-    Raises:
-        Exception: Re-raises any exceptions after logging and notification
-    """
-    
-    print("=" * 60)
-    print("BACKUP OPERATION STARTED")
-    print("=" * 60)
-    
-    # Log the complete event for debugging
-    print(f"Event received: {json.dumps(event, indent=2)}")
-    
-    try:
-        # Retrieve environment variables
-        backup_bucket = os.environ.get('BACKUP_BUCKET')
-        sns_topic_arn = os.environ.get('SNS_TOPIC_ARN')
-        
-        # Validate environment variables
-        if not backup_bucket:
-            raise ValueError("BACKUP_BUCKET environment variable not set")
-        if not sns_topic_arn:
-            raise ValueError("SNS_TOPIC_ARN environment variable not set")
-        
-        print(f"Configuration:")
-        print(f"  Backup Bucket: {backup_bucket}")
-        print(f"  SNS Topic: {sns_topic_arn}")
-        
-        # Extract file information from S3 event
-        source_bucket = event['Records'][0]['s3']['bucket']['name']
-        object_key = event['Records'][0]['s3']['object']['key']
-        file_size = event['Records'][0]['s3']['object']['size']
-        event_time = event['Records'][0]['eventTime']
-        
-        print(f"\nFile Details:")
-        print(f"  Source Bucket: {source_bucket}")
-        print(f"  Object Key: {object_key}")
-        print(f"  Size: {file_size} bytes ({file_size / 1024:.2f} KB)")
-        print(f"  Event Time: {event_time}")
-        
-        # Perform the copy operation
-        print(f"\nInitiating copy operation...")
-        print(f"  FROM: s3://{source_bucket}/{object_key}")
-        print(f"  TO:   s3://{backup_bucket}/{object_key}")
-        
-        copy_source = {
-            'Bucket': source_bucket,
-            'Key': object_key
-        }
-        
-        copy_response = s3_client.copy_object(
-            CopySource=copy_source,
-            Bucket=backup_bucket,
-            Key=object_key,
-            ServerSideEncryption='AES256'  # Enable encryption on backup
-        )
-        
-        print(f"Copy operation completed successfully")
-        print(f"  ETag: {copy_response.get('CopyObjectResult', {}).get('ETag', 'N/A')}")
-        
-        # Prepare success notification
-        current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S UTC')
-        success_message = format_success_message(
-            object_key, file_size, source_bucket, backup_bucket, current_time
-        )
-        
-        # Send success notification
-        print(f"\nSending success notification via SNS...")
-        sns_response = sns_client.publish(
-            TopicArn=sns_topic_arn,
-            Subject='AWS Backup Success - File Replicated',
-            Message=success_message
-        )
-        
-        print(f"Notification sent successfully")
-        print(f"  Message ID: {sns_response['MessageId']}")
-        
-        print("\n" + "=" * 60)
-        print("BACKUP OPERATION COMPLETED SUCCESSFULLY")
-        print("=" * 60)
-        
-        # Return success response
-        return {
-            'statusCode': 200,
-            'body': json.dumps({
-                'message': 'Backup completed successfully',
-                'source': f"{source_bucket}/{object_key}",
-                'destination': f"{backup_bucket}/{object_key}",
-                'size_bytes': file_size,
-                'timestamp': current_time
-            })
-        }
-        
-    except KeyError as e:
-        # Handle malformed event data
-        error_msg = f"Invalid event structure - missing required field: {str(e)}"
-        print(f"\nERROR: {error_msg}")
-        print(f"Event structure: {json.dumps(event, indent=2)}")
-        
-        send_failure_notification(
-            sns_topic_arn if 'sns_topic_arn' in locals() else None,
-            error_msg,
-            "Invalid Event Data"
-        )
-        
-        raise
-        
-    except ValueError as e:
-        # Handle configuration errors
-        error_msg = f"Configuration error: {str(e)}"
-        print(f"\nERROR: {error_msg}")
-        
-        send_failure_notification(
-            sns_topic_arn if 'sns_topic_arn' in locals() else None,
-            error_msg,
-            "Configuration Error"
-        )
-        
-        raise
-        
-    except Exception as e:
-        # Handle all other errors
-        error_msg = f"Backup operation failed: {str(e)}"
-        error_type = type(e).__name__
-        
-        print(f"\nERROR: {error_msg}")
-        print(f"Error Type: {error_type}")
-        
-        # Prepare detailed error notification
-        failure_message = format_failure_message(
-            error_msg,
-            error_type,
-            object_key if 'object_key' in locals() else 'Unknown',
-            source_bucket if 'source_bucket' in locals() else 'Unknown',
-            backup_bucket if 'backup_bucket' in locals() else 'Not configured'
-        )
-        
-        # Attempt to send failure notification
-        try:
-            if 'sns_topic_arn' in locals() and sns_topic_arn:
-                sns_client.publish(
-                    TopicArn=sns_topic_arn,
-                    Subject='AWS Backup FAILURE - Action Required',
-                    Message=failure_message
-                )
-                print("Failure notification sent")
-        except Exception as sns_error:
-            print(f"Failed to send failure notification: {str(sns_error)}")
-        
-        print("\n" + "=" * 60)
-        print("BACKUP OPERATION FAILED")
-        print("=" * 60)
-        
-        # Re-raise the original exception
-        raise
-
-
-def format_success_message(
-    object_key: str,
-    file_size: int,
-    source_bucket: str,
-    backup_bucket: str,
-    timestamp: str
-) -> str:
-    """
-    Format a success notification message.
-    
-    Args:
-        object_key: Name of the backed up file
-        file_size: Size of the file in bytes
-        source_bucket: Source S3 bucket name
-        backup_bucket: Backup S3 bucket name
-        timestamp: Timestamp of the operation
-        
-    Returns:
-        str: Formatted success message
-    """
-    file_size_mb = file_size / (1024 * 1024)
-    
-    return f"""
-BACKUP OPERATION SUCCESSFUL
-
-File Details:
--------------
-File Name: {object_key}
-File Size: {file_size:,} bytes ({file_size_mb:.2f} MB)
-
-Source Location:
----------------
-Bucket: {source_bucket}
-Region: us-east-1 (N. Virginia)
-
-Backup Location:
----------------
-Bucket: {backup_bucket}
-Region: us-west-2 (Oregon)
-
-Operation Details:
------------------
-Status: SUCCESS
-Timestamp: {timestamp}
-Encryption: AES256 (Server-side)
-
-Your file has been successfully replicated to the backup region.
-This provides protection against regional failures and data loss.
-
----
-Automated AWS S3 Backup System
-"""
-
-
-def format_failure_message(
-    error_msg: str,
-    error_type: str,
-    object_key: str,
-    source_bucket: str,
-    backup_bucket: str
-) -> str:
-    """
-    Format a failure notification message.
-    
-    Args:
-        error_msg: Error message describing the failure
-        error_type: Type of exception that occurred
-        object_key: Name of the file that failed to back up
-        source_bucket: Source S3 bucket name
-        backup_bucket: Backup S3 bucket name
-        
-    Returns:
-        str: Formatted failure message
-    """
-    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S UTC')
-    
-    return f"""
-BACKUP OPERATION FAILED - ACTION REQUIRED
-
-Error Details:
--------------
-Error Type: {error_type}
-Error Message: {error_msg}
-Timestamp: {timestamp}
-
-File Information:
-----------------
-File Name: {object_key}
-Source Bucket: {source_bucket}
-Backup Bucket: {backup_bucket}
-
-Troubleshooting Steps:
----------------------
-1. Check CloudWatch Logs for detailed error information
-2. Verify IAM role permissions (S3 read/write, SNS publish)
-3. Confirm backup bucket exists and is accessible
-4. Verify environment variables are configured correctly
-5. Check Lambda function timeout settings
-
-CloudWatch Log Group:
---------------------
-/aws/lambda/S3AutoBackupFunction
-
-For immediate assistance, review the Lambda function logs
-in CloudWatch or contact your cloud administrator.
-
----
-Automated AWS S3 Backup System
-"""
-
-
-def send_failure_notification(
-    sns_topic_arn: str,
-    error_msg: str,
-    error_category: str
-) -> None:
-    """
-    Send a failure notification via SNS.
-    
-    Args:
-        sns_topic_arn: ARN of the SNS topic
-        error_msg: Error message to include
-        error_category: Category of the error
-    """
-    if not sns_topic_arn:
-        print("Cannot send failure notification - SNS topic ARN not available")
-        return
-    
-    try:
-        message = f"""
-BACKUP SYSTEM ERROR
-
-Category: {error_category}
-Error: {error_msg}
-Timestamp: {datetime.now().strftime('%Y-%m-%d %H:%M:%S UTC')}
-
-Please check CloudWatch logs for detailed information.
-"""
-        
-        sns_client.publish(
-            TopicArn=sns_topic_arn,
-            Subject=f'AWS Backup System Error - {error_category}',
-            Message=message
-        )
-    except Exception as e:
-        print(f"Failed to send error notification: {str(e)}")
\ No newline at end of file
+"""
+AWS S3 Automated Backup System - Lambda Function
+
+This Lambda function automatically copies files from a source S3 bucket
+to a backup bucket in a different AWS region when triggered by S3 events.
+It sends email notifications via SNS for all backup operations.
+
+"""
+
+import heapq
+import json
+import math
+import os
+import struct
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from datetime import datetime
+from typing import Dict, Any, Callable, List, Optional, Tuple
+from urllib.parse import quote_plus, unquote_plus
+
+# Default number of records copied in parallel within one invocation
+DEFAULT_COPY_CONCURRENCY = 10
+
+# S3 multipart copy limits
+MAX_SINGLE_COPY_SIZE = 5 * 1024 ** 3  # copy_object rejects larger sources
+MIN_PART_SIZE = 5 * 1024 ** 2
+MAX_PART_SIZE = 5 * 1024 ** 3
+MAX_PARTS = 10000
+
+# Multipart copy defaults
+DEFAULT_MULTIPART_THRESHOLD = 1024 ** 3
+DEFAULT_PART_SIZE = 256 * 1024 ** 2
+DEFAULT_PART_CONCURRENCY = 8
+
+# Backup object metadata key recording the source ETag, since multipart
+# copies are given a different ETag than the object they were copied from
+SOURCE_ETAG_METADATA_KEY = 'backup-source-etag'
+
+# Idempotency defaults
+DEFAULT_IDEMPOTENCY_CACHE_SIZE = 10000
+DEFAULT_IDEMPOTENCY_TTL_SECONDS = 7 * 24 * 60 * 60
+# A claim older than the longest Lambda invocation belongs to a container
+# that died mid-copy and may be taken over
+IDEMPOTENCY_LEASE_SECONDS = 15 * 60
+
+# Local state index of backed-up objects
+DEFAULT_STATE_INDEX_KEY = '.backup-index/state.db'
+DEFAULT_STATE_INDEX_SYNC_SECONDS = 60
+STATE_INDEX_SYNC_ATTEMPTS = 3
+STATE_INDEX_LOOKUP_CHUNK = 500  # keys bound to one IN query
+
+# Warm-container cache of backup object metadata and bucket regions
+DEFAULT_METADATA_CACHE_SIZE = 10000
+DEFAULT_METADATA_CACHE_TTL_SECONDS = 300
+BUCKET_REGION_CACHE_SIZE = 1000
+BUCKET_REGION_TTL_SECONDS = 24 * 60 * 60
+
+# Notification modes and digest defaults
+NOTIFICATION_MODES = ('per_object', 'batched', 'digest')
+DEFAULT_DIGEST_FLUSH_THRESHOLD = 1
+DEFAULT_DIGEST_MAX_AGE_SECONDS = 300
+DEFAULT_DIGEST_MAX_KEYS = 50
+DEFAULT_DIGEST_BUFFER_PREFIX = '.digest-buffer/'
+DIGEST_FLUSH_LOCK_SECONDS = 60
+
+# SNS PublishBatch limits and retry policy
+SNS_BATCH_MAX_ENTRIES = 10
+SNS_BATCH_MAX_BYTES = 256 * 1024
+SNS_PUBLISH_MAX_ATTEMPTS = 3
+SNS_RETRY_BASE_DELAY = 0.2
+
+# Background notification dispatch
+DEFAULT_NOTIFY_WORKERS = 10
+NOTIFY_FLUSH_MARGIN_SECONDS = 2.0  # time left for the handler to return
+
+# Structured logging levels
+LOG_LEVELS = {'DEBUG': 10, 'INFO': 20, 'WARNING': 30, 'ERROR': 40}
+DEFAULT_LOG_LEVEL = 'INFO'
+
+# Reconciliation defaults
+DEFAULT_RECONCILE_CONCURRENCY = 8
+DEFAULT_RECONCILE_BATCH_SIZE = 1000
+MAX_REPORTED_FAILURES = 100  # failed keys listed in run summaries
+
+# Backfill defaults
+DEFAULT_BACKFILL_PAGE_SIZE = 1000  # list_objects_v2 maximum
+DEFAULT_BACKFILL_SAFETY_SECONDS = 30.0
+DEFAULT_BACKFILL_CHECKPOINT_PREFIX = '.backfill-checkpoints/'
+
+# Bloom filter of backup keys, consulted before HEAD requests in backfills
+DEFAULT_BLOOM_FILTER_CAPACITY = 10000000  # about 12 MB at a 1% error rate
+DEFAULT_BLOOM_FILTER_ERROR_RATE = 0.01
+DEFAULT_BLOOM_FILTER_MAX_AGE_SECONDS = 24 * 60 * 60
+BLOOM_FILTER_PREFIX = '.backup-index/'
+# Serialized filter: magic, bit count, hash count, keys added, build time
+BLOOM_FILTER_HEADER = struct.Struct('<4sQIQd')
+BLOOM_FILTER_MAGIC = b'BLM1'
+
+# External sort for diffing key sets larger than memory
+DEFAULT_SORT_RUN_ENTRIES = 250000  # about 80 MB of rows held in memory
+SORT_MAX_FANIN = 64  # run files merged at once
+SORT_READ_BUFFER = 256 * 1024  # decompressed bytes read per run at a time
+SORT_WRITE_BLOCK = 16384  # encoded pieces joined per compressor write
+# Per row: key length, size, ETag length (SORT_NO_ETAG when absent)
+SORT_RECORD_HEADER = struct.Struct('<HQB')
+SORT_NO_ETAG = 255
+
+# S3 Inventory worklists
+INVENTORY_FORMATS = ('CSV', 'Parquet')
+WORKLIST_RECORDS_PER_MESSAGE = 100
+SQS_BATCH_MAX_ENTRIES = 10
+# Queues created before 2025 still cap a message, and a whole
+# SendMessageBatch request, at 256 KiB
+SQS_BATCH_MAX_BYTES = 256 * 1024
+
+# CloudWatch Embedded Metric Format
+DEFAULT_METRICS_NAMESPACE = 'S3Backup'
+EMF_MAX_VALUES = 100  # values allowed per metric in one EMF document
+
+# Error codes AWS returns when a request is throttled
+THROTTLE_ERROR_CODES = frozenset([
+    'Throttling',
+    'ThrottlingException',
+    'ThrottledException',
+    'RequestThrottledException',
+    'TooManyRequestsException',
+    'ProvisionedThroughputExceededException',
+    'RequestLimitExceeded',
+    'RequestThrottled',
+    'SlowDown'
+])
+
+# Client connection and retry defaults
+RETRY_MODES = ('legacy', 'standard', 'adaptive')
+DEFAULT_RETRY_MODE = 'adaptive'
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_CONNECT_TIMEOUT = 5.0
+DEFAULT_READ_TIMEOUT = 30.0
+DEFAULT_S3_READ_TIMEOUT = 300.0  # server-side copies of large objects are slow
+
+# Part duration the planner aims for once throughput has been observed:
+# long enough to amortize per-request overhead, short enough that a
+# retried part wastes little work
+TARGET_PART_SECONDS = 10.0
+PLANNER_WINDOW_PARTS = 64  # recent parts the planner's observations cover
+
+
+def get_int_env(name: str, default: int) -> int:
+    """
+    Read a positive integer setting from the environment.
+    
+    Args:
+        name: Environment variable name
+        default: Value used when the variable is unset or empty
+        
+    Returns:
+        int: Parsed value
+        
+    Raises:
+        ValueError: If the variable is set but is not a positive integer
+    """
+    raw = os.environ.get(name)
+    if not raw:
+        return default
+    
+    try:
+        value = int(raw)
+    except ValueError:
+        raise ValueError(f"{name} must be an integer, got {raw!r}")
+    
+    if value < 1:
+        raise ValueError(f"{name} must be at least 1, got {value}")
+    
+    return value
+
+
+def get_bool_env(name: str, default: bool) -> bool:
+    """
+    Read a boolean setting from the environment.
+    
+    Args:
+        name: Environment variable name
+        default: Value used when the variable is unset or empty
+        
+    Returns:
+        bool: Parsed value
+        
+    Raises:
+        ValueError: If the variable is set but is not a recognized boolean
+    """
+    raw = os.environ.get(name)
+    if not raw:
+        return default
+    
+    value = raw.strip().lower()
+    if value in ('1', 'true', 'yes', 'on'):
+        return True
+    if value in ('0', 'false', 'no', 'off'):
+        return False
+    
+    raise ValueError(f"{name} must be true or false, got {raw!r}")
+
+
+def get_float_env(name: str, default: float) -> float:
+    """
+    Read a positive number setting from the environment.
+    
+    Args:
+        name: Environment variable name
+        default: Value used when the variable is unset or empty
+        
+    Returns:
+        float: Parsed value
+        
+    Raises:
+        ValueError: If the variable is set but is not a positive number
+    """
+    raw = os.environ.get(name)
+    if not raw:
+        return default
+    
+    try:
+        value = float(raw)
+    except ValueError:
+        raise ValueError(f"{name} must be a number, got {raw!r}")
+    
+    if value <= 0:
+        raise ValueError(f"{name} must be greater than 0, got {value}")
+    
+    return value
+
+
+_log_lock = threading.Lock()
+
+
+def log(level: str, message: str, **fields: Any) -> None:
+    """
+    Write one structured log entry as a compact JSON line.
+    
+    Entries below LOG_LEVEL (default INFO) are dropped before anything is
+    serialized, so debug-only fields such as the full event cost nothing
+    in normal operation. CloudWatch Logs Insights discovers the JSON
+    fields automatically.
+    
+    Args:
+        level: DEBUG, INFO, WARNING or ERROR
+        message: Short, constant description of the entry
+        **fields: Additional values to include in the entry
+    """
+    threshold = LOG_LEVELS.get(
+        (os.environ.get('LOG_LEVEL') or DEFAULT_LOG_LEVEL).upper(),
+        LOG_LEVELS[DEFAULT_LOG_LEVEL]
+    )
+    if LOG_LEVELS[level] < threshold:
+        return
+    
+    write_log_line({'level': level, 'message': message, **fields})
+
+
+def write_log_line(entry: Dict[str, Any]) -> None:
+    """Serialize entry as one compact JSON line on stdout."""
+    line = json.dumps(entry, separators=(',', ':'), default=str)
+    with _log_lock:
+        sys.stdout.write(line + '\n')
+
+
+def build_client_config(service: str) -> Any:
+    """
+    Build the botocore configuration for an AWS service client.
+    
+    The connection pool is sized for the concurrency the function will
+    actually use, since botocore's default of 10 connections makes extra
+    copy or notification threads queue for a socket. Retries use the
+    standard or adaptive mode (adaptive also rate limits the client when
+    S3 throttles), and sockets use TCP keep-alive with explicit timeouts.
+    
+    Args:
+        service: AWS service name, such as 's3', 'sns' or 'dynamodb'
+        
+    Returns:
+        Config: Client configuration
+        
+    Raises:
+        ValueError: If a client setting is malformed
+    """
+    from botocore.config import Config
+    
+    copy_concurrency = get_int_env('COPY_CONCURRENCY', DEFAULT_COPY_CONCURRENCY)
+    if service == 's3':
+        # Every concurrent record may run a full set of part copies
+        default_pool = copy_concurrency * get_int_env(
+            'PART_CONCURRENCY', DEFAULT_PART_CONCURRENCY
+        )
+        default_read_timeout = DEFAULT_S3_READ_TIMEOUT
+    else:
+        default_pool = copy_concurrency + get_int_env(
+            'NOTIFY_WORKERS', DEFAULT_NOTIFY_WORKERS
+        )
+        default_read_timeout = DEFAULT_READ_TIMEOUT
+    
+    retry_mode = os.environ.get('CLIENT_RETRY_MODE') or DEFAULT_RETRY_MODE
+    if retry_mode not in RETRY_MODES:
+        raise ValueError(
+            f"CLIENT_RETRY_MODE must be one of {', '.join(RETRY_MODES)}, "
+            f"got {retry_mode!r}"
+        )
+    
+    return Config(
+        max_pool_connections=get_int_env(
+            'CLIENT_MAX_POOL_CONNECTIONS', default_pool
+        ),
+        retries={
+            'mode': retry_mode,
+            'total_max_attempts': get_int_env(
+                'CLIENT_MAX_ATTEMPTS', DEFAULT_MAX_ATTEMPTS
+            )
+        },
+        connect_timeout=get_float_env(
+            'CLIENT_CONNECT_TIMEOUT', DEFAULT_CONNECT_TIMEOUT
+        ),
+        read_timeout=get_float_env('CLIENT_READ_TIMEOUT', default_read_timeout),
+        tcp_keepalive=get_bool_env('CLIENT_TCP_KEEPALIVE', True)
+    )
+
+
+def create_client(service: str, region_name: Optional[str] = None) -> Any:
+    """
+    Create an AWS service client with the tuned configuration.
+    
+    boto3 is imported here rather than at module level because importing
+    it dominates cold start, and invocations that fail validation never
+    need it.
+    
+    Args:
+        service: AWS service name, such as 's3', 'sns' or 'dynamodb'
+        region_name: Region for the client, or None for the default
+        
+    Returns:
+        object: boto3 client
+    """
+    import boto3
+    
+    config = build_client_config(service)
+    client = boto3.client(service, region_name=region_name, config=config)
+    
+    # Fires for every HTTP attempt, including ones botocore retries
+    client.meta.events.register('response-received', count_throttle)
+    
+    log(
+        'INFO', 'aws client created',
+        service=service,
+        region=client.meta.region_name,
+        max_pool_connections=config.max_pool_connections,
+        retries=config.retries,
+        connect_timeout=config.connect_timeout,
+        read_timeout=config.read_timeout,
+        tcp_keepalive=config.tcp_keepalive
+    )
+    return client
+
+
+class MetadataCache:
+    """
+    Thread-safe LRU cache whose entries expire after a fixed time.
+    
+    Lives for the lifetime of a warm container. get_or_load lets one
+    thread load a missing key while concurrent callers for the same key
+    wait for its result, so a burst of records triggers one remote lookup
+    rather than one per thread. Hits, misses and evictions are counted.
+    
+    Args:
+        max_entries: Entries kept before the least recently used is evicted
+        ttl_seconds: How long an entry is served after it was stored
+    """
+    
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._loading: Dict[Any, threading.Event] = {}
+        self._lock = threading.Lock()
+    
+    def get_or_load(self, key: Any, loader: Callable[[], Any]) -> Any:
+        """
+        Return the cached value for key, calling loader() on a miss.
+        
+        Exceptions from loader propagate and nothing is cached, so a
+        failed lookup is retried by the next caller.
+        """
+        while True:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None and entry[0] > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                loading = self._loading.get(key)
+                if loading is None:
+                    self.misses += 1
+                    loading = self._loading[key] = threading.Event()
+                    break
+            loading.wait()
+        
+        try:
+            value = loader()
+            self.put(key, value)
+            return value
+        finally:
+            with self._lock:
+                del self._loading[key]
+            loading.set()
+    
+    def put(self, key: Any, value: Any) -> None:
+        """Store value for key, evicting the least recently used if full."""
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+    
+    def invalidate(self, key: Any) -> None:
+        """Drop any cached value for key."""
+        with self._lock:
+            self._entries.pop(key, None)
+    
+    def stats(self) -> Dict[str, int]:
+        """Return the entry count and hit, miss and eviction counters."""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+
+# AWS service clients, created on first use and reused for the lifetime
+# of the container
+s3_client = None
+sns_client = None
+sqs_client = None
+lambda_client = None
+_client_lock = threading.Lock()
+
+# Throttled AWS responses seen by this container, including retried ones
+_throttle_count = 0
+_throttle_lock = threading.Lock()
+
+# Bucket regions and per-region S3 clients, cached across warm invocations
+_bucket_regions = MetadataCache(BUCKET_REGION_CACHE_SIZE, BUCKET_REGION_TTL_SECONDS)
+_regional_s3_clients = {}
+_region_lock = threading.Lock()
+
+
+def count_throttle(
+    parsed_response: Optional[Dict[str, Any]] = None,
+    **kwargs: Any
+) -> None:
+    """
+    botocore response-received handler counting throttled requests.
+    
+    Retries hide throttling from the caller, so it is counted per attempt
+    here and reported as the ThrottleCount metric.
+    """
+    global _throttle_count
+    
+    error_code = ((parsed_response or {}).get('Error') or {}).get('Code')
+    if error_code in THROTTLE_ERROR_CODES:
+        with _throttle_lock:
+            _throttle_count += 1
+
+
+def get_throttle_count() -> int:
+    """Return the number of throttled responses seen by this container."""
+    return _throttle_count
+
+
+def get_s3_client() -> Any:
+    """Return the shared S3 client, creating it on first use."""
+    global s3_client
+    if s3_client is None:
+        with _client_lock:
+            if s3_client is None:
+                s3_client = create_client('s3')
+    return s3_client
+
+
+def get_s3_client_for_bucket(bucket: str) -> Any:
+    """
+    Return an S3 client in the region that hosts the given bucket.
+    
+    The backup bucket lives in a different region from the function, and
+    sending its requests through the home-region client costs redirects
+    and extra hops. Clients are cached per region for the lifetime of the
+    container; the home-region client is reused when regions match.
+    
+    Args:
+        bucket: Bucket the requests will address
+        
+    Returns:
+        object: boto3 S3 client
+    """
+    default_client = get_s3_client()
+    region = get_bucket_region(bucket)
+    if not region or region == default_client.meta.region_name:
+        return default_client
+    
+    with _region_lock:
+        client = _regional_s3_clients.get(region)
+        if client is None:
+            client = create_client('s3', region_name=region)
+            _regional_s3_clients[region] = client
+    return client
+
+
+def get_bucket_region(bucket: str) -> Optional[str]:
+    """
+    Look up the region that hosts a bucket, cached for a day.
+    
+    BACKUP_BUCKET_REGION, when set, answers for the backup bucket without
+    a lookup. Failed lookups are remembered as None so the default client
+    is used without retrying the lookup on every object. Concurrent
+    callers for the same bucket share a single lookup.
+    
+    Args:
+        bucket: Bucket name
+        
+    Returns:
+        str: Region name, or None if it could not be determined
+    """
+    configured_region = os.environ.get('BACKUP_BUCKET_REGION')
+    if configured_region and bucket == os.environ.get('BACKUP_BUCKET'):
+        return configured_region
+    
+    def lookup() -> Optional[str]:
+        try:
+            response = get_s3_client().get_bucket_location(Bucket=bucket)
+            # Buckets in us-east-1 report no location constraint, and the
+            # oldest eu-west-1 buckets report the legacy value EU
+            region = response.get('LocationConstraint') or 'us-east-1'
+            if region == 'EU':
+                region = 'eu-west-1'
+        except Exception as e:
+            log('WARNING', 'bucket region lookup failed', bucket=bucket, error=str(e))
+            region = None
+        
+        log('INFO', 'bucket region resolved', bucket=bucket, region=region)
+        return region
+    
+    return _bucket_regions.get_or_load(bucket, lookup)
+
+
+def get_sns_client() -> Any:
+    """Return the shared SNS client, creating it on first use."""
+    global sns_client
+    if sns_client is None:
+        with _client_lock:
+            if sns_client is None:
+                sns_client = create_client('sns')
+    return sns_client
+
+
+def get_sqs_client() -> Any:
+    """Return the shared SQS client, creating it on first use."""
+    global sqs_client
+    if sqs_client is None:
+        with _client_lock:
+            if sqs_client is None:
+                sqs_client = create_client('sqs')
+    return sqs_client
+
+
+def get_lambda_client() -> Any:
+    """Return the shared Lambda client, creating it on first use."""
+    global lambda_client
+    if lambda_client is None:
+        with _client_lock:
+            if lambda_client is None:
+                lambda_client = create_client('lambda')
+    return lambda_client
+
+
+class BackupBatchError(Exception):
+    """Raised after a batch is processed when one or more records failed."""
+
+    def __init__(self, results: List[Dict[str, Any]]):
+        self.results = results
+        failed = [r for r in results if r['status'] == 'failed']
+        super().__init__(
+            f"{len(failed)} of {len(results)} record(s) failed to back up"
+        )
+
+
+def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """
+    Main Lambda handler function triggered by S3 events.
+    
+    This function processes every S3 object creation record in the event,
+    copies each file to a backup bucket, and sends notifications about the
+    operation status. Records are processed independently so a failure in
+    one record does not prevent the rest of the batch from being backed up.
+    
+    Events delivered through an SQS queue are detected automatically and
+    handled by handle_sqs_batch, which reports partial batch failures
+    instead of raising.
+    
+    Args:
+        event (dict): S3 event notification (or SQS batch of them)
+            containing file upload details
+        context (object): Lambda context object with runtime information
+        
+    Returns:
+        dict: Response object with statusCode and body, plus
+            batchItemFailures for SQS batches
+        
+    Raises:
+        BackupBatchError: If any record in the batch failed to back up
+        Exception: Re-raises configuration and event errors after logging
+            and notification
+    """
+    
+    timer = PhaseTimer()
+    throttles_before = get_throttle_count()
+    
+    # Log the complete event for debugging
+    log('DEBUG', 'event received', event=event)
+    
+    try:
+        # Retrieve environment variables
+        backup_bucket = os.environ.get('BACKUP_BUCKET')
+        sns_topic_arn = os.environ.get('SNS_TOPIC_ARN')
+        
+        # Validate environment variables
+        if not backup_bucket:
+            raise ValueError("BACKUP_BUCKET environment variable not set")
+        if not sns_topic_arn:
+            raise ValueError("SNS_TOPIC_ARN environment variable not set")
+        
+        settings = load_copy_settings()
+        settings['notifier'] = Notifier(
+            sns_topic_arn,
+            batched=settings['notification_mode'] == 'batched',
+            asynchronous=settings['notify_async'],
+            max_workers=settings['notify_workers']
+        )
+        
+        records = event['Records']
+        
+        store = settings['idempotency_store']
+        log(
+            'INFO', 'backup invocation started',
+            records=len(records),
+            backup_bucket=backup_bucket,
+            sns_topic_arn=sns_topic_arn,
+            copy_concurrency=settings['copy_concurrency'],
+            multipart_threshold=settings['multipart_threshold'],
+            part_size=settings['part_size'],
+            part_concurrency=settings['part_concurrency'],
+            skip_unchanged=settings['skip_unchanged'],
+            notification_mode=settings['notification_mode'],
+            notify_async=settings['notify_async'],
+            idempotency_store=type(store).__name__ if store else None
+        )
+        
+    except KeyError as e:
+        # Handle malformed event data
+        error_msg = f"Invalid event structure - missing required field: {str(e)}"
+        log('ERROR', 'invalid event', error=error_msg)
+        log('DEBUG', 'invalid event structure', event=event)
+        
+        send_failure_notification(
+            sns_topic_arn if 'sns_topic_arn' in locals() else None,
+            error_msg,
+            "Invalid Event Data"
+        )
+        
+        raise
+        
+    except ValueError as e:
+        # Handle configuration errors
+        error_msg = f"Configuration error: {str(e)}"
+        log('ERROR', 'configuration error', error=error_msg)
+        
+        send_failure_notification(
+            sns_topic_arn if 'sns_topic_arn' in locals() else None,
+            error_msg,
+            "Configuration Error"
+        )
+        
+        raise
+    
+    if records and records[0].get('eventSource') == 'aws:sqs':
+        return handle_sqs_batch(
+            records, backup_bucket, sns_topic_arn, settings, context, timer,
+            throttles_before
+        )
+    
+    timer.lap('validate')
+    
+    # Back up every record in the batch
+    results = copy_records(
+        records,
+        backup_bucket,
+        sns_topic_arn,
+        settings
+    )
+    timer.lap('copy')
+    
+    notify_batch(results, sns_topic_arn, settings, context)
+    timer.lap('notify')
+    
+    sync_state_index(settings)
+    timer.lap('index')
+    
+    summary = summarize_results('Backup completed successfully', results)
+    summary['timings'] = timer.timings()
+    report_timings('invocation', summary['timings'], summary)
+    
+    if settings['metrics_enabled']:
+        emit_metrics(
+            results,
+            backup_bucket,
+            settings['metrics_namespace'],
+            get_throttle_count() - throttles_before
+        )
+    counts = {k: v for k, v in summary.items() if k.startswith('records_')}
+    
+    if summary['records_failed']:
+        log(
+            'ERROR', 'backup invocation failed',
+            timings=summary['timings'],
+            caches=metadata_cache_stats(settings),
+            **counts
+        )
+        
+        # Re-raise so the invocation is reported as failed and retried
+        raise BackupBatchError(results)
+    
+    log(
+        'INFO', 'backup invocation completed',
+        total_bytes=summary['total_bytes'],
+        timings=summary['timings'],
+        caches=metadata_cache_stats(settings),
+        **counts
+    )
+    
+    # Return success response
+    return {
+        'statusCode': 200,
+        'body': json.dumps(summary)
+    }
+
+
+def handle_sqs_batch(
+    messages: List[Dict[str, Any]],
+    backup_bucket: str,
+    sns_topic_arn: str,
+    settings: Dict[str, Any],
+    context: Any,
+    timer: 'PhaseTimer',
+    throttles_before: int
+) -> Dict[str, Any]:
+    """
+    Back up the S3 events carried in a batch of SQS messages.
+    
+    Every message body is unwrapped into its S3 records and all records
+    are copied together. Rather than raising, the response lists only the
+    messages that had a failed record in batchItemFailures, so with
+    ReportBatchItemFailures enabled on the event source mapping SQS
+    redelivers just those and successful copies are never redone.
+    
+    Args:
+        messages: SQS messages from the event's Records list
+        backup_bucket: Backup S3 bucket name
+        sns_topic_arn: ARN of the SNS topic for notifications
+        settings: Copy settings from load_copy_settings
+        context: Lambda context object, used to bound notification flushing
+        timer: Invocation timer started by lambda_handler
+        throttles_before: Throttle count when the invocation started
+        
+    Returns:
+        dict: Response with statusCode, body and batchItemFailures
+    """
+    log('DEBUG', 'unwrapping sqs batch', messages=len(messages))
+    
+    s3_records = []
+    owners = []
+    failed_messages = set()
+    
+    for message in messages:
+        message_id = message['messageId']
+        try:
+            body = json.loads(message['body'])
+            # S3 sends an s3:TestEvent without Records when a queue is configured
+            records = body.get('Records', []) if isinstance(body, dict) else None
+            if not isinstance(records, list):
+                raise ValueError("message body is not an S3 event notification")
+        except (KeyError, TypeError, ValueError) as e:
+            log('ERROR', 'invalid sqs message', message_id=message_id, error=str(e))
+            failed_messages.add(message_id)
+            continue
+        
+        for record in records:
+            s3_records.append(record)
+            owners.append(message_id)
+    
+    timer.lap('validate')
+    
+    results = copy_records(s3_records, backup_bucket, sns_topic_arn, settings)
+    timer.lap('copy')
+    
+    notify_batch(results, sns_topic_arn, settings, context)
+    timer.lap('notify')
+    
+    sync_state_index(settings)
+    timer.lap('index')
+    
+    for message_id, result in zip(owners, results):
+        if result['status'] == 'failed':
+            failed_messages.add(message_id)
+    
+    batch_item_failures = [
+        {'itemIdentifier': message['messageId']}
+        for message in messages
+        if message['messageId'] in failed_messages
+    ]
+    
+    summary = summarize_results('SQS batch processed', results)
+    summary['messages_processed'] = len(messages)
+    summary['messages_failed'] = len(batch_item_failures)
+    summary['timings'] = timer.timings()
+    report_timings('invocation', summary['timings'], summary)
+    
+    if settings['metrics_enabled']:
+        emit_metrics(
+            results,
+            backup_bucket,
+            settings['metrics_namespace'],
+            get_throttle_count() - throttles_before
+        )
+    
+    log(
+        'WARNING' if batch_item_failures else 'INFO',
+        'sqs batch completed',
+        timings=summary['timings'],
+        caches=metadata_cache_stats(settings),
+        **{k: v for k, v in summary.items() if k.startswith(('records_', 'messages_'))}
+    )
+    
+    return {
+        'statusCode': 200,
+        'body': json.dumps(summary),
+        'batchItemFailures': batch_item_failures
+    }
+
+
+def reconcile_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """
+    Compare the source and backup buckets and copy whatever is missing.
+    
+    S3 events can be lost, for example while notifications are disabled
+    or during an outage. This entry point, configured as the handler of a
+    separate (typically scheduled) function, lists both buckets in
+    parallel shards, diffs the listings in a streaming merge and sends the
+    objects that are missing or stale in the backup through the normal
+    copy path in batches.
+    
+    The event may contain:
+        source_bucket: Bucket to back up (default SOURCE_BUCKET)
+        prefix: Only reconcile keys under this prefix (default all)
+        prefixes: Explicit shard prefixes, instead of discovering them
+        dry_run: Report differences without copying (default false)
+    
+    Args:
+        event (dict): Reconciliation options, as above
+        context (object): Lambda context object with runtime information
+        
+    Returns:
+        dict: Response object with statusCode and a body of counts
+        
+    Raises:
+        ValueError: If a required setting is missing or malformed
+    """
+    timer = PhaseTimer()
+    throttles_before = get_throttle_count()
+    
+    source_bucket = event.get('source_bucket') or os.environ.get('SOURCE_BUCKET')
+    backup_bucket = os.environ.get('BACKUP_BUCKET')
+    sns_topic_arn = os.environ.get('SNS_TOPIC_ARN')
+    
+    if not source_bucket:
+        raise ValueError("source_bucket must be given in the event or SOURCE_BUCKET")
+    if not backup_bucket:
+        raise ValueError("BACKUP_BUCKET environment variable not set")
+    if not sns_topic_arn:
+        raise ValueError("SNS_TOPIC_ARN environment variable not set")
+    
+    settings = load_copy_settings()
+    # One summary is sent at the end instead of a message per object
+    settings['notification_mode'] = 'digest'
+    settings['notifier'] = Notifier(
+        sns_topic_arn,
+        batched=True,
+        asynchronous=settings['notify_async'],
+        max_workers=settings['notify_workers']
+    )
+    concurrency = get_int_env('RECONCILE_CONCURRENCY', DEFAULT_RECONCILE_CONCURRENCY)
+    batch_size = get_int_env('RECONCILE_BATCH_SIZE', DEFAULT_RECONCILE_BATCH_SIZE)
+    dry_run = bool(event.get('dry_run'))
+    
+    source_client = get_s3_client_for_bucket(source_bucket)
+    if event.get('prefixes'):
+        shards = [(prefix, None) for prefix in event['prefixes']]
+    else:
+        shards = list_shards(source_client, source_bucket, event.get('prefix', ''))
+    
+    log(
+        'INFO', 'reconciliation started',
+        source_bucket=source_bucket,
+        backup_bucket=backup_bucket,
+        shards=len(shards),
+        concurrency=concurrency,
+        dry_run=dry_run
+    )
+    timer.lap('validate')
+    
+    workers = max(1, min(concurrency, len(shards)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        shard_counts = list(executor.map(
+            lambda shard: reconcile_shard(
+                shard, source_bucket, backup_bucket, sns_topic_arn,
+                settings, batch_size, dry_run
+            ),
+            shards
+        ))
+    timer.lap('copy')
+    
+    summary = {'message': 'Reconciliation completed', 'shards': len(shards)}
+    failures = []
+    for counts in shard_counts:
+        failures.extend(counts.pop('failures'))
+        for name, value in counts.items():
+            summary[name] = summary.get(name, 0) + value
+    summary['failures'] = failures[:MAX_REPORTED_FAILURES]
+    
+    settings['notifier'].flush(timeout=flush_timeout(context))
+    # ETag-only differences are usually backups of multipart or SSE-KMS
+    # sources that process_record found current, so only what was actually
+    # copied or failed, or in a dry run what is provably out of date, is
+    # worth a message
+    if dry_run:
+        changed = summary.get('missing') or summary.get('stale')
+    else:
+        changed = summary.get('copied') or failures
+    if changed:
+        recovered = summary.get('copied', 0)
+        try:
+            get_sns_client().publish(
+                TopicArn=sns_topic_arn,
+                Subject=f"AWS Backup Reconciliation - {recovered} File(s) Recovered",
+                Message=format_reconcile_message(source_bucket, backup_bucket, summary)
+            )
+        except Exception as e:
+            log('ERROR', 'reconciliation notification failed', error=str(e))
+    timer.lap('notify')
+    
+    throttles = get_throttle_count() - throttles_before
+    if settings['metrics_enabled']:
+        emit_metrics([], backup_bucket, settings['metrics_namespace'], throttles)
+    
+    summary['timings'] = timer.timings()
+    report_timings('invocation', summary['timings'], summary)
+    log(
+        'WARNING' if failures else 'INFO', 'reconciliation completed',
+        **{k: v for k, v in summary.items() if k not in ('message', 'failures')},
+        throttles=throttles
+    )
+    
+    return {
+        'statusCode': 200,
+        'body': json.dumps(summary)
+    }
+
+
+def list_shards(
+    client: Any,
+    bucket: str,
+    prefix: str
+) -> List[Tuple[str, Optional[str]]]:
+    """
+    Split the keys under prefix into independently listable shards.
+    
+    Every common prefix one level below prefix becomes a shard listed
+    recursively, and the objects directly under prefix form one more
+    shard listed with a delimiter. Together they cover every key exactly
+    once, and each is listed in key order on its own.
+    
+    Args:
+        client: S3 client for the bucket
+        bucket: Bucket to shard
+        prefix: Key prefix to cover
+        
+    Returns:
+        list: (prefix, delimiter) pairs for iter_objects
+    """
+    shards = [(prefix, '/')]
+    kwargs = {'Bucket': bucket, 'Prefix': prefix, 'Delimiter': '/'}
+    while True:
+        response = client.list_objects_v2(**kwargs)
+        shards.extend(
+            (common['Prefix'], None) for common in response.get('CommonPrefixes', [])
+        )
+        if not response.get('IsTruncated'):
+            return shards
+        kwargs['ContinuationToken'] = response['NextContinuationToken']
+
+
+def iter_objects(
+    client: Any,
+    bucket: str,
+    prefix: str,
+    delimiter: Optional[str] = None
+) -> Any:
+    """
+    Yield (key, size, etag) for every object under prefix, in key order.
+    
+    Pages are fetched lazily, so only one page of 1,000 keys is held in
+    memory at a time.
+    
+    Args:
+        client: S3 client for the bucket
+        bucket: Bucket to list
+        prefix: Key prefix to list
+        delimiter: Delimiter, to list only the objects directly under prefix
+    """
+    kwargs = {'Bucket': bucket, 'Prefix': prefix}
+    if delimiter:
+        kwargs['Delimiter'] = delimiter
+    while True:
+        response = client.list_objects_v2(**kwargs)
+        for obj in response.get('Contents', []):
+            yield obj['Key'], obj['Size'], obj.get('ETag')
+        if not response.get('IsTruncated'):
+            return
+        kwargs['ContinuationToken'] = response['NextContinuationToken']
+
+
+def diff_listings(source: Any, backup: Any) -> Any:
+    """
+    Merge two key-ordered listings and yield source objects needing a copy.
+    
+    Both iterables must yield (key, size, etag) sorted by key, as
+    list_objects_v2 does, so the diff runs in constant memory. Objects
+    whose ETags differ are reported rather than treated as stale, because
+    copies of multipart and SSE-KMS sources legitimately change the ETag;
+    process_record settles those with its HEAD check.
+    
+    Args:
+        source: (key, size, etag) tuples from the source bucket
+        backup: (key, size, etag) tuples from the backup bucket
+        
+    Yields:
+        tuple: (key, size, etag, reason) where reason is 'missing',
+            'size' or 'etag'
+    """
+    backup = iter(backup)
+    backup_entry = next(backup, None)
+    
+    for key, size, etag in source:
+        while backup_entry is not None and backup_entry[0] < key:
+            backup_entry = next(backup, None)
+        
+        if backup_entry is None or backup_entry[0] != key:
+            yield key, size, etag, 'missing'
+        elif backup_entry[1] != size:
+            yield key, size, etag, 'size'
+        elif etag and backup_entry[2] != etag:
+            yield key, size, etag, 'etag'
+
+
+def external_sort(
+    rows: Any,
+    run_entries: int = DEFAULT_SORT_RUN_ENTRIES,
+    spill_dir: Optional[str] = None
+) -> Any:
+    """
+    Sort (key, size, etag) tuples by key using bounded memory.
+    
+    Rows are collected into runs of run_entries, each sorted in memory
+    and spilled to a compressed file under spill_dir (default /tmp), then
+    the runs are k-way merged. Inputs that fit in a single run never touch
+    disk. Memory is bounded by one run plus a read buffer per merged run
+    regardless of the number of rows, so any lister's output can be fed
+    to diff_listings. Spill files are removed when the iterator is
+    exhausted or closed.
+    
+    Args:
+        rows: Iterable of (key, size, etag) tuples in any order
+        run_entries: Rows held in memory per run
+        spill_dir: Directory for run files
+        
+    Yields:
+        tuple: (key, size, etag) in key order
+    """
+    runs: List[str] = []
+    try:
+        buffer = []
+        for row in rows:
+            buffer.append(row)
+            if len(buffer) >= run_entries:
+                buffer.sort(key=sort_key)
+                runs.append(write_sort_run(buffer, spill_dir))
+                buffer = []
+        
+        buffer.sort(key=sort_key)
+        if not runs:
+            yield from buffer
+            return
+        if buffer:
+            runs.append(write_sort_run(buffer, spill_dir))
+        del buffer
+        
+        # Merge in several passes when there are too many runs to open at once
+        while len(runs) > SORT_MAX_FANIN:
+            group, runs = runs[:SORT_MAX_FANIN], runs[SORT_MAX_FANIN:]
+            try:
+                runs.append(write_sort_run(merge_sort_runs(group), spill_dir))
+            finally:
+                for path in group:
+                    os.remove(path)
+        
+        yield from merge_sort_runs(runs)
+    finally:
+        for path in runs:
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def sort_key(row: Tuple[str, int, Optional[str]]) -> str:
+    """Return the key a row is sorted and merged by."""
+    return row[0]
+
+
+def merge_sort_runs(paths: List[str]) -> Any:
+    """K-way merge sorted run files into one sorted stream of rows."""
+    return heapq.merge(*(read_sort_run(path) for path in paths), key=sort_key)
+
+
+def write_sort_run(rows: Any, spill_dir: Optional[str]) -> str:
+    """
+    Write sorted rows to a run file in a compact binary format.
+    
+    Each row is a fixed header (key length, size and ETag length)
+    followed by the UTF-8 key and the ETag. Sorted keys share long
+    prefixes, which fast gzip compression removes, keeping runs several
+    times smaller than the rows' text form.
+    
+    Args:
+        rows: Rows in key order
+        spill_dir: Directory for the run file, or None for the default
+        
+    Returns:
+        str: Path of the run file
+    """
+    import gzip
+    import tempfile
+    
+    f = tempfile.NamedTemporaryFile(
+        mode='wb', dir=spill_dir, prefix='backup-sort-', suffix='.run', delete=False
+    )
+    with f, gzip.GzipFile(fileobj=f, mode='wb', compresslevel=1) as out:
+        pack = SORT_RECORD_HEADER.pack
+        # Encoded rows are written in blocks; per-row writes to the
+        # compressor dominate otherwise
+        block = []
+        for key, size, etag in rows:
+            key_bytes = key.encode('utf-8')
+            if etag is None:
+                block.append(pack(len(key_bytes), size, SORT_NO_ETAG))
+                block.append(key_bytes)
+            else:
+                etag_bytes = etag.encode('utf-8')
+                block.append(pack(len(key_bytes), size, len(etag_bytes)))
+                block.append(key_bytes)
+                block.append(etag_bytes)
+            if len(block) >= SORT_WRITE_BLOCK:
+                out.write(b''.join(block))
+                block = []
+        out.write(b''.join(block))
+    return f.name
+
+
+def read_sort_run(path: str) -> Any:
+    """Yield the rows of a run file written by write_sort_run."""
+    import gzip
+    
+    header_size = SORT_RECORD_HEADER.size
+    unpack_from = SORT_RECORD_HEADER.unpack_from
+    # Largest possible row, so a refilled buffer always holds a whole row
+    max_row = header_size + 0xFFFF + SORT_NO_ETAG
+    
+    with open(path, 'rb') as f, gzip.GzipFile(fileobj=f, mode='rb') as run:
+        data = b''
+        pos = 0
+        eof = False
+        while True:
+            if not eof and len(data) - pos < max_row:
+                chunk = run.read(SORT_READ_BUFFER)
+                eof = not chunk
+                data = data[pos:] + chunk
+                pos = 0
+            if pos >= len(data):
+                return
+            
+            key_length, size, etag_length = unpack_from(data, pos)
+            pos += header_size
+            key = data[pos:pos + key_length].decode('utf-8')
+            pos += key_length
+            if etag_length == SORT_NO_ETAG:
+                yield key, size, None
+            else:
+                yield key, size, data[pos:pos + etag_length].decode('utf-8')
+                pos += etag_length
+
+
+def reconcile_shard(
+    shard: Tuple[str, Optional[str]],
+    source_bucket: str,
+    backup_bucket: str,
+    sns_topic_arn: str,
+    settings: Dict[str, Any],
+    batch_size: int,
+    dry_run: bool
+) -> Dict[str, Any]:
+    """
+    Diff one shard of both buckets and copy its missing or stale objects.
+    
+    Differences are turned into S3 event records and copied through
+    copy_records in batches of batch_size, so memory stays bounded by the
+    batch rather than the shard. Objects whose ETag alone differs are
+    counted as unverified; they are stale only if process_record copies
+    them. In a dry run size differences are counted as stale instead.
+    
+    Args:
+        shard: (prefix, delimiter) pair from list_shards
+        source_bucket: Bucket being backed up
+        backup_bucket: Backup S3 bucket name
+        sns_topic_arn: ARN of the SNS topic for notifications
+        settings: Copy settings from load_copy_settings
+        batch_size: Records copied per copy_records call
+        dry_run: Count differences without copying
+        
+    Returns:
+        dict: Counts by outcome, bytes copied and failed results
+    """
+    prefix, delimiter = shard
+    counts = {
+        'source_objects': 0, 'missing': 0, 'stale': 0, 'unverified': 0,
+        'copied': 0, 'skipped': 0, 'failed': 0, 'copied_bytes': 0
+    }
+    failures = []
+    batch = []
+    
+    def source_listing() -> Any:
+        for entry in iter_objects(
+            get_s3_client_for_bucket(source_bucket), source_bucket, prefix, delimiter
+        ):
+            counts['source_objects'] += 1
+            yield entry
+    
+    def copy_batch() -> None:
+        failures.extend(copy_listed_objects(
+            batch, backup_bucket, sns_topic_arn, settings, counts
+        ))
+        batch.clear()
+    
+    backup_listing = iter_objects(
+        get_s3_client_for_bucket(backup_bucket), backup_bucket, prefix, delimiter
+    )
+    for key, size, etag, reason in diff_listings(source_listing(), backup_listing):
+        if reason == 'missing':
+            counts['missing'] += 1
+        elif reason == 'etag':
+            counts['unverified'] += 1
+        elif dry_run:
+            counts['stale'] += 1
+        if dry_run:
+            continue
+        
+        batch.append(listed_object_record(
+            source_bucket, key, size, etag,
+            backup_state='missing' if reason == 'missing' else 'differs'
+        ))
+        if len(batch) >= batch_size:
+            copy_batch()
+    
+    if batch:
+        copy_batch()
+    
+    log('DEBUG', 'shard reconciled', prefix=prefix, **counts)
+    counts['failures'] = failures
+    return counts
+
+
+def listed_object_record(
+    bucket: str,
+    key: str,
+    size: int,
+    etag: Optional[str],
+    backup_state: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Build an S3 event record for an object found by listing a bucket.
+    
+    Args:
+        bucket: Bucket holding the object
+        key: Object key, as returned by list_objects_v2
+        size: Object size in bytes
+        etag: Object ETag
+        backup_state: What a listing of the backup showed: 'missing' if
+            it has no such key, so process_record copies it without first
+            checking the backup, or 'differs' if its copy differs
+        
+    Returns:
+        dict: Record in the shape process_record expects
+    """
+    record = {
+        'eventSource': 'aws:s3',
+        'eventName': 'ObjectCreated:Listed',
+        's3': {
+            'bucket': {'name': bucket},
+            # process_record expects keys URL-encoded, as in S3 events
+            'object': {'key': quote_plus(key, safe='/'), 'size': size, 'eTag': etag}
+        }
+    }
+    if backup_state:
+        record['backupState'] = backup_state
+    return record
+
+
+def copy_listed_objects(
+    records: List[Dict[str, Any]],
+    backup_bucket: str,
+    sns_topic_arn: str,
+    settings: Dict[str, Any],
+    counts: Dict[str, int]
+) -> List[Dict[str, Any]]:
+    """
+    Copy a batch of listed objects and add the outcomes to counts.
+    
+    Args:
+        records: Records from listed_object_record
+        backup_bucket: Backup S3 bucket name
+        sns_topic_arn: ARN of the SNS topic for notifications
+        settings: Copy settings from load_copy_settings
+        counts: Running 'copied', 'skipped', 'failed' and 'copied_bytes'
+            totals, updated in place; 'stale' also counts copies of
+            records whose backupState is 'differs'
+        
+    Returns:
+        list: Results of the records that failed
+    """
+    results = copy_records(records, backup_bucket, sns_topic_arn, settings)
+    
+    failures = []
+    for record, result in zip(records, results):
+        if result['status'] == 'success':
+            counts['copied'] += 1
+            counts['copied_bytes'] += result['size_bytes']
+            if record.get('backupState') == 'differs':
+                counts['stale'] += 1
+        elif result['status'] == 'failed':
+            counts['failed'] += 1
+            failures.append(result)
+        else:
+            counts['skipped'] += 1
+    
+    sync_state_index(settings)
+    
+    # ThrottleCount is emitted once by the calling handler; the counter is
+    # shared by every batch copied concurrently
+    if settings['metrics_enabled']:
+        emit_metrics(results, backup_bucket, settings['metrics_namespace'])
+    return failures
+
+
+def backfill_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """
+    Copy every object in the source bucket, resuming across invocations.
+    
+    An initial backfill of a large bucket cannot finish within one
+    invocation. This entry point lists the source bucket a page at a time,
+    copies each page through the normal copy path and saves a checkpoint
+    (continuation token, last key and counters) after every page. Before
+    starting each page after the first it checks the time left in the
+    invocation; when too little remains for another page it stops and,
+    unless BACKFILL_SELF_INVOKE is false, invokes itself asynchronously to
+    carry on. A run can also be resumed by a scheduler sending the same event.
+    Objects already current in the backup are skipped, so a page
+    interrupted midway is cheap to redo. With BLOOM_FILTER_ENABLED, objects
+    absent from a Bloom filter of the backup keys are copied without first
+    checking the backup with a HEAD request.
+    
+    The event may contain:
+        source_bucket: Bucket to back up (default SOURCE_BUCKET)
+        prefix: Only back up keys under this prefix (default all)
+        backfill_id: Name of the checkpoint (default bucket and prefix)
+        restart: Start over even if a checkpoint exists
+        invocation: Set on self-invocations to detect stale duplicates
+    
+    Args:
+        event (dict): Backfill options, as above
+        context (object): Lambda context object with runtime information
+        
+    Returns:
+        dict: Response object with statusCode and a body holding the
+            checkpoint, whose status is 'running' or 'complete'
+        
+    Raises:
+        ValueError: If a required setting is missing or malformed
+    """
+    timer = PhaseTimer()
+    throttles_before = get_throttle_count()
+    
+    source_bucket = event.get('source_bucket') or os.environ.get('SOURCE_BUCKET')
+    backup_bucket = os.environ.get('BACKUP_BUCKET')
+    sns_topic_arn = os.environ.get('SNS_TOPIC_ARN')
+    
+    if not source_bucket:
+        raise ValueError("source_bucket must be given in the event or SOURCE_BUCKET")
+    if not backup_bucket:
+        raise ValueError("BACKUP_BUCKET environment variable not set")
+    if not sns_topic_arn:
+        raise ValueError("SNS_TOPIC_ARN environment variable not set")
+    
+    settings = load_copy_settings()
+    # One summary is sent at the end instead of a message per object
+    settings['notification_mode'] = 'digest'
+    settings['notifier'] = Notifier(
+        sns_topic_arn,
+        batched=True,
+        asynchronous=settings['notify_async'],
+        max_workers=settings['notify_workers']
+    )
+    page_size = get_int_env('BACKFILL_PAGE_SIZE', DEFAULT_BACKFILL_PAGE_SIZE)
+    safety_seconds = get_float_env(
+        'BACKFILL_SAFETY_SECONDS', DEFAULT_BACKFILL_SAFETY_SECONDS
+    )
+    if not 1 <= page_size <= 1000:
+        raise ValueError(
+            f"BACKFILL_PAGE_SIZE must be between 1 and 1000, got {page_size}"
+        )
+    
+    prefix = event.get('prefix', '')
+    backfill_id = event.get('backfill_id') or f"{source_bucket}/{prefix}"
+    store = S3CheckpointStore(
+        os.environ.get('BACKFILL_CHECKPOINT_BUCKET') or backup_bucket,
+        (os.environ.get('BACKFILL_CHECKPOINT_PREFIX')
+            or DEFAULT_BACKFILL_CHECKPOINT_PREFIX)
+    )
+    
+    checkpoint = None if event.get('restart') else store.load(backfill_id)
+    if checkpoint is None:
+        checkpoint = {
+            'backfill_id': backfill_id,
+            'source_bucket': source_bucket,
+            'prefix': prefix,
+            'status': 'running',
+            'invocation': 0,
+            'continuation_token': None,
+            'last_key': None,
+            'pages': 0,
+            'listed': 0,
+            'copied': 0,
+            'skipped': 0,
+            'failed': 0,
+            'copied_bytes': 0,
+            'failed_keys': []
+        }
+    elif checkpoint['status'] == 'complete':
+        log('INFO', 'backfill already complete', backfill_id=backfill_id)
+        return {'statusCode': 200, 'body': json.dumps(checkpoint)}
+    elif event.get('invocation', checkpoint['invocation']) != checkpoint['invocation']:
+        # A retried or duplicated self-invocation; a newer one owns the run
+        log(
+            'WARNING', 'stale backfill invocation ignored',
+            backfill_id=backfill_id,
+            invocation=event.get('invocation'),
+            current_invocation=checkpoint['invocation']
+        )
+        return {'statusCode': 200, 'body': json.dumps(checkpoint)}
+    
+    if settings['skip_unchanged'] and get_bool_env('BLOOM_FILTER_ENABLED', False):
+        settings['backup_filter'] = get_backup_filter(backup_bucket, prefix)
+    
+    client = get_s3_client_for_bucket(source_bucket)
+    longest_page = 0.0
+    
+    log(
+        'INFO', 'backfill started',
+        backfill_id=backfill_id,
+        invocation=checkpoint['invocation'],
+        pages=checkpoint['pages'],
+        last_key=checkpoint['last_key']
+    )
+    timer.lap('validate')
+    
+    pages = 0
+    while True:
+        # The first page always runs, so every invocation makes progress
+        # even when the timeout is shorter than BACKFILL_SAFETY_SECONDS
+        remaining = remaining_seconds(context)
+        if remaining is not None and remaining < 2 * longest_page + safety_seconds:
+            if pages:
+                break
+            log(
+                'WARNING', 'backfill started with less than the safety margin',
+                backfill_id=backfill_id,
+                remaining_seconds=round(remaining, 1),
+                safety_seconds=safety_seconds
+            )
+        
+        page_started = time.monotonic()
+        response = list_backfill_page(client, checkpoint, page_size)
+        contents = response.get('Contents', [])
+        
+        records = [
+            listed_object_record(
+                source_bucket, obj['Key'], obj['Size'], obj.get('ETag')
+            )
+            for obj in contents
+        ]
+        failures = copy_listed_objects(
+            records, backup_bucket, sns_topic_arn, settings, checkpoint
+        ) if records else []
+        
+        checkpoint['failed_keys'] = (
+            checkpoint['failed_keys'] + [r['source'] for r in failures]
+        )[:MAX_REPORTED_FAILURES]
+        checkpoint['pages'] += 1
+        checkpoint['listed'] += len(contents)
+        if contents:
+            checkpoint['last_key'] = contents[-1]['Key']
+        checkpoint['continuation_token'] = response.get('NextContinuationToken')
+        if not response.get('IsTruncated'):
+            checkpoint['status'] = 'complete'
+        store.save(backfill_id, checkpoint)
+        
+        pages += 1
+        longest_page = max(longest_page, time.monotonic() - page_started)
+        log(
+            'INFO', 'backfill page completed',
+            backfill_id=backfill_id,
+            page=checkpoint['pages'],
+            objects=len(contents),
+            seconds=round(time.monotonic() - page_started, 3)
+        )
+        if checkpoint['status'] == 'complete':
+            break
+    timer.lap('copy')
+    
+    settings['notifier'].flush(timeout=flush_timeout(context))
+    if checkpoint['status'] == 'complete':
+        copied = checkpoint['copied']
+        try:
+            get_sns_client().publish(
+                TopicArn=sns_topic_arn,
+                Subject=f"AWS Backup Backfill Complete - {copied} File(s) Copied",
+                Message=format_backfill_message(backup_bucket, checkpoint)
+            )
+        except Exception as e:
+            log('ERROR', 'backfill notification failed', error=str(e))
+    elif get_bool_env('BACKFILL_SELF_INVOKE', True) and context is not None:
+        continue_backfill(context, checkpoint, store)
+    timer.lap('notify')
+    
+    throttles = get_throttle_count() - throttles_before
+    if settings['metrics_enabled']:
+        emit_metrics([], backup_bucket, settings['metrics_namespace'], throttles)
+    
+    body = dict(checkpoint, timings=timer.timings())
+    report_timings('invocation', body['timings'], body)
+    log(
+        'INFO', 'backfill invocation finished',
+        throttles=throttles,
+        backup_filter=(
+            settings['backup_filter'].stats() if settings['backup_filter'] else None
+        ),
+        **{k: v for k, v in body.items() if k != 'failed_keys'}
+    )
+    
+    return {
+        'statusCode': 200,
+        'body': json.dumps(body)
+    }
+
+
+def list_backfill_page(
+    client: Any,
+    checkpoint: Dict[str, Any],
+    page_size: int
+) -> Dict[str, Any]:
+    """
+    List the page of the source bucket that follows the checkpoint.
+    
+    The saved continuation token is used when there is one. S3 does not
+    document how long tokens stay valid, so if it is rejected the listing
+    restarts after the last key that was completed instead.
+    
+    Args:
+        client: S3 client for the source bucket
+        checkpoint: Current backfill checkpoint
+        page_size: Maximum keys to list
+        
+    Returns:
+        dict: list_objects_v2 response
+    """
+    from botocore.exceptions import ClientError
+    
+    kwargs = {
+        'Bucket': checkpoint['source_bucket'],
+        'Prefix': checkpoint['prefix'],
+        'MaxKeys': page_size
+    }
+    if checkpoint['continuation_token']:
+        try:
+            return client.list_objects_v2(
+                ContinuationToken=checkpoint['continuation_token'], **kwargs
+            )
+        except ClientError as e:
+            log(
+                'WARNING', 'continuation token rejected, resuming after last key',
+                last_key=checkpoint['last_key'],
+                error=str(e)
+            )
+    if checkpoint['last_key']:
+        kwargs['StartAfter'] = checkpoint['last_key']
+    return client.list_objects_v2(**kwargs)
+
+
+def remaining_seconds(context: Any) -> Optional[float]:
+    """Return the seconds left in the invocation, or None if unknown."""
+    if context is None or not hasattr(context, 'get_remaining_time_in_millis'):
+        return None
+    return context.get_remaining_time_in_millis() / 1000
+
+
+def continue_backfill(
+    context: Any,
+    checkpoint: Dict[str, Any],
+    store: 'S3CheckpointStore'
+) -> None:
+    """
+    Hand an unfinished backfill to a fresh asynchronous invocation.
+    
+    The checkpoint's invocation number is advanced and saved before the
+    invoke, so a late retry of this invocation recognizes itself as stale.
+    If the invoke fails no newer invocation exists, so the number is
+    rolled back before the error is raised and the retry of this
+    invocation carries the run on instead of being ignored.
+    
+    Args:
+        context: Lambda context object of the current invocation
+        checkpoint: Current backfill checkpoint
+        store: Checkpoint store holding it
+    """
+    checkpoint['invocation'] += 1
+    store.save(checkpoint['backfill_id'], checkpoint)
+    
+    try:
+        get_lambda_client().invoke(
+            FunctionName=context.invoked_function_arn,
+            InvocationType='Event',
+            Payload=json.dumps({
+                'backfill_id': checkpoint['backfill_id'],
+                'source_bucket': checkpoint['source_bucket'],
+                'prefix': checkpoint['prefix'],
+                'invocation': checkpoint['invocation']
+            }).encode()
+        )
+    except Exception as e:
+        checkpoint['invocation'] -= 1
+        store.save(checkpoint['backfill_id'], checkpoint)
+        log(
+            'ERROR', 'backfill continuation failed',
+            backfill_id=checkpoint['backfill_id'],
+            invocation=checkpoint['invocation'],
+            error=str(e)
+        )
+        raise
+    log(
+        'INFO', 'backfill continued in new invocation',
+        backfill_id=checkpoint['backfill_id'],
+        invocation=checkpoint['invocation']
+    )
+
+
+class S3CheckpointStore:
+    """
+    Keeps backfill checkpoints as small JSON objects in S3.
+    
+    Args:
+        bucket: Bucket holding the checkpoints
+        prefix: Key prefix for checkpoint objects
+    """
+    
+    def __init__(self, bucket: str, prefix: str):
+        self.bucket = bucket
+        self.prefix = prefix
+    
+    def _key(self, backfill_id: str) -> str:
+        return f"{self.prefix}{quote_plus(backfill_id)}.json"
+    
+    def load(self, backfill_id: str) -> Optional[Dict[str, Any]]:
+        """Return the saved checkpoint, or None if there is none."""
+        from botocore.exceptions import ClientError
+        
+        try:
+            response = get_s3_client_for_bucket(self.bucket).get_object(
+                Bucket=self.bucket, Key=self._key(backfill_id)
+            )
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey'):
+                return None
+            raise
+        return json.loads(response['Body'].read())
+    
+    def save(self, backfill_id: str, checkpoint: Dict[str, Any]) -> None:
+        """Write the checkpoint, replacing any earlier one."""
+        get_s3_client_for_bucket(self.bucket).put_object(
+            Bucket=self.bucket,
+            Key=self._key(backfill_id),
+            Body=json.dumps(checkpoint).encode(),
+            ContentType='application/json'
+        )
+
+
+class BloomFilter:
+    """
+    Compact, serializable set of keys with no false negatives.
+    
+    A key that was added is always reported as present; a key that was
+    not is reported as present with probability about error_rate. Keys
+    are hashed once with BLAKE2b and the bit positions derived by double
+    hashing. Lookups are counted, so callers can report how many remote
+    checks the filter saved.
+    
+    Args:
+        capacity: Number of keys the filter is sized for
+        error_rate: False positive rate at capacity
+    """
+    
+    def __init__(self, capacity: int, error_rate: float):
+        bits = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.size = max(64, -(-bits // 8) * 8)
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray(self.size // 8)
+        self.count = 0
+        self.built_at = time.time()
+        self.lookups = 0
+        self.negatives = 0
+        self._lock = threading.Lock()
+    
+    def _positions(self, key: str) -> List[int]:
+        from hashlib import blake2b
+        
+        digest = int.from_bytes(
+            blake2b(key.encode('utf-8'), digest_size=16).digest(), 'little'
+        )
+        first, step = digest & 0xFFFFFFFFFFFFFFFF, (digest >> 64) | 1
+        return [(first + i * step) % self.size for i in range(self.hashes)]
+    
+    def add_many(self, keys: List[str]) -> None:
+        """Add keys to the filter."""
+        positions = [self._positions(key) for key in keys]
+        with self._lock:
+            bits = self.bits
+            for key_positions in positions:
+                for position in key_positions:
+                    bits[position >> 3] |= 1 << (position & 7)
+            self.count += len(keys)
+    
+    def add(self, key: str) -> None:
+        """Add key to the filter."""
+        self.add_many([key])
+    
+    def __contains__(self, key: str) -> bool:
+        bits = self.bits
+        present = all(
+            bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(key)
+        )
+        with self._lock:
+            self.lookups += 1
+            if not present:
+                self.negatives += 1
+        return present
+    
+    def estimated_error_rate(self) -> float:
+        """Return the false positive rate expected for the keys added so far."""
+        return (1 - math.exp(-self.hashes * self.count / self.size)) ** self.hashes
+    
+    def stats(self) -> Dict[str, Any]:
+        """Return the filter's size, age and lookup counters."""
+        return {
+            'keys': self.count,
+            'bytes': len(self.bits),
+            'hashes': self.hashes,
+            'estimated_error_rate': round(self.estimated_error_rate(), 6),
+            'age_seconds': round(time.time() - self.built_at),
+            'lookups': self.lookups,
+            'negatives': self.negatives
+        }
+    
+    def to_bytes(self) -> bytes:
+        """Serialize the filter for from_bytes."""
+        header = BLOOM_FILTER_HEADER.pack(
+            BLOOM_FILTER_MAGIC, self.size, self.hashes, self.count, self.built_at
+        )
+        return header + bytes(self.bits)
+    
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'BloomFilter':
+        """
+        Rebuild a filter serialized by to_bytes.
+        
+        Raises:
+            ValueError: If data is not a serialized filter
+        """
+        magic, size, hashes, count, built_at = BLOOM_FILTER_HEADER.unpack_from(data)
+        if magic != BLOOM_FILTER_MAGIC or len(data) != BLOOM_FILTER_HEADER.size + size // 8:
+            raise ValueError("Not a serialized Bloom filter")
+        
+        bloom = cls.__new__(cls)
+        bloom.size, bloom.hashes, bloom.count, bloom.built_at = size, hashes, count, built_at
+        bloom.bits = bytearray(data[BLOOM_FILTER_HEADER.size:])
+        bloom.lookups = 0
+        bloom.negatives = 0
+        bloom._lock = threading.Lock()
+        return bloom
+
+
+# Backup key filters shared across warm invocations, by (bucket, prefix)
+_backup_filters: Dict[Tuple[str, str], BloomFilter] = {}
+
+
+def get_backup_filter(bucket: str, prefix: str) -> BloomFilter:
+    """
+    Return a Bloom filter of the keys under prefix in the backup bucket.
+    
+    A filter younger than BLOOM_FILTER_MAX_AGE_SECONDS is reused from
+    memory, then from /tmp, then from BLOOM_FILTER_PREFIX in the bucket
+    itself; otherwise one is built by listing the bucket and saved to
+    both. Keys backed up after the filter was built are missing from it,
+    which only costs a redundant copy, never a missed one.
+    
+    Args:
+        bucket: Backup S3 bucket name
+        prefix: Key prefix the filter covers
+        
+    Returns:
+        BloomFilter: Filter of the backup keys
+        
+    Raises:
+        ValueError: If a setting is malformed
+    """
+    import tempfile
+    
+    from botocore.exceptions import ClientError
+    
+    capacity = get_int_env('BLOOM_FILTER_CAPACITY', DEFAULT_BLOOM_FILTER_CAPACITY)
+    error_rate = get_float_env(
+        'BLOOM_FILTER_ERROR_RATE', DEFAULT_BLOOM_FILTER_ERROR_RATE
+    )
+    max_age = get_float_env(
+        'BLOOM_FILTER_MAX_AGE_SECONDS', DEFAULT_BLOOM_FILTER_MAX_AGE_SECONDS
+    )
+    if error_rate >= 1:
+        raise ValueError(f"BLOOM_FILTER_ERROR_RATE must be below 1, got {error_rate}")
+    
+    def fresh(bloom: Optional[BloomFilter]) -> bool:
+        return bloom is not None and time.time() - bloom.built_at < max_age
+    
+    bloom = _backup_filters.get((bucket, prefix))
+    if fresh(bloom):
+        return bloom
+    
+    key = f"{BLOOM_FILTER_PREFIX}keys{'-' + quote_plus(prefix) if prefix else ''}.bloom"
+    path = os.path.join(
+        tempfile.gettempdir(), f"backup-{quote_plus(bucket)}-{key.replace('/', '-')}"
+    )
+    client = get_s3_client_for_bucket(bucket)
+    
+    bloom = None
+    if os.path.exists(path):
+        try:
+            with open(path, 'rb') as f:
+                bloom = BloomFilter.from_bytes(f.read())
+        except (OSError, ValueError, struct.error) as e:
+            log('WARNING', 'cached backup filter unreadable', path=path, error=str(e))
+    source = 'tmp'
+    if not fresh(bloom):
+        try:
+            response = client.get_object(Bucket=bucket, Key=key)
+            bloom = BloomFilter.from_bytes(response['Body'].read())
+            source = 's3'
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') not in ('404', 'NoSuchKey'):
+                raise
+        except (ValueError, struct.error) as e:
+            # A truncated or corrupt upload is rebuilt and overwritten below
+            log('WARNING', 'stored backup filter unreadable', key=key, error=str(e))
+    
+    if not fresh(bloom):
+        started = time.monotonic()
+        bloom = build_backup_filter(client, bucket, prefix, capacity, error_rate)
+        source = 'listing'
+        try:
+            client.put_object(
+                Bucket=bucket,
+                Key=key,
+                Body=bloom.to_bytes(),
+                ContentType='application/octet-stream'
+            )
+        except ClientError as e:
+            log('WARNING', 'backup filter upload failed', key=key, error=str(e))
+        log(
+            'INFO', 'backup filter built',
+            bucket=bucket,
+            prefix=prefix,
+            seconds=round(time.monotonic() - started, 3),
+            **bloom.stats()
+        )
+    
+    if source != 'tmp':
+        with open(path, 'wb') as f:
+            f.write(bloom.to_bytes())
+    if bloom.count > capacity:
+        log(
+            'WARNING', 'backup filter over capacity',
+            keys=bloom.count,
+            capacity=capacity,
+            estimated_error_rate=round(bloom.estimated_error_rate(), 6)
+        )
+    
+    _backup_filters[(bucket, prefix)] = bloom
+    return bloom
+
+
+def build_backup_filter(
+    client: Any,
+    bucket: str,
+    prefix: str,
+    capacity: int,
+    error_rate: float
+) -> BloomFilter:
+    """
+    Build a Bloom filter of every key under prefix by listing the bucket.
+    
+    The listing is split with list_shards and the shards are listed in
+    parallel, as in reconciliation.
+    
+    Args:
+        client: S3 client for the bucket
+        bucket: Bucket to list
+        prefix: Key prefix to cover
+        capacity: Number of keys the filter is sized for
+        error_rate: False positive rate at capacity
+        
+    Returns:
+        BloomFilter: Filter of the listed keys
+    """
+    bloom = BloomFilter(capacity, error_rate)
+    shards = list_shards(client, bucket, prefix)
+    
+    def add_shard(shard: Tuple[str, Optional[str]]) -> None:
+        page = []
+        for key, _, _ in iter_objects(client, bucket, *shard):
+            page.append(key)
+            if len(page) >= 1000:
+                bloom.add_many(page)
+                page = []
+        bloom.add_many(page)
+    
+    workers = max(1, min(DEFAULT_RECONCILE_CONCURRENCY, len(shards)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(add_shard, shards))
+    return bloom
+
+
+def inventory_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """
+    Diff S3 Inventory reports of both buckets and queue the differences.
+    
+    Listing a bucket of hundreds of millions of objects is slow and costs
+    a request per 1,000 keys. S3 Inventory delivers the same listing as
+    compressed files, so this entry point reads the latest inventory
+    manifests of the source and backup buckets, sorts both with
+    external_sort (spilling to /tmp, so memory stays bounded), diffs them
+    with the sort-merge diff used by reconciliation, and turns the objects
+    missing or stale in the backup into a copy worklist.
+    
+    With WORKLIST_QUEUE_URL set, the worklist is sent to that SQS queue as
+    S3 event messages, which lambda_handler consumes unchanged; the queue
+    should be the one already configured as its trigger. Otherwise the
+    objects are copied inline in batches.
+    
+    The event must contain:
+        source_manifest: s3:// URL of the source bucket's manifest.json
+        backup_manifest: s3:// URL of the backup bucket's manifest.json
+    and may contain:
+        dry_run: Report differences without queueing or copying
+    
+    Args:
+        event (dict): Inventory options, as above
+        context (object): Lambda context object with runtime information
+        
+    Returns:
+        dict: Response object with statusCode and a body of counts
+        
+    Raises:
+        ValueError: If a setting or manifest is missing or unsupported
+    """
+    timer = PhaseTimer()
+    throttles_before = get_throttle_count()
+    
+    backup_bucket = os.environ.get('BACKUP_BUCKET')
+    sns_topic_arn = os.environ.get('SNS_TOPIC_ARN')
+    queue_url = os.environ.get('WORKLIST_QUEUE_URL')
+    
+    if not backup_bucket:
+        raise ValueError("BACKUP_BUCKET environment variable not set")
+    if not sns_topic_arn:
+        raise ValueError("SNS_TOPIC_ARN environment variable not set")
+    if not event.get('source_manifest') or not event.get('backup_manifest'):
+        raise ValueError(
+            "source_manifest and backup_manifest must be given in the event"
+        )
+    
+    settings = load_copy_settings()
+    settings['notification_mode'] = 'digest'
+    settings['notifier'] = Notifier(
+        sns_topic_arn,
+        batched=True,
+        asynchronous=settings['notify_async'],
+        max_workers=settings['notify_workers']
+    )
+    batch_size = get_int_env('RECONCILE_BATCH_SIZE', DEFAULT_RECONCILE_BATCH_SIZE)
+    dry_run = bool(event.get('dry_run'))
+    
+    source_manifest = load_inventory_manifest(event['source_manifest'])
+    backup_manifest = load_inventory_manifest(event['backup_manifest'])
+    source_bucket = source_manifest['sourceBucket']
+    
+    log(
+        'INFO', 'inventory diff started',
+        source_bucket=source_bucket,
+        backup_bucket=backup_bucket,
+        source_files=len(source_manifest['files']),
+        backup_files=len(backup_manifest['files']),
+        worklist_queue=queue_url,
+        dry_run=dry_run
+    )
+    timer.lap('validate')
+    
+    counts = {
+        'source_objects': 0, 'missing': 0, 'stale': 0, 'queued': 0,
+        'copied': 0, 'skipped': 0, 'failed': 0, 'copied_bytes': 0
+    }
+    failures = []
+    batch = []
+    
+    def source_rows() -> Any:
+        for row in iter_inventory(source_manifest):
+            counts['source_objects'] += 1
+            yield row
+    
+    def flush() -> None:
+        if queue_url:
+            counts['queued'] += send_worklist(queue_url, batch)
+        else:
+            failures.extend(copy_listed_objects(
+                batch, backup_bucket, sns_topic_arn, settings, counts
+            ))
+        batch.clear()
+    
+    # Inventory files are not guaranteed to be in key order
+    run_entries = get_int_env('SORT_RUN_ENTRIES', DEFAULT_SORT_RUN_ENTRIES)
+    spill_dir = os.environ.get('SORT_SPILL_DIR') or None
+    differences = diff_listings(
+        external_sort(source_rows(), run_entries, spill_dir),
+        external_sort(iter_inventory(backup_manifest), run_entries, spill_dir)
+    )
+    for key, size, etag, reason in differences:
+        counts['missing' if reason == 'missing' else 'stale'] += 1
+        if dry_run:
+            continue
+        
+        # Inventory reports can be a day old, so a key missing from the
+        # backup's report may have been copied since; it is still checked
+        batch.append(listed_object_record(source_bucket, key, size, etag))
+        if len(batch) >= batch_size:
+            flush()
+    
+    if batch:
+        flush()
+    timer.lap('copy')
+    
+    settings['notifier'].flush(timeout=flush_timeout(context))
+    timer.lap('notify')
+    
+    throttles = get_throttle_count() - throttles_before
+    if settings['metrics_enabled']:
+        emit_metrics([], backup_bucket, settings['metrics_namespace'], throttles)
+    
+    summary = dict(
+        counts,
+        message='Inventory diff completed',
+        failures=failures[:MAX_REPORTED_FAILURES],
+        timings=timer.timings()
+    )
+    report_timings('invocation', summary['timings'], summary)
+    log(
+        'WARNING' if failures else 'INFO', 'inventory diff completed',
+        throttles=throttles, **counts
+    )
+    
+    return {
+        'statusCode': 200,
+        'body': json.dumps(summary)
+    }
+
+
+def parse_s3_url(url: str) -> Tuple[str, str]:
+    """
+    Split an s3://bucket/key URL into bucket and key.
+    
+    Raises:
+        ValueError: If url is not an s3:// URL
+    """
+    if not url.startswith('s3://') or '/' not in url[len('s3://'):]:
+        raise ValueError(f"Expected an s3://bucket/key URL, got {url!r}")
+    bucket, key = url[len('s3://'):].split('/', 1)
+    return bucket, key
+
+
+def load_inventory_manifest(url: str) -> Dict[str, Any]:
+    """
+    Read an S3 Inventory manifest.json.
+    
+    Args:
+        url: s3:// URL of the manifest
+        
+    Returns:
+        dict: Parsed manifest, with the inventory destination bucket name
+            added as 'bucket' and the column names as 'columns'
+        
+    Raises:
+        ValueError: If the inventory format is not supported
+    """
+    bucket, key = parse_s3_url(url)
+    response = get_s3_client_for_bucket(bucket).get_object(Bucket=bucket, Key=key)
+    manifest = json.loads(response['Body'].read())
+    
+    if manifest['fileFormat'] not in INVENTORY_FORMATS:
+        raise ValueError(
+            f"Inventory format {manifest['fileFormat']} is not supported, "
+            f"use one of {', '.join(INVENTORY_FORMATS)}"
+        )
+    
+    # destinationBucket is an ARN such as arn:aws:s3:::inventory-bucket
+    manifest['bucket'] = manifest['destinationBucket'].rsplit(':', 1)[-1]
+    manifest['columns'] = [
+        column.strip() for column in manifest['fileSchema'].split(',')
+    ]
+    if manifest['fileFormat'] == 'CSV':
+        for column in ('Key', 'Size', 'ETag'):
+            if column not in manifest['columns']:
+                raise ValueError(f"Inventory must include the {column} field")
+    return manifest
+
+
+def iter_inventory(manifest: Dict[str, Any]) -> Any:
+    """
+    Yield (key, size, etag) for the current objects in an inventory.
+    
+    Data files are read one at a time and streamed, so memory use does not
+    grow with the size of the bucket. Noncurrent versions and delete
+    markers are ignored. Rows are yielded in file order; pass them
+    through external_sort before diffing.
+    
+    Args:
+        manifest: Manifest from load_inventory_manifest
+    """
+    for data_file in manifest['files']:
+        if manifest['fileFormat'] == 'CSV':
+            rows = iter_inventory_csv(manifest, data_file['key'])
+        else:
+            rows = iter_inventory_parquet(manifest, data_file['key'])
+        
+        for row in rows:
+            if row.get('IsLatest') in ('false', False):
+                continue
+            if row.get('IsDeleteMarker') in ('true', True):
+                continue
+            
+            yield row['Key'], int(row['Size']), f'"{row["ETag"]}"'
+
+
+def iter_inventory_csv(manifest: Dict[str, Any], key: str) -> Any:
+    """
+    Stream the rows of one gzipped CSV inventory file as dicts.
+    
+    Keys in CSV inventories are URL-encoded and are decoded here.
+    """
+    import csv
+    import gzip
+    
+    response = get_s3_client_for_bucket(manifest['bucket']).get_object(
+        Bucket=manifest['bucket'], Key=key
+    )
+    with gzip.open(response['Body'], mode='rt', encoding='utf-8', newline='') as f:
+        for values in csv.reader(f):
+            row = dict(zip(manifest['columns'], values))
+            row['Key'] = unquote_plus(row['Key'])
+            yield row
+
+
+def iter_inventory_parquet(manifest: Dict[str, Any], key: str) -> Any:
+    """
+    Stream the rows of one Parquet inventory file as dicts.
+    
+    Parquet needs random access, so the file is downloaded to /tmp and
+    read in record batches. Requires pyarrow, which is not part of the
+    Lambda runtime and must be added as a layer.
+    """
+    import tempfile
+    
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ValueError("Reading Parquet inventories requires the pyarrow package")
+    
+    with tempfile.NamedTemporaryFile(suffix='.parquet') as f:
+        get_s3_client_for_bucket(manifest['bucket']).download_fileobj(
+            manifest['bucket'], key, f
+        )
+        f.flush()
+        
+        columns = ['key', 'size', 'e_tag', 'is_latest', 'is_delete_marker']
+        parquet_file = pq.ParquetFile(f.name)
+        available = set(parquet_file.schema_arrow.names)
+        for batch in parquet_file.iter_batches(
+            columns=[c for c in columns if c in available]
+        ):
+            for row in batch.to_pylist():
+                yield {
+                    'Key': row['key'],
+                    'Size': row['size'],
+                    'ETag': row['e_tag'],
+                    'IsLatest': row.get('is_latest'),
+                    'IsDeleteMarker': row.get('is_delete_marker')
+                }
+
+
+def send_worklist(queue_url: str, records: List[Dict[str, Any]]) -> int:
+    """
+    Send records to an SQS queue as S3 event notification messages.
+    
+    Records are packed into messages of at most WORKLIST_RECORDS_PER_MESSAGE
+    records and messages into SendMessageBatch requests of at most ten,
+    both within SQS_BATCH_MAX_BYTES (see chunk_worklist). Entries SQS
+    rejects are retried once, then raise.
+    
+    Args:
+        queue_url: URL of the queue lambda_handler consumes
+        records: Records from listed_object_record
+        
+    Returns:
+        int: Number of records sent
+        
+    Raises:
+        RuntimeError: If messages could not be sent
+    """
+    client = get_sqs_client()
+    
+    for bodies in chunk_worklist(records):
+        entries = [
+            {'Id': str(index), 'MessageBody': body}
+            for index, body in enumerate(bodies)
+        ]
+        for attempt in range(2):
+            response = client.send_message_batch(QueueUrl=queue_url, Entries=entries)
+            failed_ids = {failure['Id'] for failure in response.get('Failed', [])}
+            entries = [entry for entry in entries if entry['Id'] in failed_ids]
+            if not entries:
+                break
+        if entries:
+            raise RuntimeError(
+                f"Failed to queue {len(entries)} worklist message(s) to {queue_url}"
+            )
+    
+    return len(records)
+
+
+def chunk_worklist(records: List[Dict[str, Any]]) -> List[List[str]]:
+    """
+    Pack records into S3 event message bodies grouped for SendMessageBatch.
+    
+    Sizes are counted in encoded bytes, since a listed record ranges from
+    about 250 bytes to over 3 KB for a long non-ASCII key.
+    
+    Args:
+        records: Records from listed_object_record
+        
+    Returns:
+        list: Groups of at most ten message bodies and SQS_BATCH_MAX_BYTES,
+            each body holding at most WORKLIST_RECORDS_PER_MESSAGE records
+    """
+    # The body is built from the encoded records so its size is known
+    # without serializing the message again
+    prefix, suffix, separator = '{"Records": [', ']}', ', '
+    overhead = len(prefix) + len(suffix)
+    
+    bodies = []
+    current = []
+    current_bytes = overhead
+    for record in records:
+        encoded = json.dumps(record)
+        size = len(encoded.encode('utf-8')) + (len(separator) if current else 0)
+        if current and (
+            len(current) == WORKLIST_RECORDS_PER_MESSAGE
+            or current_bytes + size > SQS_BATCH_MAX_BYTES
+        ):
+            bodies.append(prefix + separator.join(current) + suffix)
+            current = []
+            current_bytes = overhead
+            size -= len(separator)
+        current.append(encoded)
+        current_bytes += size
+    if current:
+        bodies.append(prefix + separator.join(current) + suffix)
+    
+    batches = []
+    batch = []
+    batch_bytes = 0
+    for body in bodies:
+        size = len(body.encode('utf-8'))
+        if batch and (
+            len(batch) == SQS_BATCH_MAX_ENTRIES
+            or batch_bytes + size > SQS_BATCH_MAX_BYTES
+        ):
+            batches.append(batch)
+            batch = []
+            batch_bytes = 0
+        batch.append(body)
+        batch_bytes += size
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def summarize_results(message: str, results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Build the response body summarizing a batch of per-record results.
+    
+    Args:
+        message: Human readable outcome
+        results: Per-record results from process_record
+        
+    Returns:
+        dict: Counts by status, bytes copied and the individual results
+    """
+    counts = {}
+    for result in results:
+        counts[result['status']] = counts.get(result['status'], 0) + 1
+    
+    return {
+        'message': message,
+        'records_processed': len(results),
+        'records_succeeded': counts.get('success', 0),
+        'records_skipped': counts.get('skipped', 0),
+        'records_duplicate': counts.get('duplicate', 0),
+        'records_failed': counts.get('failed', 0),
+        'total_bytes': sum(
+            r['size_bytes'] for r in results if r['status'] == 'success'
+        ),
+        'results': results
+    }
+
+
+class PhaseTimer:
+    """
+    Record how long each phase of a record or invocation takes.
+    
+    Phases are measured back to back with the monotonic clock: lap(name)
+    closes the phase that started at the previous lap (or when the timer
+    was created) and attributes its duration to name. Laps with the same
+    name accumulate.
+    """
+    
+    def __init__(self):
+        self.started = time.monotonic()
+        self._last = self.started
+        self.phases: Dict[str, float] = {}
+    
+    def lap(self, name: str) -> None:
+        """Attribute the time since the previous lap to phase name."""
+        now = time.monotonic()
+        self.phases[name] = self.phases.get(name, 0.0) + now - self._last
+        self._last = now
+    
+    def timings(self) -> Dict[str, float]:
+        """
+        Return phase durations and the total so far, in milliseconds.
+        
+        Returns:
+            dict: {'<phase>_ms': ..., 'total_ms': ...}
+        """
+        timings = {
+            f"{name}_ms": round(seconds * 1000, 1)
+            for name, seconds in self.phases.items()
+        }
+        timings['total_ms'] = round((time.monotonic() - self.started) * 1000, 1)
+        return timings
+
+
+# hook(scope, timings, result), see add_timing_hook
+TimingHook = Callable[[str, Dict[str, float], Dict[str, Any]], None]
+
+# Callbacks that receive every record and invocation timing
+_timing_hooks: List[TimingHook] = []
+
+
+def add_timing_hook(hook: TimingHook) -> None:
+    """
+    Register a callback that receives phase timings as they are recorded.
+    
+    The hook is called as hook(scope, timings, result) where scope is
+    'record' or 'invocation', timings is the dict from PhaseTimer.timings
+    and result is the per-record result or the invocation summary. Record
+    hooks run on copy worker threads, so hooks must be thread-safe. Hooks
+    persist across warm invocations until removed.
+    
+    Args:
+        hook: Callable to register
+    """
+    _timing_hooks.append(hook)
+
+
+def remove_timing_hook(hook: TimingHook) -> None:
+    """Unregister a callback added with add_timing_hook."""
+    _timing_hooks.remove(hook)
+
+
+def report_timings(
+    scope: str,
+    timings: Dict[str, float],
+    result: Dict[str, Any]
+) -> None:
+    """
+    Pass timings to every registered hook.
+    
+    A failing hook is logged and ignored so instrumentation can never fail
+    a backup.
+    
+    Args:
+        scope: 'record' or 'invocation'
+        timings: Phase durations from PhaseTimer.timings
+        result: Per-record result or invocation summary
+    """
+    for hook in list(_timing_hooks):
+        try:
+            hook(scope, timings, result)
+        except Exception as e:
+            log('WARNING', 'timing hook failed', scope=scope, error=str(e))
+
+
+def emit_metrics(
+    results: List[Dict[str, Any]],
+    backup_bucket: str,
+    namespace: str,
+    throttles: Optional[int] = None
+) -> None:
+    """
+    Write invocation metrics as CloudWatch Embedded Metric Format lines.
+    
+    CloudWatch extracts the metrics from the function's log stream, so no
+    PutMetricData request is made on the hot path. Record metrics are
+    dimensioned by SourceBucket and BackupBucket, one document per source
+    bucket and at most EMF_MAX_VALUES records; sums and latency
+    percentiles aggregate correctly across documents. ThrottleCount covers
+    every client and is dimensioned by BackupBucket only; it is left out
+    when throttles is None.
+    
+    Args:
+        results: Per-record results from process_record
+        backup_bucket: Backup S3 bucket name
+        namespace: CloudWatch metric namespace
+        throttles: Throttled AWS responses during the invocation, or None
+    """
+    timestamp = int(time.time() * 1000)
+    
+    by_source: Dict[str, List[Dict[str, Any]]] = {}
+    for result in results:
+        source_bucket = result['source'].split('/', 1)[0]
+        by_source.setdefault(source_bucket, []).append(result)
+    
+    for source_bucket, source_results in by_source.items():
+        for start in range(0, len(source_results), EMF_MAX_VALUES):
+            chunk = source_results[start:start + EMF_MAX_VALUES]
+            statuses = [r['status'] for r in chunk]
+            write_log_line({
+                '_aws': {
+                    'Timestamp': timestamp,
+                    'CloudWatchMetrics': [{
+                        'Namespace': namespace,
+                        'Dimensions': [['SourceBucket', 'BackupBucket']],
+                        'Metrics': [
+                            {'Name': 'BytesCopied', 'Unit': 'Bytes'},
+                            {'Name': 'ObjectsCopied', 'Unit': 'Count'},
+                            {'Name': 'ObjectsSkipped', 'Unit': 'Count'},
+                            {'Name': 'ObjectsFailed', 'Unit': 'Count'},
+                            {'Name': 'CopyLatency', 'Unit': 'Milliseconds'},
+                            {'Name': 'NotifyLatency', 'Unit': 'Milliseconds'}
+                        ]
+                    }]
+                },
+                'SourceBucket': source_bucket,
+                'BackupBucket': backup_bucket,
+                'BytesCopied': sum(
+                    r['size_bytes'] for r in chunk if r['status'] == 'success'
+                ),
+                'ObjectsCopied': statuses.count('success'),
+                'ObjectsSkipped': statuses.count('skipped'),
+                'ObjectsFailed': statuses.count('failed'),
+                'CopyLatency': [
+                    r['timings']['copy_ms'] for r in chunk
+                    if 'copy_ms' in r['timings']
+                ],
+                'NotifyLatency': [
+                    r['timings']['notify_ms'] for r in chunk
+                    if 'notify_ms' in r['timings']
+                ]
+            })
+    
+    if throttles is None:
+        return
+    write_log_line({
+        '_aws': {
+            'Timestamp': timestamp,
+            'CloudWatchMetrics': [{
+                'Namespace': namespace,
+                'Dimensions': [['BackupBucket']],
+                'Metrics': [{'Name': 'ThrottleCount', 'Unit': 'Count'}]
+            }]
+        },
+        'BackupBucket': backup_bucket,
+        'ThrottleCount': throttles
+    })
+
+
+def load_copy_settings() -> Dict[str, Any]:
+    """
+    Load copy tuning settings from the environment.
+    
+    Returns:
+        dict: copy_concurrency, multipart_threshold, part_size,
+            part_concurrency, skip_unchanged, notification, digest and
+            metrics settings, a fresh CopyPlanner for this invocation, the
+            idempotency store, state index and metadata cache (each None
+            if disabled) and an unset backup_filter
+        
+    Raises:
+        ValueError: If a setting is malformed or outside S3's limits
+    """
+    settings = {
+        'copy_concurrency': get_int_env(
+            'COPY_CONCURRENCY', DEFAULT_COPY_CONCURRENCY
+        ),
+        'multipart_threshold': get_int_env(
+            'MULTIPART_THRESHOLD_BYTES', DEFAULT_MULTIPART_THRESHOLD
+        ),
+        'part_size': get_int_env('PART_SIZE_BYTES', DEFAULT_PART_SIZE),
+        'part_concurrency': get_int_env(
+            'PART_CONCURRENCY', DEFAULT_PART_CONCURRENCY
+        ),
+        'skip_unchanged': get_bool_env('SKIP_UNCHANGED', True),
+        'notification_mode': os.environ.get('NOTIFICATION_MODE') or 'per_object',
+        'digest_flush_threshold': get_int_env(
+            'DIGEST_FLUSH_THRESHOLD', DEFAULT_DIGEST_FLUSH_THRESHOLD
+        ),
+        'digest_max_age_seconds': get_int_env(
+            'DIGEST_MAX_AGE_SECONDS', DEFAULT_DIGEST_MAX_AGE_SECONDS
+        ),
+        'digest_max_keys': get_int_env(
+            'DIGEST_MAX_KEYS', DEFAULT_DIGEST_MAX_KEYS
+        ),
+        'notify_async': get_bool_env('NOTIFY_ASYNC', False),
+        'notify_workers': get_int_env('NOTIFY_WORKERS', DEFAULT_NOTIFY_WORKERS),
+        'metrics_enabled': get_bool_env('METRICS_ENABLED', True),
+        'metrics_namespace': (
+            os.environ.get('METRICS_NAMESPACE') or DEFAULT_METRICS_NAMESPACE
+        )
+    }
+    
+    if not MIN_PART_SIZE <= settings['part_size'] <= MAX_PART_SIZE:
+        raise ValueError(
+            f"PART_SIZE_BYTES must be between {MIN_PART_SIZE} and "
+            f"{MAX_PART_SIZE}, got {settings['part_size']}"
+        )
+    if settings['notification_mode'] not in NOTIFICATION_MODES:
+        raise ValueError(
+            f"NOTIFICATION_MODE must be one of {', '.join(NOTIFICATION_MODES)}, "
+            f"got {settings['notification_mode']!r}"
+        )
+    if settings['multipart_threshold'] > MAX_SINGLE_COPY_SIZE:
+        raise ValueError(
+            f"MULTIPART_THRESHOLD_BYTES cannot exceed {MAX_SINGLE_COPY_SIZE}, "
+            f"got {settings['multipart_threshold']}"
+        )
+    
+    settings['planner'] = CopyPlanner(
+        settings['part_size'], settings['part_concurrency']
+    )
+    settings['idempotency_store'] = get_idempotency_store()
+    settings['state_index'] = get_state_index()
+    settings['metadata_cache'] = get_metadata_cache()
+    # Set by handlers that copy listed objects, see get_backup_filter
+    settings['backup_filter'] = None
+    
+    return settings
+
+
+def copy_records(
+    records: List[Dict[str, Any]],
+    backup_bucket: str,
+    sns_topic_arn: str,
+    settings: Dict[str, Any]
+) -> List[Dict[str, Any]]:
+    """
+    Back up a batch of S3 event records using a bounded thread pool.
+    
+    Copies are network-bound server-side requests, so fanning them out
+    across threads that share the module-level clients lets a large batch
+    finish in roughly the time of its slowest copies. Each record is
+    isolated by process_record, so one failure never cancels the others.
+    
+    Args:
+        records: S3 event records to back up
+        backup_bucket: Backup S3 bucket name
+        sns_topic_arn: ARN of the SNS topic for notifications
+        settings: Copy settings from load_copy_settings
+        
+    Returns:
+        list: Per-record results in the same order as records
+    """
+    workers = max(1, min(settings['copy_concurrency'], len(records)))
+    log('DEBUG', 'copying records', records=len(records), workers=workers)
+    
+    if workers == 1:
+        return [
+            process_record(record, backup_bucket, sns_topic_arn, settings)
+            for record in records
+        ]
+    
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(
+            lambda record: process_record(
+                record, backup_bucket, sns_topic_arn, settings
+            ),
+            records
+        ))
+
+
+def process_record(
+    record: Dict[str, Any],
+    backup_bucket: str,
+    sns_topic_arn: str,
+    settings: Dict[str, Any]
+) -> Dict[str, Any]:
+    """
+    Back up the object referenced by a single S3 event record.
+    
+    Errors are caught, logged and notified here rather than propagated so
+    that one bad record cannot stop the rest of the batch.
+    
+    Args:
+        record: A single entry from the event's Records list
+        backup_bucket: Backup S3 bucket name
+        sns_topic_arn: ARN of the SNS topic for notifications
+        settings: Copy settings from load_copy_settings
+        
+    Returns:
+        dict: Per-record result with status, source, destination, size and
+            phase timings
+    """
+    timer = PhaseTimer()
+    claimed = False
+    try:
+        # Extract file information from S3 event record
+        source_bucket = record['s3']['bucket']['name']
+        # Keys arrive URL-encoded, with spaces as '+'
+        object_key = unquote_plus(record['s3']['object']['key'])
+        file_size = record['s3']['object']['size']
+        source_etag = record['s3']['object'].get('eTag')
+        event_time = record.get('eventTime', 'Unknown')
+        
+        # Return immediately for events that were already backed up, or are
+        # being backed up by another delivery
+        store = settings['idempotency_store']
+        event_id = idempotency_key(record)
+        claimed = bool(store and event_id and store.claim(event_id))
+        duplicate = bool(store and event_id) and not claimed
+        timer.lap('validate')
+        
+        if duplicate:
+            result = {
+                'status': 'duplicate',
+                'source': f"{source_bucket}/{object_key}",
+                'destination': f"{backup_bucket}/{object_key}",
+                'size_bytes': file_size,
+                'timings': timer.timings()
+            }
+            report_timings('record', result['timings'], result)
+            log(
+                'INFO', 'record processed',
+                status='duplicate',
+                source_bucket=source_bucket,
+                key=object_key,
+                size_bytes=file_size,
+                event_time=event_time,
+                timings=result['timings']
+            )
+            return result
+        
+        # Skip the copy when the backup already holds identical content.
+        # Keys missing from the backup filter, or from the backup listing
+        # they were diffed against, cannot be in the backup, so they are
+        # copied without a HEAD request
+        backup_filter = settings['backup_filter']
+        check = (
+            settings['skip_unchanged']
+            and record.get('backupState') != 'missing'
+            and (backup_filter is None or object_key in backup_filter)
+        )
+        skipped = check and is_backup_current(
+            source_bucket, object_key, backup_bucket, file_size, source_etag,
+            settings['metadata_cache']
+        )
+        if check:
+            timer.lap('check')
+        
+        if skipped:
+            copy_result = {'method': 'skipped', 'etag': source_etag or 'N/A'}
+        else:
+            # Perform the copy operation
+            copy_result = copy_object_to_backup(
+                source_bucket, object_key, backup_bucket, file_size, settings
+            )
+            remember_backup(
+                settings['metadata_cache'], backup_bucket, object_key,
+                file_size, source_etag
+            )
+            timer.lap('copy')
+        
+        current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S UTC')
+        message_id = None
+        
+        # In digest mode successes are reported together by notify_batch
+        if settings['notification_mode'] != 'digest':
+            success_message = format_success_message(
+                object_key, file_size, source_bucket, backup_bucket, current_time,
+                skipped=skipped
+            )
+            
+            # Send success notification
+            message_id = settings['notifier'].publish(
+                'AWS Backup Success - File Replicated',
+                success_message
+            )
+        
+            timer.lap('notify')
+        
+        index = settings['state_index']
+        if index:
+            try:
+                index.record(
+                    object_key, file_size, source_etag,
+                    record['s3']['object'].get('versionId')
+                )
+            except Exception as e:
+                log('WARNING', 'state index record failed', key=object_key, error=str(e))
+            timer.lap('index')
+        
+        if claimed:
+            store.mark_processed(event_id)
+            claimed = False
+            timer.lap('idempotency')
+        
+        result = {
+            'status': 'skipped' if skipped else 'success',
+            'source': f"{source_bucket}/{object_key}",
+            'destination': f"{backup_bucket}/{object_key}",
+            'size_bytes': file_size,
+            'copy_method': copy_result['method'],
+            'copy_plan': copy_result.get('plan'),
+            'timestamp': current_time,
+            'timings': timer.timings()
+        }
+        report_timings('record', result['timings'], result)
+        
+        log(
+            'INFO', 'record processed',
+            status=result['status'],
+            source_bucket=source_bucket,
+            backup_bucket=backup_bucket,
+            key=object_key,
+            size_bytes=file_size,
+            etag=copy_result['etag'],
+            copy_method=copy_result['method'],
+            copy_plan=copy_result.get('plan'),
+            event_time=event_time,
+            notification_id=message_id,
+            timings=result['timings']
+        )
+        
+        return result
+        
+    except KeyError as e:
+        # Handle malformed record data
+        error_msg = f"Invalid event structure - missing required field: {str(e)}"
+        log('ERROR', 'record failed', error=error_msg, error_type=type(e).__name__)
+        log('DEBUG', 'invalid record structure', record=record)
+        
+        send_failure_notification(sns_topic_arn, error_msg, "Invalid Event Data")
+        
+        result = {
+            'status': 'failed',
+            'source': 'Unknown',
+            'destination': 'Unknown',
+            'size_bytes': 0,
+            'error': error_msg,
+            'error_type': type(e).__name__,
+            'timings': timer.timings()
+        }
+        report_timings('record', result['timings'], result)
+        return result
+        
+    except Exception as e:
+        # Handle all other errors
+        error_msg = f"Backup operation failed: {str(e)}"
+        error_type = type(e).__name__
+        
+        log(
+            'ERROR', 'record failed',
+            source_bucket=source_bucket if 'source_bucket' in locals() else None,
+            backup_bucket=backup_bucket,
+            key=object_key if 'object_key' in locals() else None,
+            size_bytes=file_size if 'file_size' in locals() else None,
+            error=error_msg,
+            error_type=error_type,
+            timings=timer.timings()
+        )
+        
+        # Prepare detailed error notification
+        failure_message = format_failure_message(
+            error_msg,
+            error_type,
+            object_key if 'object_key' in locals() else 'Unknown',
+            source_bucket if 'source_bucket' in locals() else 'Unknown',
+            backup_bucket
+        )
+        
+        # Attempt to send failure notification
+        try:
+            settings['notifier'].publish(
+                'AWS Backup FAILURE - Action Required',
+                failure_message
+            )
+        except Exception as sns_error:
+            log('ERROR', 'failure notification failed', error=str(sns_error))
+        
+        result = {
+            'status': 'failed',
+            'source': f"{source_bucket}/{object_key}" if 'object_key' in locals() else 'Unknown',
+            'destination': f"{backup_bucket}/{object_key}" if 'object_key' in locals() else 'Unknown',
+            'size_bytes': file_size if 'file_size' in locals() else 0,
+            'error': error_msg,
+            'error_type': error_type,
+            'timings': timer.timings()
+        }
+        report_timings('record', result['timings'], result)
+        return result
+    
+    finally:
+        if claimed:
+            store.release(event_id)
+
+
+def is_backup_current(
+    source_bucket: str,
+    object_key: str,
+    backup_bucket: str,
+    file_size: int,
+    source_etag: Optional[str],
+    cache: Optional[MetadataCache] = None
+) -> bool:
+    """
+    Check whether the backup bucket already holds an identical copy.
+    
+    S3 redelivers events and identical re-uploads trigger new ones, so a
+    HEAD on the backup object is far cheaper than a cross-region copy.
+    The backup is current when its size matches and either its ETag or
+    the source ETag recorded by the copy matches the source.
+    
+    Args:
+        source_bucket: Source S3 bucket name
+        object_key: Key of the object to check
+        backup_bucket: Backup S3 bucket name
+        file_size: Size of the source object in bytes
+        source_etag: Source ETag from the event, or None to look it up
+        cache: Optional metadata cache consulted before the HEAD request
+        
+    Returns:
+        bool: True if the copy can be skipped
+    """
+    from botocore.exceptions import ClientError
+    
+    def head_backup() -> Optional[Dict[str, Any]]:
+        try:
+            head = get_s3_client_for_bucket(backup_bucket).head_object(
+                Bucket=backup_bucket, Key=object_key
+            )
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
+        return {
+            'size': head.get('ContentLength'),
+            'etag': head.get('ETag', '').strip('"'),
+            'source_etag': head.get('Metadata', {}).get(SOURCE_ETAG_METADATA_KEY)
+        }
+    
+    try:
+        if cache:
+            backup = cache.get_or_load((backup_bucket, object_key), head_backup)
+        else:
+            backup = head_backup()
+    except ClientError as e:
+        # Copying is always safe, so any failure to check means copy
+        log(
+            'WARNING', 'backup check failed, copying anyway',
+            backup_bucket=backup_bucket,
+            key=object_key,
+            error_code=e.response.get('Error', {}).get('Code')
+        )
+        return False
+    
+    if backup is None or backup['size'] != file_size:
+        return False
+    
+    if not source_etag:
+        source_head = get_s3_client_for_bucket(source_bucket).head_object(
+            Bucket=source_bucket, Key=object_key
+        )
+        source_etag = source_head.get('ETag')
+    
+    return source_etag.strip('"') in (backup['etag'], backup['source_etag'])
+
+
+def remember_backup(
+    cache: Optional[MetadataCache],
+    backup_bucket: str,
+    object_key: str,
+    file_size: int,
+    source_etag: Optional[str]
+) -> None:
+    """
+    Record in the metadata cache that the backup now matches the source.
+    
+    A repeat event for the same content, such as a redelivery or an
+    identical re-upload, is then skipped without a HEAD request. Without
+    a source ETag the new backup cannot be described, so the cached entry
+    is dropped instead.
+    
+    Args:
+        cache: Metadata cache, or None if disabled
+        backup_bucket: Backup S3 bucket name
+        object_key: Key of the copied object
+        file_size: Size of the copied object in bytes
+        source_etag: Source ETag from the event, if known
+    """
+    if cache is None:
+        return
+    if source_etag:
+        cache.put((backup_bucket, object_key), {
+            'size': file_size,
+            'etag': None,
+            'source_etag': source_etag.strip('"')
+        })
+    else:
+        cache.invalidate((backup_bucket, object_key))
+
+
+def copy_object_to_backup(
+    source_bucket: str,
+    object_key: str,
+    backup_bucket: str,
+    file_size: int,
+    settings: Dict[str, Any]
+) -> Dict[str, Any]:
+    """
+    Copy an object to the backup bucket, choosing single or multipart copy.
+    
+    Objects at or above the multipart threshold (and always those over the
+    5 GB copy_object limit) are copied with parallel UploadPartCopy calls.
+    
+    Args:
+        source_bucket: Source S3 bucket name
+        object_key: Key of the object to copy
+        backup_bucket: Backup S3 bucket name
+        file_size: Size of the source object in bytes
+        settings: Copy settings from load_copy_settings
+        
+    Returns:
+        dict: Copy method used, resulting ETag and number of parts
+    """
+    if file_size >= settings['multipart_threshold']:
+        return multipart_copy(
+            source_bucket,
+            object_key,
+            backup_bucket,
+            file_size,
+            settings['planner']
+        )
+    
+    copy_source = {
+        'Bucket': source_bucket,
+        'Key': object_key
+    }
+    
+    # The backup's own ETag differs from the source's for multipart and
+    # SSE-KMS sources, so stamp the source ETag as multipart copies do
+    source_head = get_s3_client_for_bucket(source_bucket).head_object(
+        Bucket=source_bucket, Key=object_key
+    )
+    
+    copy_response = get_s3_client_for_bucket(backup_bucket).copy_object(
+        CopySource=copy_source,
+        CopySourceIfMatch=source_head['ETag'],
+        Bucket=backup_bucket,
+        Key=object_key,
+        MetadataDirective='REPLACE',
+        ServerSideEncryption='AES256',  # Enable encryption on backup
+        **backup_object_args(source_head)
+    )
+    
+    return {
+        'method': 'single',
+        'etag': copy_response.get('CopyObjectResult', {}).get('ETag', 'N/A'),
+        'parts': 1
+    }
+
+
+def backup_object_args(source_head: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Build the metadata arguments that recreate a source object's headers.
+    
+    Both copy paths write their own metadata, so the source's content
+    headers and user metadata are carried over, and the source ETag is
+    recorded under SOURCE_ETAG_METADATA_KEY for is_backup_current.
+    
+    Args:
+        source_head: head_object response for the source object
+        
+    Returns:
+        dict: Keyword arguments for copy_object or create_multipart_upload
+    """
+    args = {
+        key: source_head[key]
+        for key in (
+            'ContentType', 'ContentEncoding', 'ContentDisposition',
+            'ContentLanguage', 'CacheControl'
+        )
+        if source_head.get(key)
+    }
+    args['Metadata'] = {
+        **source_head.get('Metadata', {}),
+        SOURCE_ETAG_METADATA_KEY: source_head.get('ETag', '').strip('"')
+    }
+    return args
+
+
+def multipart_copy(
+    source_bucket: str,
+    object_key: str,
+    backup_bucket: str,
+    file_size: int,
+    planner: 'CopyPlanner'
+) -> Dict[str, Any]:
+    """
+    Copy a large object with a server-side multipart upload.
+    
+    The source is split into byte ranges that are copied in parallel with
+    upload_part_copy. Every part is pinned to the ETag the source had when
+    the upload started, so an overwrite during the copy fails the part
+    instead of mixing ranges of two versions under the old ETag stamp. If
+    any part fails the upload is aborted so no orphaned parts are left
+    accruing storage charges.
+    
+    Args:
+        source_bucket: Source S3 bucket name
+        object_key: Key of the object to copy
+        backup_bucket: Backup S3 bucket name
+        file_size: Size of the source object in bytes
+        planner: Planner that sizes the parts and records their throughput
+        
+    Returns:
+        dict: Copy method used, resulting ETag, number of parts and the
+            plan that was followed
+    """
+    plan = planner.plan(file_size)
+    part_size = plan['part_size']
+    part_count = plan['part_count']
+    copy_source = {
+        'Bucket': source_bucket,
+        'Key': object_key
+    }
+    
+    log('DEBUG', 'multipart copy planned', key=object_key, plan=plan)
+    
+    # Multipart uploads do not inherit source metadata, so carry it over
+    backup_client = get_s3_client_for_bucket(backup_bucket)
+    source_head = get_s3_client_for_bucket(source_bucket).head_object(
+        Bucket=source_bucket, Key=object_key
+    )
+    source_etag = source_head['ETag']
+    
+    upload = backup_client.create_multipart_upload(
+        Bucket=backup_bucket,
+        Key=object_key,
+        ServerSideEncryption='AES256',  # Enable encryption on backup
+        **backup_object_args(source_head)
+    )
+    upload_id = upload['UploadId']
+    
+    def copy_part(part_number: int) -> Dict[str, Any]:
+        start = (part_number - 1) * part_size
+        end = min(start + part_size, file_size) - 1
+        part_started = time.monotonic()
+        response = backup_client.upload_part_copy(
+            Bucket=backup_bucket,
+            Key=object_key,
+            CopySource=copy_source,
+            CopySourceRange=f"bytes={start}-{end}",
+            CopySourceIfMatch=source_etag,
+            PartNumber=part_number,
+            UploadId=upload_id
+        )
+        planner.record_part(
+            end - start + 1, time.monotonic() - part_started, plan['concurrency']
+        )
+        return {
+            'ETag': response['CopyPartResult']['ETag'],
+            'PartNumber': part_number
+        }
+    
+    copy_started = time.monotonic()
+    try:
+        with ThreadPoolExecutor(max_workers=plan['concurrency']) as executor:
+            parts = list(executor.map(copy_part, range(1, part_count + 1)))
+        
+        response = backup_client.complete_multipart_upload(
+            Bucket=backup_bucket,
+            Key=object_key,
+            UploadId=upload_id,
+            MultipartUpload={'Parts': parts}
+        )
+    except Exception as e:
+        error_code = getattr(e, 'response', {}).get('Error', {}).get('Code')
+        log(
+            'ERROR',
+            'source changed during multipart copy, aborting'
+            if error_code == 'PreconditionFailed'
+            else 'multipart copy failed, aborting',
+            key=object_key,
+            upload_id=upload_id,
+            error_code=error_code
+        )
+        try:
+            backup_client.abort_multipart_upload(
+                Bucket=backup_bucket,
+                Key=object_key,
+                UploadId=upload_id
+            )
+        except Exception as abort_error:
+            log(
+                'ERROR', 'multipart abort failed',
+                key=object_key,
+                upload_id=upload_id,
+                error=str(abort_error)
+            )
+        raise
+    
+    duration = time.monotonic() - copy_started
+    plan['duration_seconds'] = round(duration, 3)
+    plan['throughput_bytes_per_second'] = (
+        round(file_size / duration) if duration > 0 else None
+    )
+    
+    return {
+        'method': 'multipart',
+        'etag': response.get('ETag', 'N/A'),
+        'parts': part_count,
+        'plan': plan
+    }
+
+
+class CopyPlanner:
+    """
+    Chooses part size and parallelism for multipart copies.
+    
+    The first large copy of an invocation uses the configured part size
+    and max_concurrency parallel parts. Later copies are planned from the
+    last PLANNER_WINDOW_PARTS parts: parts are sized from the mean
+    per-part throughput, aiming for TARGET_PART_SECONDS per part, and
+    parallelism from how much slower the average part ran than the
+    fastest. Parts slowed by sharing bandwidth with each other moved no
+    more data in aggregate than fewer uncontended parts would have, so
+    parallelism drops to that number; while parts run at full speed it
+    grows by one per copy, up to max_concurrency. Parts are sized so the
+    copy runs in whole waves, and every plan respects S3's 5 MiB to 5 GiB
+    part size range and 10,000 part limit.
+    """
+    
+    def __init__(self, part_size: int, max_concurrency: int):
+        self.part_size = part_size
+        self.max_concurrency = max_concurrency
+        self._lock = threading.Lock()
+        self._parts = deque(maxlen=PLANNER_WINDOW_PARTS)
+    
+    def record_part(self, size: int, seconds: float, concurrency: int = 1) -> None:
+        """
+        Record the size and duration of a completed part copy.
+        
+        Args:
+            size: Bytes copied by the part
+            seconds: Wall-clock duration of the upload_part_copy call
+            concurrency: Parts the copy was running in parallel
+        """
+        if seconds <= 0:
+            return
+        with self._lock:
+            self._parts.append((size, seconds, concurrency))
+    
+    def observed(self) -> Optional[Dict[str, float]]:
+        """
+        Summarize the recent part copies.
+        
+        Returns:
+            dict: Part count, mean part latency, mean and best per-part
+                throughput and mean parts in flight, or None if nothing
+                has been recorded yet
+        """
+        with self._lock:
+            parts = list(self._parts)
+        if not parts:
+            return None
+        total_bytes = sum(size for size, _, _ in parts)
+        total_seconds = sum(seconds for _, seconds, _ in parts)
+        return {
+            'parts': len(parts),
+            'part_latency_seconds': total_seconds / len(parts),
+            'part_throughput_bytes_per_second': total_bytes / total_seconds,
+            'best_part_throughput_bytes_per_second': max(
+                size / seconds for size, seconds, _ in parts
+            ),
+            'parts_in_flight': (
+                sum(seconds * concurrency for _, seconds, concurrency in parts)
+                / total_seconds
+            )
+        }
+    
+    def plan(self, file_size: int) -> Dict[str, Any]:
+        """
+        Plan a multipart copy for an object of the given size.
+        
+        Args:
+            file_size: Size of the source object in bytes
+            
+        Returns:
+            dict: part_size, part_count, concurrency, the basis of the
+                decision and the observations it was based on
+        """
+        observed = self.observed()
+        if observed:
+            basis = 'observed'
+            throughput = observed['part_throughput_bytes_per_second']
+            target = throughput * TARGET_PART_SECONDS
+            # Uncontended parts needed for the aggregate throughput achieved,
+            # plus one to probe whether more parallelism would help
+            concurrency = math.ceil(
+                observed['parts_in_flight'] * throughput
+                / observed['best_part_throughput_bytes_per_second']
+            ) + 1
+        else:
+            basis = 'configured'
+            target = self.part_size
+            concurrency = self.max_concurrency
+        concurrency = max(1, min(concurrency, self.max_concurrency))
+        
+        # Split into whole waves of parallel parts so the last wave does
+        # not leave most workers idle while a few parts finish
+        waves = max(1, math.ceil(file_size / (target * concurrency)))
+        part_size = math.ceil(file_size / (waves * concurrency))
+        
+        # Clamp to S3's part size and part count limits
+        part_size = max(part_size, MIN_PART_SIZE, math.ceil(file_size / MAX_PARTS))
+        part_size = min(part_size, MAX_PART_SIZE)
+        part_count = max(1, math.ceil(file_size / part_size))
+        
+        return {
+            'part_size': part_size,
+            'part_count': part_count,
+            'concurrency': min(concurrency, part_count),
+            'basis': basis,
+            'observed_part_latency_seconds': (
+                round(observed['part_latency_seconds'], 3) if observed else None
+            ),
+            'observed_part_throughput_bytes_per_second': (
+                round(observed['part_throughput_bytes_per_second']) if observed else None
+            ),
+            'observed_best_part_throughput_bytes_per_second': (
+                round(observed['best_part_throughput_bytes_per_second']) if observed else None
+            ),
+            'observed_parts_in_flight': (
+                round(observed['parts_in_flight'], 1) if observed else None
+            )
+        }
+
+
+def idempotency_key(record: Dict[str, Any]) -> Optional[str]:
+    """
+    Build the idempotency key identifying a single S3 event.
+    
+    S3 gives every change to a key a sequencer that increases with each
+    write, so together with the bucket, key and version it identifies one
+    upload no matter how many times its event is delivered.
+    
+    Args:
+        record: A single entry from the event's Records list
+        
+    Returns:
+        str: Idempotency key, or None if the record has no sequencer
+    """
+    s3_object = record['s3']['object']
+    sequencer = s3_object.get('sequencer')
+    if not sequencer:
+        return None
+    
+    return '/'.join((
+        record['s3']['bucket']['name'],
+        s3_object['key'],
+        s3_object.get('versionId') or '',
+        sequencer
+    ))
+
+
+class MemoryIdempotencyStore:
+    """
+    In-process LRU record of processed events.
+    
+    Lives for the lifetime of a warm container, so it catches duplicate
+    deliveries that land on the same container without any remote call.
+    Events being processed are claimed, so duplicates within one batch
+    are not copied twice either.
+    """
+    
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._claims = set()
+        self._lock = threading.Lock()
+    
+    def is_processed(self, key: str) -> bool:
+        """Return True if the event has already been processed."""
+        with self._lock:
+            if key not in self._entries:
+                return False
+            self._entries.move_to_end(key)
+            return True
+    
+    def claim(self, key: str) -> bool:
+        """Claim the event; False if it is processed or already claimed."""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return False
+            if key in self._claims:
+                return False
+            self._claims.add(key)
+            return True
+    
+    def release(self, key: str) -> None:
+        """Give up a claim so a redelivery of the event is processed."""
+        with self._lock:
+            self._claims.discard(key)
+    
+    def mark_processed(self, key: str) -> None:
+        """Record the event as processed, evicting the oldest if full."""
+        with self._lock:
+            self._claims.discard(key)
+            self._entries[key] = time.time()
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class DynamoDBIdempotencyStore:
+    """
+    Record of processed events shared by all containers via DynamoDB.
+    
+    The table needs a string partition key named idempotency_key. Items
+    carry an expires_at attribute that can be enabled as the table's TTL
+    attribute so old entries are removed automatically. An optional
+    MemoryIdempotencyStore in front answers repeat lookups locally.
+    
+    An event is claimed with a conditional put before it is copied, so of
+    several containers receiving the same event only one copies it. The
+    claim is a lease of IDEMPOTENCY_LEASE_SECONDS, taken over if the
+    container holding it dies; mark_processed turns it into a processed
+    entry, and release deletes it when the copy fails.
+    
+    Args:
+        table_name: Name of the DynamoDB table
+        ttl_seconds: How long processed events are remembered
+        cache: Optional in-memory store consulted before the table
+        client: DynamoDB client, created on first use if not provided
+    """
+    
+    def __init__(
+        self,
+        table_name: str,
+        ttl_seconds: int,
+        cache: Optional[MemoryIdempotencyStore] = None,
+        client: Any = None
+    ):
+        self.table_name = table_name
+        self.ttl_seconds = ttl_seconds
+        self.cache = cache
+        self._client = client
+    
+    @property
+    def client(self) -> Any:
+        if self._client is None:
+            self._client = create_client('dynamodb')
+        return self._client
+    
+    def claim(self, key: str) -> bool:
+        """Claim the event; False if it is processed or being processed."""
+        if self.cache and self.cache.is_processed(key):
+            return False
+        
+        from botocore.exceptions import ClientError
+        
+        now = int(time.time())
+        try:
+            self.client.put_item(
+                TableName=self.table_name,
+                Item={
+                    'idempotency_key': {'S': key},
+                    'status': {'S': 'processing'},
+                    'expires_at': {'N': str(now + IDEMPOTENCY_LEASE_SECONDS)}
+                },
+                # Processed entries are never overwritten, even past their
+                # TTL; only an abandoned claim is taken over
+                ConditionExpression=(
+                    'attribute_not_exists(idempotency_key)'
+                    ' OR (#status = :processing AND expires_at <= :now)'
+                ),
+                ExpressionAttributeNames={'#status': 'status'},
+                ExpressionAttributeValues={
+                    ':processing': {'S': 'processing'},
+                    ':now': {'N': str(now)}
+                }
+            )
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') == 'ConditionalCheckFailedException':
+                return False
+            # Treat the event as new; a redundant copy is safe
+            log('WARNING', 'idempotency claim failed', error=str(e))
+        except Exception as e:
+            log('WARNING', 'idempotency claim failed', error=str(e))
+        return True
+    
+    def release(self, key: str) -> None:
+        """Delete the claim so a redelivery of the event is processed."""
+        try:
+            self.client.delete_item(
+                TableName=self.table_name,
+                Key={'idempotency_key': {'S': key}},
+                ConditionExpression='#status = :processing',
+                ExpressionAttributeNames={'#status': 'status'},
+                ExpressionAttributeValues={':processing': {'S': 'processing'}}
+            )
+        except Exception as e:
+            # The lease expires on its own
+            log('WARNING', 'idempotency release failed', error=str(e))
+    
+    def mark_processed(self, key: str) -> None:
+        """Record the event as processed in the cache and the table."""
+        if self.cache:
+            self.cache.mark_processed(key)
+        
+        now = int(time.time())
+        try:
+            self.client.put_item(
+                TableName=self.table_name,
+                Item={
+                    'idempotency_key': {'S': key},
+                    'status': {'S': 'processed'},
+                    'processed_at': {'N': str(now)},
+                    'expires_at': {'N': str(now + self.ttl_seconds)}
+                }
+            )
+        except Exception as e:
+            log('WARNING', 'idempotency record failed', error=str(e))
+
+
+# Idempotency store shared across warm invocations, rebuilt if its
+# configuration changes
+_idempotency_store = None
+_idempotency_config = None
+
+
+def get_idempotency_store() -> Any:
+    """
+    Return the idempotency store configured by the environment.
+    
+    IDEMPOTENCY_ENABLED turns deduplication off entirely. With
+    IDEMPOTENCY_TABLE set, events are recorded in DynamoDB behind an
+    in-memory cache; otherwise only the in-memory store is used.
+    
+    Returns:
+        object: Store with claim, mark_processed and release, or None if
+            idempotency is disabled
+        
+    Raises:
+        ValueError: If a setting is malformed
+    """
+    global _idempotency_store, _idempotency_config
+    
+    config = (
+        get_bool_env('IDEMPOTENCY_ENABLED', True),
+        get_int_env('IDEMPOTENCY_CACHE_SIZE', DEFAULT_IDEMPOTENCY_CACHE_SIZE),
+        os.environ.get('IDEMPOTENCY_TABLE'),
+        get_int_env('IDEMPOTENCY_TTL_SECONDS', DEFAULT_IDEMPOTENCY_TTL_SECONDS)
+    )
+    if config == _idempotency_config:
+        return _idempotency_store
+    
+    enabled, cache_size, table_name, ttl_seconds = config
+    if not enabled:
+        store = None
+    elif table_name:
+        store = DynamoDBIdempotencyStore(
+            table_name, ttl_seconds, cache=MemoryIdempotencyStore(cache_size)
+        )
+    else:
+        store = MemoryIdempotencyStore(cache_size)
+    
+    _idempotency_store, _idempotency_config = store, config
+    return store
+
+
+# Backup object metadata cache shared across warm invocations, rebuilt if
+# its configuration changes
+_metadata_cache = None
+_metadata_cache_config = None
+
+
+def get_metadata_cache() -> Optional[MetadataCache]:
+    """
+    Return the backup object metadata cache configured by the environment.
+    
+    The cache keeps what is_backup_current learns about backup objects,
+    and what a copy makes them, for METADATA_CACHE_TTL_SECONDS, so repeat
+    events for hot keys skip the HEAD request. A backup object changed by
+    anything other than this function within the TTL is not noticed
+    until its entry expires.
+    
+    Returns:
+        MetadataCache: The shared cache, or None if METADATA_CACHE_ENABLED
+            is false
+        
+    Raises:
+        ValueError: If a setting is malformed
+    """
+    global _metadata_cache, _metadata_cache_config
+    
+    config = (
+        get_bool_env('METADATA_CACHE_ENABLED', True),
+        get_int_env('METADATA_CACHE_SIZE', DEFAULT_METADATA_CACHE_SIZE),
+        get_float_env('METADATA_CACHE_TTL_SECONDS', DEFAULT_METADATA_CACHE_TTL_SECONDS)
+    )
+    if config == _metadata_cache_config:
+        return _metadata_cache
+    
+    enabled, max_entries, ttl_seconds = config
+    cache = MetadataCache(max_entries, ttl_seconds) if enabled else None
+    
+    _metadata_cache, _metadata_cache_config = cache, config
+    return cache
+
+
+def metadata_cache_stats(settings: Dict[str, Any]) -> Dict[str, Any]:
+    """Return the counters of the metadata and bucket region caches."""
+    cache = settings['metadata_cache']
+    return {
+        'objects': cache.stats() if cache else None,
+        'bucket_regions': _bucket_regions.stats()
+    }
+
+
+class SQLiteStateIndex:
+    """
+    Local SQLite index of backed-up objects, shared through S3.
+    
+    Every object that process_record copies, or finds already current in
+    the backup bucket, is recorded with its version ID, source ETag, size
+    and backup time, so tooling can ask whether keys are backed up without
+    a HEAD request per key. Rows are written to a local database file that
+    starts empty, so recording never waits for S3.
+    
+    The rows recorded since the last sync are also held in memory, and
+    sync uploads just those as a small compressed delta object of its own
+    under the snapshot key, so containers never contend for one object and
+    a sync costs the same however large the index grows. compact, run on a schedule by
+    state_index_compact_handler, folds the deltas into the snapshot and
+    deletes them. Lookups first load the snapshot and any deltas not yet
+    folded in, keeping the newest row per key. Rows not yet synced are
+    lost with the container, so a missing row means unknown rather than
+    not backed up.
+    
+    Args:
+        bucket: Bucket holding the snapshot and deltas
+        key: Key of the snapshot object; deltas are kept under key + '.deltas/'
+        path: Local database file, replaced on first use
+        sync_seconds: Minimum interval between delta uploads by sync_if_due
+    """
+    
+    def __init__(
+        self,
+        bucket: str,
+        key: str = DEFAULT_STATE_INDEX_KEY,
+        path: Optional[str] = None,
+        sync_seconds: float = DEFAULT_STATE_INDEX_SYNC_SECONDS
+    ):
+        import tempfile
+        
+        self.bucket = bucket
+        self.key = key
+        self.delta_prefix = f"{key}.deltas/"
+        self.path = path or os.path.join(tempfile.gettempdir(), 'backup-state.db')
+        self.sync_seconds = sync_seconds
+        self._connection = None
+        self._loaded = False
+        self._remote_etag = None
+        self._merged_deltas = set()
+        self._pending = {}
+        self._last_sync = time.monotonic()
+        self._lock = threading.RLock()
+    
+    @property
+    def connection(self) -> Any:
+        with self._lock:
+            if self._connection is None:
+                if os.path.exists(self.path):
+                    os.remove(self.path)
+                self._connection = open_state_database(self.path)
+            return self._connection
+    
+    def record(
+        self,
+        key: str,
+        size: int,
+        etag: Optional[str],
+        version_id: Optional[str] = None
+    ) -> None:
+        """Record key as backed up now, replacing any earlier row."""
+        row = (key, version_id, etag.strip('"') if etag else None, size, time.time())
+        with self._lock:
+            connection = self.connection
+            connection.execute(
+                'INSERT INTO backed_up_objects VALUES (?, ?, ?, ?, ?) '
+                'ON CONFLICT(key) DO UPDATE SET version_id = excluded.version_id, '
+                'etag = excluded.etag, size = excluded.size, '
+                'backed_up_at = excluded.backed_up_at',
+                row
+            )
+            connection.commit()
+            self._pending[key] = row
+    
+    def lookup(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return the row recorded for key, or None."""
+        return self.lookup_many([key]).get(key)
+    
+    def lookup_many(self, keys: List[str]) -> Dict[str, Dict[str, Any]]:
+        """
+        Return the rows recorded for any of keys.
+        
+        The snapshot and deltas are loaded by the first lookup; call
+        refresh to pick up later syncs.
+        
+        Args:
+            keys: Object keys to look up
+            
+        Returns:
+            dict: key -> {'version_id', 'etag', 'size', 'backed_up_at'}
+                for the keys that are in the index
+        """
+        found = {}
+        with self._lock:
+            if not self._loaded:
+                self.refresh()
+            connection = self.connection
+            for start in range(0, len(keys), STATE_INDEX_LOOKUP_CHUNK):
+                chunk = keys[start:start + STATE_INDEX_LOOKUP_CHUNK]
+                rows = connection.execute(
+                    'SELECT key, version_id, etag, size, backed_up_at '
+                    'FROM backed_up_objects WHERE key IN '
+                    f"({', '.join('?' * len(chunk))})",
+                    chunk
+                )
+                for key, version_id, etag, size, backed_up_at in rows:
+                    found[key] = {
+                        'version_id': version_id,
+                        'etag': etag,
+                        'size': size,
+                        'backed_up_at': backed_up_at
+                    }
+        return found
+    
+    def is_backed_up(
+        self,
+        key: str,
+        size: Optional[int] = None,
+        etag: Optional[str] = None
+    ) -> bool:
+        """Return True if key is recorded, with the given size and ETag if set."""
+        row = self.lookup(key)
+        if row is None:
+            return False
+        if size is not None and row['size'] != size:
+            return False
+        return etag is None or row['etag'] == etag.strip('"')
+    
+    def refresh(self) -> None:
+        """
+        Merge in the snapshot, if it changed, and every delta not yet merged.
+        
+        A delta deleted by a compaction between listing and reading has
+        been folded into a newer snapshot, so the merge starts over.
+        
+        Raises:
+            RuntimeError: If compactions kept replacing the snapshot for
+                STATE_INDEX_SYNC_ATTEMPTS attempts
+        """
+        with self._lock:
+            for attempt in range(STATE_INDEX_SYNC_ATTEMPTS):
+                self._merge_snapshot()
+                if self._merge_deltas():
+                    self._loaded = True
+                    return
+                log(
+                    'DEBUG', 'state index delta compacted during load, retrying',
+                    key=self.key, attempt=attempt + 1
+                )
+        raise RuntimeError(
+            f"State index s3://{self.bucket}/{self.key} kept changing during "
+            f"{STATE_INDEX_SYNC_ATTEMPTS} load attempts"
+        )
+    
+    def sync_if_due(self) -> bool:
+        """
+        Sync if there are new rows and sync_seconds have passed since the last.
+        
+        Failures are logged rather than raised, since the index is only a
+        cache of what the backup bucket holds.
+        
+        Returns:
+            bool: True if a delta was uploaded
+        """
+        if not self._pending or time.monotonic() - self._last_sync < self.sync_seconds:
+            return False
+        try:
+            return self.sync()
+        except Exception as e:
+            log('WARNING', 'state index sync failed', key=self.key, error=str(e))
+            return False
+    
+    def sync(self) -> bool:
+        """
+        Upload the rows recorded since the last sync as a delta object.
+        
+        Returns:
+            bool: True if a delta was uploaded, False if there was nothing
+                new to upload
+        """
+        import gzip
+        import uuid
+        
+        with self._lock:
+            if not self._pending:
+                return False
+            self._last_sync = time.monotonic()
+            rows = list(self._pending.values())
+            self._pending = {}
+        
+        delta_key = (
+            f"{self.delta_prefix}{int(time.time() * 1000):013d}-{uuid.uuid4().hex}.json.gz"
+        )
+        body = gzip.compress(json.dumps(rows).encode(), compresslevel=6)
+        try:
+            get_s3_client_for_bucket(self.bucket).put_object(
+                Bucket=self.bucket,
+                Key=delta_key,
+                Body=body,
+                ContentType='application/gzip'
+            )
+        except BaseException:
+            with self._lock:
+                # Rows recorded again during the upload are newer
+                for row in rows:
+                    self._pending.setdefault(row[0], row)
+            raise
+        
+        with self._lock:
+            self._merged_deltas.add(delta_key)
+        log('DEBUG', 'state index synced', key=delta_key, rows=len(rows), bytes=len(body))
+        return True
+    
+    def compact(self) -> int:
+        """
+        Fold every delta into the snapshot and delete the folded deltas.
+        
+        The snapshot is replaced with a conditional put, so concurrent
+        compactions cannot lose each other's rows; the loser starts over
+        from the new snapshot.
+        
+        Returns:
+            int: Number of deltas folded in
+            
+        Raises:
+            RuntimeError: If other compactions kept replacing the snapshot
+                for STATE_INDEX_SYNC_ATTEMPTS attempts
+        """
+        import tempfile
+        
+        client = get_s3_client_for_bucket(self.bucket)
+        for attempt in range(STATE_INDEX_SYNC_ATTEMPTS):
+            fd, path = tempfile.mkstemp(prefix='backup-state-compact-', suffix='.db')
+            os.close(fd)
+            try:
+                etag = self._download(path)
+                connection = open_state_database(path)
+                try:
+                    deltas = [
+                        key for key, _, _ in iter_objects(client, self.bucket, self.delta_prefix)
+                    ]
+                    for delta_key in deltas:
+                        rows = self._read_delta(delta_key)
+                        if rows is not None:
+                            merge_state_rows(connection, rows)
+                    connection.commit()
+                finally:
+                    connection.close()
+                if not deltas:
+                    return 0
+                if self._upload(path, etag):
+                    break
+            finally:
+                os.remove(path)
+            log(
+                'DEBUG', 'state index snapshot changed, compacting again',
+                key=self.key, attempt=attempt + 1
+            )
+        else:
+            raise RuntimeError(
+                f"State index s3://{self.bucket}/{self.key} kept changing during "
+                f"{STATE_INDEX_SYNC_ATTEMPTS} compaction attempts"
+            )
+        
+        for start in range(0, len(deltas), 1000):
+            client.delete_objects(
+                Bucket=self.bucket,
+                Delete={
+                    'Objects': [{'Key': key} for key in deltas[start:start + 1000]],
+                    'Quiet': True
+                }
+            )
+        log('INFO', 'state index compacted', key=self.key, deltas=len(deltas))
+        return len(deltas)
+    
+    def _upload(self, path: str, etag: Optional[str]) -> bool:
+        """Put path as the snapshot unless it was replaced since etag was read."""
+        from botocore.exceptions import ClientError
+        
+        condition = {'IfMatch': etag} if etag else {'IfNoneMatch': '*'}
+        try:
+            with open(path, 'rb') as f:
+                get_s3_client_for_bucket(self.bucket).put_object(
+                    Bucket=self.bucket,
+                    Key=self.key,
+                    Body=f,
+                    ContentType='application/vnd.sqlite3',
+                    **condition
+                )
+        except ClientError as e:
+            code = e.response.get('Error', {}).get('Code')
+            if code in ('PreconditionFailed', 'ConditionalRequestConflict'):
+                return False
+            raise
+        log('DEBUG', 'state index snapshot uploaded', key=self.key, bytes=os.path.getsize(path))
+        return True
+    
+    def _download(self, path: str) -> Optional[str]:
+        """Replace path with the snapshot from S3, returning its ETag or None."""
+        import shutil
+        
+        from botocore.exceptions import ClientError
+        
+        if os.path.exists(path):
+            os.remove(path)
+        try:
+            response = get_s3_client_for_bucket(self.bucket).get_object(
+                Bucket=self.bucket, Key=self.key
+            )
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey'):
+                return None
+            raise
+        with open(path, 'wb') as f:
+            shutil.copyfileobj(response['Body'], f)
+        return response.get('ETag')
+    
+    def _read_delta(self, delta_key: str) -> Optional[List[List[Any]]]:
+        """Return the rows of a delta, or None if it no longer exists."""
+        import gzip
+        
+        from botocore.exceptions import ClientError
+        
+        try:
+            response = get_s3_client_for_bucket(self.bucket).get_object(
+                Bucket=self.bucket, Key=delta_key
+            )
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey'):
+                return None
+            raise
+        return json.loads(gzip.decompress(response['Body'].read()))
+    
+    def _merge_snapshot(self) -> None:
+        """Merge the S3 snapshot into the local database if it changed."""
+        import tempfile
+        
+        from botocore.exceptions import ClientError
+        
+        try:
+            head = get_s3_client_for_bucket(self.bucket).head_object(
+                Bucket=self.bucket, Key=self.key
+            )
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return
+            raise
+        if head.get('ETag') == self._remote_etag:
+            return
+        
+        fd, path = tempfile.mkstemp(prefix='backup-state-remote-', suffix='.db')
+        os.close(fd)
+        try:
+            etag = self._download(path)
+            if etag is not None:
+                connection = self.connection
+                connection.execute('ATTACH DATABASE ? AS remote', (path,))
+                try:
+                    # WHERE true lets the parser tell ON CONFLICT from a join
+                    connection.execute(
+                        'INSERT INTO backed_up_objects '
+                        'SELECT * FROM remote.backed_up_objects WHERE true '
+                        'ON CONFLICT(key) DO UPDATE SET version_id = excluded.version_id, '
+                        'etag = excluded.etag, size = excluded.size, '
+                        'backed_up_at = excluded.backed_up_at '
+                        'WHERE excluded.backed_up_at > backed_up_objects.backed_up_at'
+                    )
+                    connection.commit()
+                finally:
+                    connection.execute('DETACH DATABASE remote')
+            self._remote_etag = etag
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+    
+    def _merge_deltas(self) -> bool:
+        """Merge deltas not yet merged; False if one vanished meanwhile."""
+        client = get_s3_client_for_bucket(self.bucket)
+        for delta_key, _, _ in iter_objects(client, self.bucket, self.delta_prefix):
+            if delta_key in self._merged_deltas:
+                continue
+            rows = self._read_delta(delta_key)
+            if rows is None:
+                return False
+            merge_state_rows(self.connection, rows)
+            self.connection.commit()
+            self._merged_deltas.add(delta_key)
+        return True
+
+
+def open_state_database(path: str) -> Any:
+    """
+    Open a state index database, creating its table if needed.
+    
+    Args:
+        path: Database file
+        
+    Returns:
+        sqlite3.Connection: Connection usable from any thread
+    """
+    import sqlite3
+    
+    # The copies in S3 are the durable ones, so local writes need not
+    # survive a crash
+    connection = sqlite3.connect(path, check_same_thread=False)
+    connection.execute('PRAGMA synchronous = OFF')
+    connection.execute(
+        'CREATE TABLE IF NOT EXISTS backed_up_objects ('
+        'key TEXT PRIMARY KEY, version_id TEXT, etag TEXT, '
+        'size INTEGER NOT NULL, backed_up_at REAL NOT NULL'
+        ') WITHOUT ROWID'
+    )
+    connection.commit()
+    return connection
+
+
+def merge_state_rows(connection: Any, rows: List[List[Any]]) -> None:
+    """
+    Merge delta rows into a state index database, keeping the newest per key.
+    
+    Args:
+        connection: Database connection
+        rows: [key, version_id, etag, size, backed_up_at] rows
+    """
+    connection.executemany(
+        'INSERT INTO backed_up_objects VALUES (?, ?, ?, ?, ?) '
+        'ON CONFLICT(key) DO UPDATE SET version_id = excluded.version_id, '
+        'etag = excluded.etag, size = excluded.size, '
+        'backed_up_at = excluded.backed_up_at '
+        'WHERE excluded.backed_up_at > backed_up_objects.backed_up_at',
+        rows
+    )
+
+
+# State index shared across warm invocations, rebuilt if its
+# configuration changes
+_state_index = None
+_state_index_config = None
+
+
+def get_state_index() -> Optional[SQLiteStateIndex]:
+    """
+    Return the state index configured by the environment.
+    
+    The index is off unless STATE_INDEX_ENABLED is set. Its snapshot is
+    kept at STATE_INDEX_KEY in STATE_INDEX_BUCKET (default BACKUP_BUCKET).
+    
+    Returns:
+        SQLiteStateIndex: The shared index, or None if disabled
+        
+    Raises:
+        ValueError: If a setting is malformed
+    """
+    global _state_index, _state_index_config
+    
+    config = (
+        get_bool_env('STATE_INDEX_ENABLED', False),
+        os.environ.get('STATE_INDEX_BUCKET') or os.environ.get('BACKUP_BUCKET'),
+        os.environ.get('STATE_INDEX_KEY') or DEFAULT_STATE_INDEX_KEY,
+        get_float_env('STATE_INDEX_SYNC_SECONDS', DEFAULT_STATE_INDEX_SYNC_SECONDS)
+    )
+    if config == _state_index_config:
+        return _state_index
+    
+    enabled, bucket, key, sync_seconds = config
+    index = None
+    if enabled:
+        if not bucket:
+            raise ValueError("STATE_INDEX_BUCKET or BACKUP_BUCKET must be set")
+        index = SQLiteStateIndex(bucket, key, sync_seconds=sync_seconds)
+    
+    _state_index, _state_index_config = index, config
+    return index
+
+
+def sync_state_index(settings: Dict[str, Any]) -> None:
+    """Upload the state index delta if one is enabled and a sync is due."""
+    if settings['state_index']:
+        settings['state_index'].sync_if_due()
+
+
+def state_index_compact_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """
+    Fold the state index deltas uploaded by backup functions into its snapshot.
+    
+    Backup functions only upload small deltas, so the snapshot is merged
+    and uploaded here, on a schedule and with a timeout of its own,
+    rather than on the event path.
+    
+    Args:
+        event (dict): Scheduled event (contents are ignored)
+        context (object): Lambda context object with runtime information
+        
+    Returns:
+        dict: Response object with statusCode and the number of deltas
+            folded in
+        
+    Raises:
+        ValueError: If STATE_INDEX_ENABLED is not set or a setting is
+            malformed
+    """
+    timer = PhaseTimer()
+    index = get_state_index()
+    if index is None:
+        raise ValueError("STATE_INDEX_ENABLED must be set to compact the state index")
+    
+    compacted = index.compact()
+    timer.lap('index')
+    
+    body = {'deltas': compacted, 'timings': timer.timings()}
+    report_timings('invocation', body['timings'], body)
+    log('INFO', 'state index compaction finished', **body)
+    return {
+        'statusCode': 200,
+        'body': json.dumps(body)
+    }
+
+
+class Notifier:
+    """
+    Publishes per-object notifications, optionally batched and in the
+    background.
+    
+    Unbatched, each message is sent with Publish; batched, messages are
+    grouped into PublishBatch requests of up to ten entries, retrying only
+    the entries SNS reports as failed on its side. When asynchronous, the
+    requests run on background threads so SNS latency overlaps with the
+    copies still in progress, and flush waits for them up to a deadline.
+    
+    Args:
+        topic_arn: ARN of the SNS topic
+        batched: Group messages into PublishBatch requests
+        asynchronous: Send from background threads instead of the caller
+        max_workers: Background threads used when asynchronous
+    """
+    
+    def __init__(
+        self,
+        topic_arn: str,
+        batched: bool,
+        asynchronous: bool = False,
+        max_workers: int = DEFAULT_NOTIFY_WORKERS
+    ):
+        self.topic_arn = topic_arn
+        self.batched = batched
+        self.asynchronous = asynchronous
+        self.max_workers = max_workers
+        self._pending = []
+        self._futures = []
+        self._executor = None
+        self._next_id = 0
+        self._lock = threading.Lock()
+    
+    def publish(self, subject: str, message: str) -> Optional[str]:
+        """
+        Send, queue or dispatch a notification.
+        
+        Args:
+            subject: Email subject line
+            message: Message body
+            
+        Returns:
+            str: SNS message ID, or None if the message was queued or
+                handed to a background thread
+        """
+        if not self.batched:
+            if self.asynchronous:
+                self._submit(1, self._publish_counted, subject, message)
+                return None
+            return self._publish_single(subject, message)
+        
+        with self._lock:
+            self._pending.append({
+                'Id': str(self._next_id),
+                'Subject': subject,
+                'Message': message
+            })
+            self._next_id += 1
+            
+            # Dispatch full batches as they fill so they overlap with copies
+            ready = None
+            if self.asynchronous and len(self._pending) >= SNS_BATCH_MAX_ENTRIES:
+                ready, self._pending = self._pending, []
+        
+        if ready:
+            self._submit(len(ready), self._publish_batch, ready)
+        return None
+    
+    def flush(self, timeout: Optional[float] = None) -> Dict[str, int]:
+        """
+        Publish queued notifications and wait for background sends.
+        
+        Args:
+            timeout: Seconds to wait for background sends, or None to wait
+                until they finish
+            
+        Returns:
+            dict: Number of messages sent, failed, and still in flight
+                when the timeout expired
+        """
+        with self._lock:
+            pending, self._pending = self._pending, []
+        
+        batches = chunk_publish_entries(pending)
+        if batches:
+            log(
+                'DEBUG', 'publishing notification batches',
+                notifications=len(pending),
+                batches=len(batches)
+            )
+        
+        counts = {'sent': 0, 'failed': 0, 'unfinished': 0}
+        
+        for batch in batches:
+            if self.asynchronous:
+                self._submit(len(batch), self._publish_batch, batch)
+            else:
+                sent, failed = self._publish_batch(batch)
+                counts['sent'] += sent
+                counts['failed'] += failed
+        
+        with self._lock:
+            futures, self._futures = self._futures, []
+        
+        if futures:
+            deadline = None if timeout is None else time.monotonic() + timeout
+            for future, size in futures:
+                remaining = None
+                if deadline is not None:
+                    remaining = max(0.0, deadline - time.monotonic())
+                try:
+                    sent, failed = future.result(timeout=remaining)
+                except FutureTimeoutError:
+                    counts['unfinished'] += size
+                    continue
+                except Exception as e:
+                    log('ERROR', 'notification dispatch failed', error=str(e))
+                    sent, failed = 0, size
+                counts['sent'] += sent
+                counts['failed'] += failed
+        
+        if self._executor:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        
+        if batches or futures:
+            log(
+                'WARNING' if counts['failed'] or counts['unfinished'] else 'INFO',
+                'notification dispatch completed',
+                **counts
+            )
+        return counts
+    
+    def _submit(self, size: int, function: Any, *args: Any) -> None:
+        """Run a send of size messages in the background and track it."""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+            self._futures.append((self._executor.submit(function, *args), size))
+    
+    def _publish_single(self, subject: str, message: str) -> str:
+        """Publish one message and return its ID."""
+        response = get_sns_client().publish(
+            TopicArn=self.topic_arn,
+            Subject=subject,
+            Message=message
+        )
+        return response['MessageId']
+    
+    def _publish_counted(self, subject: str, message: str) -> Tuple[int, int]:
+        """Publish one message in the background, returning sent/failed."""
+        self._publish_single(subject, message)
+        return 1, 0
+    
+    def _publish_batch(self, entries: List[Dict[str, str]]) -> Tuple[int, int]:
+        """Publish one batch, retrying entries that failed on SNS's side."""
+        sent = 0
+        remaining = entries
+        
+        for attempt in range(1, SNS_PUBLISH_MAX_ATTEMPTS + 1):
+            try:
+                response = get_sns_client().publish_batch(
+                    TopicArn=self.topic_arn,
+                    PublishBatchRequestEntries=remaining
+                )
+            except Exception as e:
+                log('WARNING', 'publish batch request failed', error=str(e))
+                response = {
+                    'Failed': [
+                        {'Id': entry['Id'], 'SenderFault': False, 'Message': str(e)}
+                        for entry in remaining
+                    ]
+                }
+            
+            sent += len(response.get('Successful', []))
+            failures = response.get('Failed', [])
+            
+            for failure in failures:
+                if failure.get('SenderFault'):
+                    log(
+                        'ERROR', 'notification rejected',
+                        entry_id=failure['Id'],
+                        code=failure.get('Code'),
+                        error=failure.get('Message')
+                    )
+            
+            retry_ids = {f['Id'] for f in failures if not f.get('SenderFault')}
+            remaining = [entry for entry in remaining if entry['Id'] in retry_ids]
+            
+            if not remaining:
+                break
+            if attempt < SNS_PUBLISH_MAX_ATTEMPTS:
+                log('DEBUG', 'retrying notifications', entries=len(remaining))
+                time.sleep(SNS_RETRY_BASE_DELAY * 2 ** (attempt - 1))
+        
+        return sent, len(entries) - sent
+
+
+def flush_timeout(context: Any) -> Optional[float]:
+    """
+    Seconds available for flushing notifications before the Lambda times out.
+    
+    Args:
+        context: Lambda context object, or None outside Lambda
+        
+    Returns:
+        float: Remaining time less a safety margin, or None if unknown
+    """
+    remaining = remaining_seconds(context)
+    if remaining is None:
+        return None
+    return max(0.0, remaining - NOTIFY_FLUSH_MARGIN_SECONDS)
+
+
+def chunk_publish_entries(entries: List[Dict[str, str]]) -> List[List[Dict[str, str]]]:
+    """
+    Split PublishBatch entries into groups within SNS's batch limits.
+    
+    Args:
+        entries: Entries with Id, Subject and Message
+        
+    Returns:
+        list: Groups of at most ten entries and 256 KiB of payload
+    """
+    batches = []
+    current = []
+    current_bytes = 0
+    
+    for entry in entries:
+        size = len(entry['Message'].encode('utf-8'))
+        size += len(entry['Subject'].encode('utf-8'))
+        if current and (
+            len(current) == SNS_BATCH_MAX_ENTRIES
+            or current_bytes + size > SNS_BATCH_MAX_BYTES
+        ):
+            batches.append(current)
+            current = []
+            current_bytes = 0
+        current.append(entry)
+        current_bytes += size
+    
+    if current:
+        batches.append(current)
+    return batches
+
+
+class S3DigestStore:
+    """
+    Digest results buffered in S3 until enough accumulate for a summary.
+    
+    Each invocation writes its results as one small object whose key
+    records when it was written and how many results it holds, so the
+    pending count and age come from a single listing. Whichever container
+    finds the buffer due takes a lock object with a conditional put,
+    publishes everything buffered and deletes what it published, so
+    results survive container recycling and are reported once.
+    
+    Args:
+        bucket: Bucket holding the buffer
+        prefix: Key prefix for buffered results and the lock
+    """
+    
+    def __init__(self, bucket: str, prefix: str):
+        self.bucket = bucket
+        self.results_prefix = f"{prefix}results/"
+        self.lock_key = f"{prefix}flush.lock"
+    
+    def add(self, results: List[Dict[str, Any]]) -> None:
+        """Buffer the results of one invocation."""
+        import uuid
+        
+        entries = [
+            {key: r[key] for key in ('status', 'source', 'size_bytes')}
+            for r in results
+        ]
+        key = (
+            f"{self.results_prefix}{int(time.time() * 1000):013d}-"
+            f"{len(entries)}-{uuid.uuid4().hex}.json"
+        )
+        get_s3_client_for_bucket(self.bucket).put_object(
+            Bucket=self.bucket,
+            Key=key,
+            Body=json.dumps(entries).encode(),
+            ContentType='application/json'
+        )
+    
+    def _pending_keys(self) -> List[str]:
+        client = get_s3_client_for_bucket(self.bucket)
+        return [key for key, _, _ in iter_objects(client, self.bucket, self.results_prefix)]
+    
+    def pending(self) -> Tuple[int, float]:
+        """Return the number of buffered results and the oldest one's age."""
+        count, oldest = 0, None
+        for key in self._pending_keys():
+            written, entries = key[len(self.results_prefix):].split('-')[:2]
+            count += int(entries)
+            oldest = int(written) if oldest is None else min(oldest, int(written))
+        return count, 0.0 if oldest is None else time.time() - oldest / 1000
+    
+    def flush(self, send: Callable[[List[Dict[str, Any]]], None]) -> int:
+        """
+        Pass everything buffered to send, then remove it from the buffer.
+        
+        Nothing is removed if send raises, so the results are sent by a
+        later flush instead.
+        
+        Args:
+            send: Callable publishing the buffered results
+            
+        Returns:
+            int: Number of results sent, or 0 if another container holds
+                the lock
+        """
+        if not self._acquire():
+            log('INFO', 'digest flush already in progress')
+            return 0
+        client = get_s3_client_for_bucket(self.bucket)
+        try:
+            keys = self._pending_keys()
+            results = []
+            for key in keys:
+                response = client.get_object(Bucket=self.bucket, Key=key)
+                results.extend(json.loads(response['Body'].read()))
+            if results:
+                send(results)
+            for start in range(0, len(keys), 1000):
+                client.delete_objects(
+                    Bucket=self.bucket,
+                    Delete={
+                        'Objects': [{'Key': key} for key in keys[start:start + 1000]],
+                        'Quiet': True
+                    }
+                )
+            return len(results)
+        finally:
+            client.delete_object(Bucket=self.bucket, Key=self.lock_key)
+    
+    def _acquire(self) -> bool:
+        """Take the flush lock, replacing it if its holder's lease expired."""
+        from botocore.exceptions import ClientError
+        
+        client = get_s3_client_for_bucket(self.bucket)
+        body = json.dumps({'expires_at': time.time() + DIGEST_FLUSH_LOCK_SECONDS}).encode()
+        conflicts = ('PreconditionFailed', 'ConditionalRequestConflict')
+        try:
+            client.put_object(
+                Bucket=self.bucket, Key=self.lock_key, Body=body, IfNoneMatch='*'
+            )
+            return True
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') not in conflicts:
+                raise
+        
+        try:
+            current = client.get_object(Bucket=self.bucket, Key=self.lock_key)
+        except ClientError:
+            # Released meanwhile; a later invocation will flush
+            return False
+        if json.loads(current['Body'].read()).get('expires_at', 0) > time.time():
+            return False
+        try:
+            client.put_object(
+                Bucket=self.bucket, Key=self.lock_key, Body=body, IfMatch=current['ETag']
+            )
+            return True
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') not in conflicts:
+                raise
+            return False
+
+
+def get_digest_store() -> Optional[S3DigestStore]:
+    """
+    Return the digest buffer configured by the environment.
+    
+    Results are buffered across invocations only when DIGEST_BUFFER_BUCKET
+    is set; otherwise every invocation sends its own digest.
+    
+    Returns:
+        S3DigestStore: The buffer, or None if not configured
+    """
+    bucket = os.environ.get('DIGEST_BUFFER_BUCKET')
+    if not bucket:
+        return None
+    return S3DigestStore(
+        bucket, os.environ.get('DIGEST_BUFFER_PREFIX') or DEFAULT_DIGEST_BUFFER_PREFIX
+    )
+
+
+def notify_batch(
+    results: List[Dict[str, Any]],
+    sns_topic_arn: str,
+    settings: Dict[str, Any],
+    context: Any = None
+) -> None:
+    """
+    Send the notifications for a processed batch.
+    
+    In batched mode the per-object messages queued by process_record are
+    published with PublishBatch. In digest mode a summary is published for
+    every invocation, unless DIGEST_BUFFER_BUCKET is set, in which case
+    results are buffered there and flush_digest publishes them together.
+    In per_object mode process_record has already notified each object.
+    
+    Background sends are waited for until shortly before the invocation
+    would time out, as reported by the Lambda context.
+    
+    Args:
+        results: Per-record results from process_record
+        sns_topic_arn: ARN of the SNS topic for notifications
+        settings: Copy settings from load_copy_settings
+        context: Lambda context object, or None to wait without a deadline
+    """
+    settings['notifier'].flush(timeout=flush_timeout(context))
+    
+    if settings['notification_mode'] != 'digest':
+        return
+    
+    # Duplicates were already reported when first processed
+    reportable = [r for r in results if r['status'] != 'duplicate']
+    store = get_digest_store()
+    
+    try:
+        if store is None:
+            if reportable:
+                publish_digest(reportable, sns_topic_arn, settings)
+            return
+        if reportable:
+            store.add(reportable)
+        flush_digest(store, sns_topic_arn, settings)
+    except Exception as e:
+        log('ERROR', 'digest notification failed', results=len(reportable), error=str(e))
+
+
+def flush_digest(
+    store: S3DigestStore,
+    sns_topic_arn: str,
+    settings: Dict[str, Any]
+) -> int:
+    """
+    Publish the buffered digest if it is due.
+    
+    The digest is due once DIGEST_FLUSH_THRESHOLD results are buffered or
+    the oldest has waited DIGEST_MAX_AGE_SECONDS.
+    
+    Args:
+        store: Digest buffer
+        sns_topic_arn: ARN of the SNS topic for notifications
+        settings: Copy settings from load_copy_settings
+        
+    Returns:
+        int: Number of results published
+    """
+    buffered, age = store.pending()
+    if not buffered:
+        return 0
+    if (buffered < settings['digest_flush_threshold']
+            and age < settings['digest_max_age_seconds']):
+        log('DEBUG', 'digest flush deferred', buffered=buffered, age_seconds=round(age, 1))
+        return 0
+    return store.flush(lambda digest: publish_digest(digest, sns_topic_arn, settings))
+
+
+def publish_digest(
+    digest: List[Dict[str, Any]],
+    sns_topic_arn: str,
+    settings: Dict[str, Any]
+) -> None:
+    """
+    Publish one digest notification summarizing results.
+    
+    Args:
+        digest: Results to summarize
+        sns_topic_arn: ARN of the SNS topic for notifications
+        settings: Copy settings from load_copy_settings
+    """
+    copied = sum(1 for r in digest if r['status'] == 'success')
+    sns_response = get_sns_client().publish(
+        TopicArn=sns_topic_arn,
+        Subject=f'AWS Backup Digest - {copied} File(s) Replicated',
+        Message=format_digest_message(digest, settings['digest_max_keys'])
+    )
+    log(
+        'INFO', 'digest sent',
+        results=len(digest),
+        message_id=sns_response['MessageId']
+    )
+
+
+def digest_flush_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """
+    Publish buffered digest results that have waited long enough.
+    
+    Buffered results are otherwise only flushed when a later backup
+    invocation finds them due, so a quiet bucket could leave them waiting
+    indefinitely. Run this on a schedule (for example every
+    DIGEST_MAX_AGE_SECONDS) to bound how late a digest can be.
+    
+    Args:
+        event (dict): Scheduled event (contents are ignored)
+        context (object): Lambda context object with runtime information
+        
+    Returns:
+        dict: Response object with statusCode and the number of results
+            published
+        
+    Raises:
+        ValueError: If SNS_TOPIC_ARN or DIGEST_BUFFER_BUCKET is not set
+    """
+    sns_topic_arn = os.environ.get('SNS_TOPIC_ARN')
+    if not sns_topic_arn:
+        raise ValueError("SNS_TOPIC_ARN environment variable not set")
+    store = get_digest_store()
+    if store is None:
+        raise ValueError("DIGEST_BUFFER_BUCKET environment variable not set")
+    
+    published = flush_digest(store, sns_topic_arn, load_copy_settings())
+    log('INFO', 'digest flush finished', results=published)
+    return {
+        'statusCode': 200,
+        'body': json.dumps({'published': published})
+    }
+
+
+def format_digest_message(
+    results: List[Dict[str, Any]],
+    max_keys: int
+) -> str:
+    """
+    Format a digest notification summarizing many backup results.
+    
+    Args:
+        results: Per-record results to summarize
+        max_keys: Maximum number of files listed individually
+        
+    Returns:
+        str: Formatted digest message
+    """
+    copied = [r for r in results if r['status'] == 'success']
+    skipped = [r for r in results if r['status'] == 'skipped']
+    failed = [r for r in results if r['status'] == 'failed']
+    total_bytes = sum(r['size_bytes'] for r in copied)
+    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S UTC')
+    
+    lines = [
+        f"  [{r['status'].upper()}] {r['source']} ({r['size_bytes']:,} bytes)"
+        for r in results[:max_keys]
+    ]
+    if len(results) > max_keys:
+        lines.append(f"  ... and {len(results) - max_keys} more")
+    file_list = '\n'.join(lines)
+    
+    return f"""
+BACKUP DIGEST
+
+Summary:
+--------
+Files Copied: {len(copied)}
+Files Skipped (unchanged): {len(skipped)}
+Files Failed: {len(failed)}
+Total Copied: {total_bytes:,} bytes ({total_bytes / (1024 * 1024):.2f} MB)
+Timestamp: {timestamp}
+
+Files:
+------
+{file_list}
+
+Failed files were also reported in individual failure notifications.
+
+---
+Automated AWS S3 Backup System
+"""
+
+
+def format_reconcile_message(
+    source_bucket: str,
+    backup_bucket: str,
+    summary: Dict[str, Any]
+) -> str:
+    """
+    Format the notification sent after a reconciliation run.
+    
+    Args:
+        source_bucket: Bucket that was reconciled
+        backup_bucket: Backup S3 bucket name
+        summary: Counts from reconcile_handler
+        
+    Returns:
+        str: Formatted reconciliation message
+    """
+    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S UTC')
+    copied_bytes = summary.get('copied_bytes', 0)
+    failed_list = '\n'.join(
+        f"  {r['source']}: {r['error']}" for r in summary['failures']
+    ) or '  None'
+    
+    return f"""
+BACKUP RECONCILIATION
+
+Summary:
+--------
+Source Bucket: {source_bucket}
+Backup Bucket: {backup_bucket}
+Objects Checked: {summary.get('source_objects', 0)}
+Missing From Backup: {summary.get('missing', 0)}
+Stale In Backup: {summary.get('stale', 0)}
+ETag Differs, Checked: {summary.get('unverified', 0)}
+Files Copied: {summary.get('copied', 0)}
+Files Already Current: {summary.get('skipped', 0)}
+Files Failed: {summary.get('failed', 0)}
+Total Copied: {copied_bytes:,} bytes ({copied_bytes / (1024 * 1024):.2f} MB)
+Timestamp: {timestamp}
+
+Failed Files:
+-------------
+{failed_list}
+
+Objects missing from the backup usually mean S3 events were not
+delivered. Check the source bucket's event notification configuration.
+
+---
+Automated AWS S3 Backup System
+"""
+
+
+def format_backfill_message(backup_bucket: str, checkpoint: Dict[str, Any]) -> str:
+    """
+    Format the notification sent when a backfill finishes.
+    
+    Args:
+        backup_bucket: Backup S3 bucket name
+        checkpoint: Final backfill checkpoint
+        
+    Returns:
+        str: Formatted backfill message
+    """
+    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S UTC')
+    copied_bytes = checkpoint['copied_bytes']
+    failed_list = '\n'.join(
+        f"  {key}" for key in checkpoint['failed_keys']
+    ) or '  None'
+    
+    return f"""
+BACKUP BACKFILL COMPLETE
+
+Summary:
+--------
+Source: s3://{checkpoint['source_bucket']}/{checkpoint['prefix']}
+Backup Bucket: {backup_bucket}
+Invocations: {checkpoint['invocation'] + 1}
+Objects Listed: {checkpoint['listed']}
+Files Copied: {checkpoint['copied']}
+Files Already Current: {checkpoint['skipped']}
+Files Failed: {checkpoint['failed']}
+Total Copied: {copied_bytes:,} bytes ({copied_bytes / (1024 * 1024):.2f} MB)
+Timestamp: {timestamp}
+
+Failed Files:
+-------------
+{failed_list}
+
+Failed files can be retried by running reconciliation.
+
+---
+Automated AWS S3 Backup System
+"""
+
+
+def format_success_message(
+    object_key: str,
+    file_size: int,
+    source_bucket: str,
+    backup_bucket: str,
+    timestamp: str,
+    skipped: bool = False
+) -> str:
+    """
+    Format a success notification message.
+    
+    Args:
+        object_key: Name of the backed up file
+        file_size: Size of the file in bytes
+        source_bucket: Source S3 bucket name
+        backup_bucket: Backup S3 bucket name
+        timestamp: Timestamp of the operation
+        skipped: True if the copy was skipped because the backup was current
+        
+    Returns:
+        str: Formatted success message
+    """
+    file_size_mb = file_size / (1024 * 1024)
+    
+    if skipped:
+        status = "SKIPPED (backup already up to date)"
+        summary = (
+            "The backup region already holds an identical copy of this file,\n"
+            "so no data was transferred."
+        )
+    else:
+        status = "SUCCESS"
+        summary = (
+            "Your file has been successfully replicated to the backup region.\n"
+            "This provides protection against regional failures and data loss."
+        )
+    
+    return f"""
+BACKUP OPERATION SUCCESSFUL
+
+File Details:
+-------------
+File Name: {object_key}
+File Size: {file_size:,} bytes ({file_size_mb:.2f} MB)
+
+Source Location:
+---------------
+Bucket: {source_bucket}
+Region: us-east-1 (N. Virginia)
+
+Backup Location:
+---------------
+Bucket: {backup_bucket}
+Region: us-west-2 (Oregon)
+
+Operation Details:
+-----------------
+Status: {status}
+Timestamp: {timestamp}
+Encryption: AES256 (Server-side)
+
+{summary}
+
+---
+Automated AWS S3 Backup System
+"""
+
+
+def format_failure_message(
+    error_msg: str,
+    error_type: str,
+    object_key: str,
+    source_bucket: str,
+    backup_bucket: str
+) -> str:
+    """
+    Format a failure notification message.
+    
+    Args:
+        error_msg: Error message describing the failure
+        error_type: Type of exception that occurred
+        object_key: Name of the file that failed to back up
+        source_bucket: Source S3 bucket name
+        backup_bucket: Backup S3 bucket name
+        
+    Returns:
+        str: Formatted failure message
+    """
+    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S UTC')
+    
+    return f"""
+BACKUP OPERATION FAILED - ACTION REQUIRED
+
+Error Details:
+-------------
+Error Type: {error_type}
+Error Message: {error_msg}
+Timestamp: {timestamp}
+
+File Information:
+----------------
+File Name: {object_key}
+Source Bucket: {source_bucket}
+Backup Bucket: {backup_bucket}
+
+Troubleshooting Steps:
+---------------------
+1. Check CloudWatch Logs for detailed error information
+2. Verify IAM role permissions (S3 read/write, SNS publish)
+3. Confirm backup bucket exists and is accessible
+4. Verify environment variables are configured correctly
+5. Check Lambda function timeout settings
+
+CloudWatch Log Group:
+--------------------
+/aws/lambda/S3AutoBackupFunction
+
+For immediate assistance, review the Lambda function logs
+in CloudWatch or contact your cloud administrator.
+
+---
+Automated AWS S3 Backup System
+"""
+
+
+def send_failure_notification(
+    sns_topic_arn: str,
+    error_msg: str,
+    error_category: str
+) -> None:
+    """
+    Send a failure notification via SNS.
+    
+    Args:
+        sns_topic_arn: ARN of the SNS topic
+        error_msg: Error message to include
+        error_category: Category of the error
+    """
+    if not sns_topic_arn:
+        log('WARNING', 'failure notification skipped, SNS topic ARN not available')
+        return
+    
+    try:
+        message = f"""
+BACKUP SYSTEM ERROR
+
+Category: {error_category}
+Error: {error_msg}
+Timestamp: {datetime.now().strftime('%Y-%m-%d %H:%M:%S UTC')}
+
+Please check CloudWatch logs for detailed information.
+"""
+        
+        get_sns_client().publish(
+            TopicArn=sns_topic_arn,
+            Subject=f'AWS Backup System Error - {error_category}',
+            Message=message
+        )
+    except Exception as e:
+        log('ERROR', 'error notification failed', error=str(e))
\ No newline at end of file
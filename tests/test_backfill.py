@@ -0,0 +1,138 @@
+"""
+Tests for resumable backfills and their self-invocation.
+
+Run with:
+    python -m unittest discover tests
+
+"""
+
+import json
+import os
+import sys
+import unittest
+from typing import Any, Dict, List
+from unittest import mock
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+from local_aws import LocalS3, LocalSNS  # noqa: E402
+
+import lambda_function  # noqa: E402
+
+ENVIRONMENT = {
+    'BACKUP_BUCKET': 'test-backup',
+    'SNS_TOPIC_ARN': 'arn:aws:sns:us-east-1:000000000000:test',
+    'SOURCE_BUCKET': 'test-source',
+    'BACKFILL_PAGE_SIZE': '10',
+    'BACKFILL_SAFETY_SECONDS': '30',
+    'IDEMPOTENCY_ENABLED': 'false',
+    'METADATA_CACHE_ENABLED': 'false',
+    'METRICS_ENABLED': 'false',
+    'LOG_LEVEL': 'ERROR'
+}
+
+OBJECTS = 35
+
+
+class FakeContext:
+    """Lambda context reporting a fixed time left for a number of checks."""
+
+    invoked_function_arn = 'arn:aws:lambda:us-east-1:000000000000:function:backfill'
+
+    def __init__(self, remaining_seconds: List[float]):
+        self.remaining_seconds = list(remaining_seconds)
+
+    def get_remaining_time_in_millis(self) -> int:
+        if len(self.remaining_seconds) > 1:
+            return int(self.remaining_seconds.pop(0) * 1000)
+        return int(self.remaining_seconds[0] * 1000)
+
+
+class FakeLambda:
+    """Records asynchronous invocations instead of making them."""
+
+    def __init__(self) -> None:
+        self.payloads: List[Dict[str, Any]] = []
+
+    def invoke(self, **kwargs: Any) -> Dict[str, Any]:
+        self.payloads.append(json.loads(kwargs['Payload']))
+        return {'StatusCode': 202}
+
+
+class BackfillTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        patcher = mock.patch.dict(os.environ, ENVIRONMENT)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.s3 = LocalS3(request_latency=0, time_scale=0)
+        self.sns = LocalSNS(request_latency=0, time_scale=0)
+        self.lambda_client = FakeLambda()
+        for name, client in (
+            ('s3_client', self.s3),
+            ('sns_client', self.sns),
+            ('lambda_client', self.lambda_client)
+        ):
+            patcher = mock.patch.object(lambda_function, name, client)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        lambda_function._regional_s3_clients.clear()
+
+        for n in range(OBJECTS):
+            self.s3.add_object('test-source', f"object-{n:03d}", 1024)
+
+    def backfill(self, event: Dict[str, Any], context: FakeContext) -> Dict[str, Any]:
+        response = lambda_function.backfill_handler(event, context)
+        self.assertEqual(response['statusCode'], 200)
+        return json.loads(response['body'])
+
+    def backed_up(self) -> int:
+        # Checkpoints are kept under a dot-prefix in the backup bucket
+        return sum(
+            1 for bucket, key in self.s3.objects
+            if bucket == 'test-backup' and not key.startswith('.')
+        )
+
+    def test_resumes_from_checkpoint_in_next_invocation(self) -> None:
+        # Two pages fit, then the time left drops below the safety margin
+        body = self.backfill({}, FakeContext([300, 300, 10]))
+
+        self.assertEqual(body['status'], 'running')
+        self.assertEqual(body['pages'], 2)
+        self.assertEqual(body['copied'], 20)
+        self.assertEqual(len(self.lambda_client.payloads), 1)
+
+        copies = self.s3.calls['copy_object']
+        body = self.backfill(self.lambda_client.payloads[0], FakeContext([300]))
+
+        self.assertEqual(body['status'], 'complete')
+        self.assertEqual(body['pages'], 4)
+        self.assertEqual(body['listed'], OBJECTS)
+        self.assertEqual(body['copied'], OBJECTS)
+        # Only the objects after the checkpoint were copied
+        self.assertEqual(self.s3.calls['copy_object'] - copies, OBJECTS - 20)
+        self.assertEqual(self.backed_up(), OBJECTS)
+        self.assertEqual(len(self.lambda_client.payloads), 1)
+
+    def test_short_timeout_still_copies_a_page_per_invocation(self) -> None:
+        # Less time left than BACKFILL_SAFETY_SECONDS from the start
+        event: Dict[str, Any] = {}
+        for invocation in range(1, 5):
+            body = self.backfill(event, FakeContext([20]))
+            self.assertEqual(body['pages'], invocation)
+            if body['status'] == 'complete':
+                break
+            event = self.lambda_client.payloads[-1]
+
+        self.assertEqual(body['status'], 'complete')
+        self.assertEqual(body['copied'], OBJECTS)
+        self.assertEqual(self.backed_up(), OBJECTS)
+        self.assertEqual(len(self.lambda_client.payloads), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,174 @@
+"""
+Tests for claiming, releasing and recording events in the idempotency stores.
+
+Run with:
+    python -m unittest discover tests
+
+"""
+
+import os
+import sys
+import threading
+import time
+import unittest
+from typing import Any, Dict
+from unittest import mock
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+from local_aws import LocalDynamoDB, LocalS3, LocalSNS  # noqa: E402
+
+import lambda_function  # noqa: E402
+
+ENVIRONMENT = {
+    'BACKUP_BUCKET': 'test-backup',
+    'SNS_TOPIC_ARN': 'arn:aws:sns:us-east-1:000000000000:test',
+    'METADATA_CACHE_ENABLED': 'false',
+    'METRICS_ENABLED': 'false',
+    'SKIP_UNCHANGED': 'false',
+    'LOG_LEVEL': 'ERROR'
+}
+
+TABLE = 'test-idempotency'
+
+
+def s3_record(key: str, sequencer: str) -> Dict[str, Any]:
+    return {
+        'eventSource': 'aws:s3',
+        'eventName': 'ObjectCreated:Put',
+        's3': {
+            'bucket': {'name': 'test-source'},
+            'object': {'key': key, 'size': 1024, 'sequencer': sequencer}
+        }
+    }
+
+
+class IdempotencyTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        patcher = mock.patch.dict(os.environ, ENVIRONMENT)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.s3 = LocalS3(request_latency=0, time_scale=0)
+        self.sns = LocalSNS(request_latency=0, time_scale=0)
+        for name, client in (('s3_client', self.s3), ('sns_client', self.sns)):
+            patcher = mock.patch.object(lambda_function, name, client)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        lambda_function._regional_s3_clients.clear()
+
+        self.dynamodb = LocalDynamoDB(request_latency=0, time_scale=0)
+        self.s3.add_object('test-source', 'a.txt', 1024)
+
+    def store(self) -> lambda_function.DynamoDBIdempotencyStore:
+        # Each store stands in for a separate container with its own cache
+        return lambda_function.DynamoDBIdempotencyStore(
+            TABLE, 3600,
+            cache=lambda_function.MemoryIdempotencyStore(100),
+            client=self.dynamodb
+        )
+
+    def process(self, record: Dict[str, Any], store: Any) -> str:
+        settings = lambda_function.load_copy_settings()
+        settings['idempotency_store'] = store
+        settings['notifier'] = lambda_function.Notifier(
+            ENVIRONMENT['SNS_TOPIC_ARN'], batched=False
+        )
+        return lambda_function.process_record(
+            record, ENVIRONMENT['BACKUP_BUCKET'], ENVIRONMENT['SNS_TOPIC_ARN'], settings
+        )['status']
+
+    def item(self, key: str) -> Dict[str, Any]:
+        return self.dynamodb.tables.get(TABLE, {}).get(f"idempotency_key={key}")
+
+    def put_item(self, key: str, status: str, expires_at: int) -> None:
+        self.dynamodb.put_item(TableName=TABLE, Item={
+            'idempotency_key': {'S': key},
+            'status': {'S': status},
+            'expires_at': {'N': str(expires_at)}
+        })
+
+    def test_concurrent_duplicate_is_not_copied(self) -> None:
+        record = s3_record('a.txt', '01')
+        first, second = self.store(), self.store()
+
+        # Another container holds the claim while this delivery arrives
+        self.assertTrue(first.claim('test-source/a.txt//01'))
+        self.assertEqual(self.process(record, second), 'duplicate')
+        self.assertNotIn('copy_object', self.s3.calls)
+
+        first.mark_processed('test-source/a.txt//01')
+        self.assertEqual(self.item('test-source/a.txt//01')['status']['S'], 'processed')
+        self.assertEqual(self.process(record, second), 'duplicate')
+
+    def test_concurrent_deliveries_copy_once(self) -> None:
+        self.s3.time_scale = 0.05
+        statuses = []
+        threads = [
+            threading.Thread(
+                target=lambda store: statuses.append(
+                    self.process(s3_record('a.txt', '02'), store)
+                ),
+                args=(self.store(),)
+            )
+            for _ in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(statuses), ['duplicate'] * 3 + ['success'])
+        self.assertEqual(self.s3.calls['copy_object'], 1)
+
+    def test_failed_copy_releases_claim(self) -> None:
+        record = s3_record('late.txt', '03')
+        store = self.store()
+
+        self.assertEqual(self.process(record, store), 'failed')
+        self.assertIsNone(self.item('test-source/late.txt//03'))
+
+        # The redelivery, once the object exists, is processed
+        self.s3.add_object('test-source', 'late.txt', 1024)
+        self.assertEqual(self.process(record, self.store()), 'success')
+        self.assertIn(('test-backup', 'late.txt'), self.s3.objects)
+
+    def test_expired_claim_is_taken_over(self) -> None:
+        self.put_item('test-source/a.txt//04', 'processing', int(time.time()) - 1)
+
+        self.assertEqual(self.process(s3_record('a.txt', '04'), self.store()), 'success')
+        self.assertEqual(self.item('test-source/a.txt//04')['status']['S'], 'processed')
+
+    def test_live_claim_is_not_taken_over(self) -> None:
+        self.put_item('test-source/a.txt//05', 'processing', int(time.time()) + 600)
+
+        self.assertEqual(self.process(s3_record('a.txt', '05'), self.store()), 'duplicate')
+
+    def test_processed_item_is_never_overwritten(self) -> None:
+        now = int(time.time())
+        for sequencer, expires_at in (('06', now + 600), ('07', now - 1)):
+            key = f"test-source/a.txt//{sequencer}"
+            self.put_item(key, 'processed', expires_at)
+
+            self.assertFalse(self.store().claim(key))
+            self.assertEqual(self.item(key)['status']['S'], 'processed')
+            self.assertEqual(self.item(key)['expires_at']['N'], str(expires_at))
+
+    def test_memory_store_claims_within_a_container(self) -> None:
+        store = lambda_function.MemoryIdempotencyStore(100)
+
+        self.assertTrue(store.claim('event'))
+        self.assertFalse(store.claim('event'))
+        store.release('event')
+        self.assertTrue(store.claim('event'))
+        store.mark_processed('event')
+        self.assertFalse(store.claim('event'))
+        self.assertTrue(store.is_processed('event'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,153 @@
+"""
+Tests for SQS batch unwrapping and partial batch failure reporting.
+
+Run with:
+    python -m unittest discover tests
+
+"""
+
+import json
+import os
+import sys
+import unittest
+from typing import Any, Dict, List
+from unittest import mock
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+from local_aws import LocalS3, LocalSNS  # noqa: E402
+
+import lambda_function  # noqa: E402
+
+ENVIRONMENT = {
+    'BACKUP_BUCKET': 'test-backup',
+    'SNS_TOPIC_ARN': 'arn:aws:sns:us-east-1:000000000000:test',
+    'IDEMPOTENCY_ENABLED': 'false',
+    'METADATA_CACHE_ENABLED': 'false',
+    'METRICS_ENABLED': 'false',
+    'SKIP_UNCHANGED': 'false',
+    'LOG_LEVEL': 'ERROR'
+}
+
+
+def s3_record(key: str, size: int = 1024) -> Dict[str, Any]:
+    return {
+        'eventSource': 'aws:s3',
+        'eventName': 'ObjectCreated:Put',
+        's3': {
+            'bucket': {'name': 'test-source'},
+            'object': {'key': key, 'size': size}
+        }
+    }
+
+
+def sqs_message(message_id: str, body: Any) -> Dict[str, Any]:
+    return {
+        'messageId': message_id,
+        'eventSource': 'aws:sqs',
+        'body': body if isinstance(body, str) else json.dumps(body)
+    }
+
+
+class SQSBatchTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        patcher = mock.patch.dict(os.environ, ENVIRONMENT)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.s3 = LocalS3(request_latency=0, time_scale=0)
+        self.sns = LocalSNS(request_latency=0, time_scale=0)
+        for name, client in (('s3_client', self.s3), ('sns_client', self.sns)):
+            patcher = mock.patch.object(lambda_function, name, client)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        lambda_function._regional_s3_clients.clear()
+
+        for key in ('a.txt', 'b.txt', 'c.txt'):
+            self.s3.add_object('test-source', key, 1024)
+
+    def handle(self, messages: List[Dict[str, Any]]) -> Dict[str, Any]:
+        response = lambda_function.lambda_handler({'Records': messages}, None)
+        self.assertEqual(response['statusCode'], 200)
+        return response
+
+    def failed_ids(self, response: Dict[str, Any]) -> List[str]:
+        return [failure['itemIdentifier'] for failure in response['batchItemFailures']]
+
+    def test_unwraps_every_record_of_every_message(self) -> None:
+        response = self.handle([
+            sqs_message('m1', {'Records': [s3_record('a.txt'), s3_record('b.txt')]}),
+            sqs_message('m2', {'Records': [s3_record('c.txt')]})
+        ])
+
+        self.assertEqual(self.failed_ids(response), [])
+        for key in ('a.txt', 'b.txt', 'c.txt'):
+            self.assertIn(('test-backup', key), self.s3.objects)
+        body = json.loads(response['body'])
+        self.assertEqual(body['messages_processed'], 2)
+        self.assertEqual(body['records_succeeded'], 3)
+
+    def test_test_event_without_records_succeeds(self) -> None:
+        response = self.handle([
+            sqs_message('m1', {'Service': 'Amazon S3', 'Event': 's3:TestEvent'})
+        ])
+
+        self.assertEqual(self.failed_ids(response), [])
+
+    def test_only_message_with_failed_record_is_reported(self) -> None:
+        response = self.handle([
+            sqs_message('m1', {'Records': [s3_record('a.txt')]}),
+            sqs_message('m2', {'Records': [s3_record('b.txt'), s3_record('missing.txt')]}),
+            sqs_message('m3', {'Records': [s3_record('c.txt')]})
+        ])
+
+        self.assertEqual(self.failed_ids(response), ['m2'])
+        self.assertIn(('test-backup', 'b.txt'), self.s3.objects)
+        self.assertEqual(json.loads(response['body'])['messages_failed'], 1)
+
+    def test_malformed_bodies_fail_only_their_message(self) -> None:
+        response = self.handle([
+            sqs_message('invalid-json', '{not json'),
+            sqs_message('string', '"hello"'),
+            sqs_message('list', [s3_record('b.txt')]),
+            sqs_message('null', 'null'),
+            sqs_message('records-not-list', {'Records': {'key': 'b.txt'}}),
+            sqs_message('valid', {'Records': [s3_record('a.txt')]})
+        ])
+
+        self.assertEqual(self.failed_ids(response), [
+            'invalid-json', 'string', 'list', 'null', 'records-not-list'
+        ])
+        self.assertIn(('test-backup', 'a.txt'), self.s3.objects)
+        self.assertNotIn(('test-backup', 'b.txt'), self.s3.objects)
+
+    def test_worklist_batches_stay_within_sqs_limits(self) -> None:
+        # Maximum-length keys that URL-encode to three bytes per character
+        records = [
+            lambda_function.listed_object_record(
+                'test-source', f"{n:04d}" + '\u00e9' * 510, 1024, '"etag"'
+            )
+            for n in range(300)
+        ]
+
+        batches = lambda_function.chunk_worklist(records)
+
+        for bodies in batches:
+            self.assertLessEqual(len(bodies), lambda_function.SQS_BATCH_MAX_ENTRIES)
+            self.assertLessEqual(
+                sum(len(body.encode('utf-8')) for body in bodies),
+                lambda_function.SQS_BATCH_MAX_BYTES
+            )
+        self.assertEqual(
+            [record for bodies in batches for body in bodies
+             for record in json.loads(body)['Records']],
+            records
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()